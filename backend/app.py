@@ -1,19 +1,31 @@
-import base64
+import json
+import os
 import time
-import cv2
-import numpy as np
-import face_recognition
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from io import BytesIO
-from PIL import Image
+from flask_sock import Sock, ConnectionClosed
 
 from faces_recognition.hnsw_manager import FaceSearchEngine
+from faces_recognition.pipeline import EncoderPool, EncoderBusyError
+from faces_recognition import face_tracker, metrics
+from faces_recognition.face_tracker import FaceTracker, TrackerRegistry
+
+# msgpack là tuỳ chọn: không cài thì response nhị phân quay về JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Body là bytes ảnh gửi thẳng (không base64, không JSON)
+RAW_IMAGE_MIMETYPES = {"image/jpeg", "image/png", "application/octet-stream"}
+MSGPACK_MIMETYPE = "application/x-msgpack"
 
 # --- CẤU HÌNH SERVER ---
 app = Flask(__name__)
 # Cho phép Frontend từ mọi nguồn (localhost, deploy) gọi vào
 CORS(app, resources={r"/*": {"origins": "*"}})
+# WebSocket cho luồng webcam (/ws_recognize_frame)
+sock = Sock(app)
 
 # --- KHỞI ĐỘNG HNSW ---
 print("[INFO] Dang khoi dong Server va nap du lieu...")
@@ -26,98 +38,208 @@ try:
 except Exception as e:
     print(f"[ERROR] LOI NGHIEM TRONG: Khong the khoi dong HNSW. Chi tiet: {e}")
 
+# Detect + encode khuôn mặt (CPU nặng) chạy trong pool tiến trình riêng, không chặn
+# luồng xử lý request; hàng đợi có giới hạn, đầy thì trả 503
+encoder_pool = EncoderPool()
+# Tracking khuôn mặt theo phiên webcam (HTTP: ?session=<id>; WebSocket: mỗi kết nối một phiên)
+trackers = TrackerRegistry()
 
-# ----------------- HÀM BRUTE-FORCE -----------------
-def brute_force_search(query_vector, threshold=0.5):
-    """
-    Tìm kiếm brute-force trên MongoDB:
-    - Duyệt tất cả feature_vector
-    - Tính khoảng cách L2
-    - Lấy doc có distance nhỏ nhất
-    """
-    collection = search_engine.collection  # đã cấu hình sẵn trong FaceSearchEngine
-    cursor = collection.find({"feature_vector": {"$exists": True}})
 
-    best_doc = None
-    best_dist = None
+# --- ĐO THỜI GIAN REQUEST (GET /metrics) ---
+@app.before_request
+def start_timer():
+    g.start_time = time.time()
 
-    q = np.array(query_vector, dtype=np.float32)
 
-    for doc in cursor:
-        vec = doc.get("feature_vector")
-        if not isinstance(vec, list):
-            continue
-
-        v = np.array(vec, dtype=np.float32)
-        if v.shape[0] != q.shape[0]:
-            continue
+@app.after_request
+def record_request(response):
+    # Kết nối WebSocket tự ghi từng frame, không tính cả kết nối là một request
+    if request.environ.get("HTTP_UPGRADE", "").lower() != "websocket" and "start_time" in g:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(endpoint, response.status_code, (time.time() - g.start_time) * 1000,
+                                g.get("timings"), g.get("faces"))
+    return response
 
-        d = np.linalg.norm(q - v)
 
-        if best_dist is None or d < best_dist:
-            best_dist = d
-            best_doc = doc
+# ----------------- HÀM BRUTE-FORCE -----------------
+def brute_force_search(query_vectors, **search_params):
+    """
+    Tìm kiếm brute-force (kết quả chính xác, dùng làm baseline):
+    - Tính khoảng cách L2 từ tất cả khuôn mặt truy vấn tới toàn bộ vector
+      trong bộ nhớ bằng một phép nhân ma trận (không quét MongoDB mỗi request)
+    - Mỗi khuôn mặt lấy vector có distance nhỏ nhất
+    """
+    return search_engine.exact_search(query_vectors, **search_params)
 
-    if best_doc is None or best_dist is None:
-        return {"status": "unknown", "distance": None, "info": {}}
 
-    status = "found" if best_dist <= threshold else "unknown"
+def search_all_faces(face_encodings, mode, search_params):
+    """
+    Tìm kiếm toàn bộ khuôn mặt của một request trong một lần gọi
+    (HNSW: một lần knn_query cho cả batch; brute-force: một phép nhân ma trận).
+    Trả về list kết quả theo đúng thứ tự face_encodings.
+    """
+    if mode == "bruteforce":
+        return brute_force_search(face_encodings, **search_params)
+    return search_engine.search_faces(face_encodings, **search_params)
 
-    info = {
-        "MSSV": best_doc.get("MSSV", "Unknown"),
-        "Ten": best_doc.get("Ten", "Unknown"),
-    }
 
-    return {
-        "status": status,
-        "distance": float(best_dist),
-        "info": info,
-    }
+def parse_search_params(args):
+    """
+    Đọc tham số tìm kiếm tuỳ chọn từ query string:
+    ?k=5&threshold=0.5&margin=0.05 (không truyền thì dùng mặc định của server)
+    Raise ValueError nếu giá trị không hợp lệ.
+    """
+    params = {}
+    if args.get("k"):
+        params["k"] = int(args["k"])
+        if not 1 <= params["k"] <= 100:
+            raise ValueError("k phai nam trong khoang [1, 100]")
+    for name in ("threshold", "margin"):
+        if args.get(name):
+            params[name] = float(args[name])
+            if params[name] < 0:
+                raise ValueError(f"{name} phai >= 0")
+    return params
+
+
+def parse_output_options(args, accept="", raw_upload=False):
+    """
+    Đọc tuỳ chọn định dạng kết quả:
+    - ?crops=base64|jpeg|none: ảnh cắt khuôn mặt dạng data URL, bytes JPEG (chỉ với
+      msgpack) hoặc không trả (chỉ có box). Mặc định base64, riêng upload nhị phân là none
+    - ?format=msgpack hoặc header Accept: application/x-msgpack -> trả msgpack
+    Output: (crop_format, use_msgpack), raise ValueError nếu giá trị không hợp lệ.
+    """
+    crops = (args.get("crops") or ("none" if raw_upload else "base64")).lower()
+    if crops in {"none", "box", "boxes"}:
+        crop_format = None
+    elif crops in {"base64", "jpeg"}:
+        crop_format = crops
+    else:
+        raise ValueError("crops phai la base64, jpeg hoac none")
+
+    fmt = (args.get("format") or "").lower()
+    if fmt not in {"", "json", "msgpack"}:
+        raise ValueError("format phai la json hoac msgpack")
+    use_msgpack = msgpack is not None and (fmt == "msgpack" or (not fmt and MSGPACK_MIMETYPE in (accept or "")))
+
+    # JSON không chứa được bytes: ảnh cắt JPEG chuyển về base64
+    if crop_format == "jpeg" and not use_msgpack:
+        crop_format = "base64"
+    return crop_format, use_msgpack
+
+
+def encode_result(payload, use_msgpack):
+    """Đóng gói kết quả thành bytes msgpack hoặc chuỗi JSON"""
+    if use_msgpack:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload)
+
+
+def result_response(payload, use_msgpack, status=200):
+    t = time.time()
+    if use_msgpack:
+        response = Response(encode_result(payload, True), status=status, mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(payload)
+        response.status_code = status
+    # Thời gian từng bước của request, after_request ghi vào /metrics
+    g.timings = dict(payload.get("timings", {}), serialize_ms=(time.time() - t) * 1000)
+    g.faces = len(payload.get("faces", []))
+    return response
+
+
+def busy_response(e):
+    """Hàng đợi encode đầy / frame cũ -> 503, client gửi lại (frame webcam kế tiếp) sau"""
+    response = jsonify({"error": f"Server dang ban: {e}", "dropped": True})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+def build_face_results(search_results, detection, mode, tracked=None):
+    """Ghép kết quả tìm kiếm với vị trí / ảnh cắt của từng khuôn mặt thành JSON trả về"""
+    results = []
+    crops = detection.get("crops") or []
+    for i, search_result in enumerate(search_results):
+        if not search_result:
+            continue
 
+        top, right, bottom, left = detection["locations"][i]
+        found = search_result.get("status") == "found"
+        results.append({
+            "student_id": search_result.get("info", {}).get("MSSV", "Unknown") if found else "Unknown",
+            "name": search_result.get("info", {}).get("Ten", "Unknown") if found else "Unknown",
+            "distance": search_result.get("distance", 0),
+            "margin": search_result.get("margin"),
+            "candidates": search_result.get("candidates", []),
+            "box": [top, right, bottom, left],
+            "mode": mode,
+        })
+        if tracked is not None:
+            results[-1]["track_id"], _, results[-1]["reused"] = tracked[i]
+        if i < len(crops):
+            results[-1]["crop_image"] = crops[i]
+    return results
+
+
+def recognize(detection, mode, search_params, start_time, tracker=None):
+    """
+    Tìm kiếm mọi khuôn mặt đã encode và dựng kết quả trả về (kèm thời gian từng bước).
+    Có tracker: khuôn mặt thuộc track cũ (không encode lại) dùng lại kết quả của track.
+    """
+    timings = dict(detection.get("timings", {}))
+    results = []
+    if len(detection["locations"]) > 0:
+        search_results = []
+        if len(detection["encodings"]) > 0:
+            t = time.time()
+            search_results = search_all_faces(detection["encodings"], mode, search_params)
+            timings["search_ms"] = (time.time() - t) * 1000
 
-# --- HÀM PHỤ TRỢ: GIẢI MÃ ẢNH BASE64 ---
-def decode_base64_image(base64_string):
-    """Chuyển chuỗi Base64 từ Webcam thành ảnh OpenCV (RGB)"""
-    try:
-        # Nếu chuỗi có header (ví dụ: "data:image/jpeg;base64,..."), hãy cắt bỏ nó
-        if "," in base64_string:
-            base64_string = base64_string.split(",")[1]
+        if tracker is not None:
+            tracked = tracker.update(detection["locations"], detection["reuse"],
+                                     detection["encodings"], search_results)
+            per_face = [entry[1] if entry else None for entry in tracked]
+            results = build_face_results(per_face, detection, mode, tracked)
+        else:
+            results = build_face_results(search_results, detection, mode)
 
-        img_bytes = base64.b64decode(base64_string)
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        img_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    elapsed_ms = (time.time() - start_time) * 1000
+    return {"faces": results, "mode": mode, "elapsed_ms": elapsed_ms, "timings": timings}
 
-        # Quan trọng: OpenCV dùng BGR, face_recognition cần RGB
-        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        return img_rgb
-    except Exception as e:
-        print(f"[ERROR] Loi decode anh: {e}")
-        return None
 
+def tracking_key(mode, search_params):
+    """Khoá (mode, k, threshold, margin) của kết quả track: phiên đổi tham số thì track cũ bị bỏ"""
+    return (mode,) + tuple(search_params.get(name) for name in ("k", "threshold", "margin"))
 
-# --- HÀM PHỤ TRỢ: CẮT ẢNH KHUÔN MẶT RA BASE64 ---
-def crop_face_to_base64(image_rgb, top, right, bottom, left):
-    try:
-        # Cắt ảnh theo toạ độ [y:y+h, x:x+w]
-        face_image = image_rgb[top:bottom, left:right]
 
-        # Chuyển sang PIL Image
-        pil_img = Image.fromarray(face_image)
+def run_frame(payload, source, crop_format, tracker=None, drop_stale=False, search_key=None):
+    """
+    Detect + encode một frame; có tracker thì bỏ qua encode các khuôn mặt đang được theo dõi
+    (search_key: xem tracking_key)
+    """
+    if tracker is None:
+        return encoder_pool.run(payload, source=source, crop_format=crop_format, drop_stale=drop_stale)
+    return encoder_pool.run(payload, source=source, crop_format=crop_format, drop_stale=drop_stale,
+                            reuse_boxes=tracker.reusable_boxes(search_key))
 
-        # Lưu vào buffer
-        buffered = BytesIO()
-        pil_img.save(buffered, format="JPEG")
 
-        # Encode base64
-        img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        return f"data:image/jpeg;base64,{img_str}"
-    except Exception as e:
-        print(f"[ERROR] Loi crop anh: {e}")
-        return ""
+def encode_single_face(file):
+    """
+    Detect + encode ảnh upload dùng cho enroll / cập nhật.
+    Output: (face_encoding, box), raise ValueError nếu ảnh không có đúng 1 khuôn mặt
+    """
+    detection = encoder_pool.run(file.read(), source="file", crop_format=None)
+    if "error" in detection:
+        raise ValueError(detection["error"])
+    if len(detection["locations"]) != 1:
+        raise ValueError(f"Anh phai co dung 1 khuon mat (tim thay {len(detection['locations'])})")
+    return detection["encodings"][0], list(detection["locations"][0])
 
 
 # --- API 1: UPLOAD FILE ẢNH ---
 # Gọi từ frontend: POST /recognize_image?mode=hnsw|bruteforce
+# Tuỳ chọn: &k=5&threshold=0.5&margin=0.05 (top-k ứng viên + quyết định theo margin)
 @app.route("/recognize_image", methods=["POST"])
 def search_by_file():
     start_time = time.time()
@@ -126,6 +248,12 @@ def search_by_file():
     if mode not in {"hnsw", "bruteforce"}:
         mode = "hnsw"
 
+    try:
+        search_params = parse_search_params(request.args)
+        crop_format, use_msgpack = parse_output_options(request.args, request.headers.get("Accept"))
+    except ValueError as e:
+        return jsonify({"error": f"Tham so tim kiem khong hop le: {e}"}), 400
+
     if "file" not in request.files:
         return jsonify({"error": "Vui long gui kem file anh (key='file')"}), 400
 
@@ -134,58 +262,16 @@ def search_by_file():
         return jsonify({"error": "Chua chon file"}), 400
 
     try:
-        # Đọc ảnh trực tiếp từ file gửi lên
-        image = face_recognition.load_image_file(file)
-
-        # 1. Tìm vị trí khuôn mặt (Dùng HOG cho nhanh)
-        face_locations = face_recognition.face_locations(image, model="hog")
+        # Decode + detect (HOG) + encode + cắt ảnh chạy trong pool encode
+        detection = encoder_pool.run(file.read(), source="file", crop_format=crop_format)
+        if "error" in detection:
+            return jsonify({"error": detection["error"]}), 400
 
-        if len(face_locations) == 0:
-            elapsed_ms = (time.time() - start_time) * 1000
-            return jsonify({"faces": [], "mode": mode, "elapsed_ms": elapsed_ms}), 200
-
-        # 2. Encode khuôn mặt
-        face_encodings = face_recognition.face_encodings(image, face_locations)
-
-        results = []
-
-        # 3. Duyệt qua từng mặt tìm thấy
-        for i, query_vector in enumerate(face_encodings):
-            # Chọn thuật toán
-            if mode == "bruteforce":
-                search_result = brute_force_search(query_vector)
-            else:
-                search_result = search_engine.search_face(query_vector)
-
-            if not search_result:
-                continue
-
-            top, right, bottom, left = face_locations[i]
-
-            # Cắt ảnh khuôn mặt
-            crop_b64 = crop_face_to_base64(image, top, right, bottom, left)
-
-            face_data = {
-                "student_id": search_result.get("info", {}).get(
-                    "MSSV", "Unknown"
-                )
-                if search_result.get("status") == "found"
-                else "Unknown",
-                "name": search_result.get("info", {}).get(
-                    "Ten", "Unknown"
-                )
-                if search_result.get("status") == "found"
-                else "Unknown",
-                "distance": search_result.get("distance", 0),
-                "box": [top, right, bottom, left],
-                "crop_image": crop_b64,
-                "mode": mode,
-            }
-            results.append(face_data)
-
-        elapsed_ms = (time.time() - start_time) * 1000
-        return jsonify({"faces": results, "mode": mode, "elapsed_ms": elapsed_ms}), 200
+        # Tìm kiếm tất cả khuôn mặt trong một lượt
+        return result_response(recognize(detection, mode, search_params, start_time), use_msgpack)
 
+    except EncoderBusyError as e:
+        return busy_response(e)
     except Exception as e:
         print(f"[ERROR] Loi xu ly file: {e}")
         return jsonify({"error": str(e)}), 500
@@ -193,6 +279,10 @@ def search_by_file():
 
 # --- API 2: NHẬN DIỆN REALTIME (WEBCAM) ---
 # Gọi từ frontend: POST /recognize_frame?mode=hnsw|bruteforce
+# Tuỳ chọn: &k=5&threshold=0.5&margin=0.05 (top-k ứng viên + quyết định theo margin)
+# Body: JSON {"image": "<base64>"} hoặc bytes JPEG gửi thẳng (Content-Type: image/jpeg);
+# &crops=base64|jpeg|none, &format=msgpack (hoặc Accept: application/x-msgpack)
+# &session=<id> (hoặc header X-Session-Id): bật tracking, khuôn mặt đứng yên không bị encode lại
 @app.route("/recognize_frame", methods=["POST"])
 def search_by_base64():
     start_time = time.time()
@@ -201,70 +291,242 @@ def search_by_base64():
     if mode not in {"hnsw", "bruteforce"}:
         mode = "hnsw"
 
-    # 1. Lấy dữ liệu JSON
-    data = request.get_json()
-    if not data or "image" not in data:
-        return jsonify({"error": "Thieu du lieu 'image'"}), 400
+    raw_upload = request.mimetype in RAW_IMAGE_MIMETYPES
+    try:
+        search_params = parse_search_params(request.args)
+        crop_format, use_msgpack = parse_output_options(request.args, request.headers.get("Accept"), raw_upload)
+    except ValueError as e:
+        return jsonify({"error": f"Tham so tim kiem khong hop le: {e}"}), 400
+
+    # 1. Lấy dữ liệu: bytes ảnh gửi thẳng hoặc JSON base64
+    if raw_upload:
+        payload, source = request.get_data(), "bytes"
+        if not payload:
+            return jsonify({"error": "Body anh rong"}), 400
+    else:
+        data = request.get_json(silent=True)
+        if not data or "image" not in data:
+            return jsonify({"error": "Thieu du lieu 'image'"}), 400
+        payload, source = data["image"], "base64"
+
+    session_id = request.args.get("session") or request.headers.get("X-Session-Id")
+    tracker = trackers.get(session_id) if session_id else None
 
-    base64_str = data["image"]
+    try:
+        # Frame webcam: không chờ khi hàng đợi đầy, frame chờ quá lâu thì bỏ
+        # (client sẽ gửi frame mới hơn ngay sau đó)
+        if tracker is None:
+            detection = run_frame(payload, source, crop_format, drop_stale=True)
+            if "error" in detection:
+                return jsonify({"error": "Anh loi, khong decode duoc"}), 400
+            result = recognize(detection, mode, search_params, start_time)
+        else:
+            # Các frame của cùng một phiên xử lý lần lượt để track không bị ghi chồng
+            with tracker.lock:
+                # Cùng session có thể đổi mode / k / threshold / margin giữa các frame
+                detection = run_frame(payload, source, crop_format, tracker, drop_stale=True,
+                                      search_key=tracking_key(mode, search_params))
+                if "error" in detection:
+                    return jsonify({"error": "Anh loi, khong decode duoc"}), 400
+                result = recognize(detection, mode, search_params, start_time, tracker)
+
+        return result_response(result, use_msgpack)
+
+    except EncoderBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"[ERROR] Loi realtime: {e}")
+        return jsonify({"error": str(e)}), 500
 
-    # 2. Giải mã Base64 -> Ảnh RGB
-    image_rgb = decode_base64_image(base64_str)
-    if image_rgb is None:
-        return jsonify({"error": "Anh base64 loi"}), 400
+# --- API 2b: NHẬN DIỆN REALTIME QUA WEBSOCKET ---
+# Kết nối: ws://<host>/ws_recognize_frame?mode=hnsw|bruteforce&k=5&threshold=0.5&margin=0.05
+# Client gửi mỗi frame là một message nhị phân (bytes JPEG) hoặc text JSON {"image": "<base64>"};
+# server trả về mỗi frame đã xử lý một message JSON giống /recognize_frame
+# (&format=msgpack -> message nhị phân msgpack, &crops=base64|jpeg|none như API 2)
+@sock.route("/ws_recognize_frame")
+def ws_recognize_frame(ws):
+    mode = request.args.get("mode", "hnsw").lower()
+    if mode not in {"hnsw", "bruteforce"}:
+        mode = "hnsw"
 
     try:
-        # 3. Tìm vị trí mặt (HOG)
-        face_locations = face_recognition.face_locations(image_rgb, model="hog")
+        search_params = parse_search_params(request.args)
+        crop_format, use_msgpack = parse_output_options(request.args)
+    except ValueError as e:
+        ws.send(json.dumps({"error": f"Tham so tim kiem khong hop le: {e}"}))
+        return
+
+    frame_id = 0
+    # Mỗi kết nối là một phiên tracking (tắt bằng &tracking=0)
+    tracker = None if request.args.get("tracking") == "0" else FaceTracker()
+    try:
+        while True:
+            message = ws.receive()
+            if message is None:
+                break
+            frame_id += 1
+
+            # Client gửi nhanh hơn tốc độ xử lý: chỉ giữ frame mới nhất đang chờ
+            dropped = 0
+            while True:
+                newer = ws.receive(timeout=0)
+                if newer is None:
+                    break
+                message = newer
+                frame_id += 1
+                dropped += 1
+
+            start_time = time.time()
+            if isinstance(message, (bytes, bytearray)):
+                payload, source = bytes(message), "bytes"
+            else:
+                try:
+                    payload, source = json.loads(message)["image"], "base64"
+                except (ValueError, KeyError, TypeError):
+                    ws.send(encode_result({"error": "Thieu du lieu 'image'", "frame_id": frame_id}, use_msgpack))
+                    continue
+
+            try:
+                detection = run_frame(payload, source, crop_format, tracker)
+            except EncoderBusyError as e:
+                ws.send(encode_result({"error": f"Server dang ban: {e}", "dropped": True, "frame_id": frame_id},
+                                      use_msgpack))
+                continue
+            if "error" in detection:
+                ws.send(encode_result({"error": detection["error"], "frame_id": frame_id}, use_msgpack))
+                continue
 
-        if len(face_locations) == 0:
-            elapsed_ms = (time.time() - start_time) * 1000
-            return jsonify({"faces": [], "mode": mode, "elapsed_ms": elapsed_ms}), 200
+            result = recognize(detection, mode, search_params, start_time, tracker)
+            result["frame_id"] = frame_id
+            result["dropped_frames"] = dropped
+            t = time.time()
+            message = encode_result(result, use_msgpack)
+            result["timings"]["serialize_ms"] = (time.time() - t) * 1000
+            ws.send(message)
+            metrics.observe_request("/ws_recognize_frame", 200, (time.time() - start_time) * 1000,
+                                    result["timings"], len(result["faces"]))
+    except ConnectionClosed:
+        pass
+    except Exception as e:
+        print(f"[ERROR] Loi websocket: {e}")
 
-        # 4. Encode mặt (Trích xuất đặc trưng 128D)
-        face_encodings = face_recognition.face_encodings(image_rgb, face_locations)
 
-        results = []
+# --- API 3: THÊM NGƯỜI MỚI (ENROLL) ---
+# POST /enroll, multipart/form-data: file=<ảnh có đúng 1 khuôn mặt>, student_id=<MSSV>, name=<Tên>
+@app.route("/enroll", methods=["POST"])
+def enroll_face():
+    start_time = time.time()
 
-        # 5. Duyệt và tìm kiếm
-        for i, face_encoding in enumerate(face_encodings):
-            # Chọn thuật toán
-            if mode == "bruteforce":
-                search_result = brute_force_search(face_encoding)
-            else:
-                search_result = search_engine.search_face(face_encoding)
+    if search_engine.read_only:
+        return jsonify({"error": "Server dang o che do chi-doc, khong the enroll"}), 403
 
-            if not search_result:
-                continue
+    student_id = (request.form.get("student_id") or "").strip()
+    name = (request.form.get("name") or "").strip()
+    if not student_id or not name:
+        return jsonify({"error": "Thieu 'student_id' hoac 'name'"}), 400
 
-            top, right, bottom, left = face_locations[i]
-            crop_b64 = crop_face_to_base64(image_rgb, top, right, bottom, left)
-
-            face_data = {
-                "student_id": search_result.get("info", {}).get(
-                    "MSSV", "Unknown"
-                )
-                if search_result.get("status") == "found"
-                else "Unknown",
-                "name": search_result.get("info", {}).get(
-                    "Ten", "Unknown"
-                )
-                if search_result.get("status") == "found"
-                else "Unknown",
-                "distance": search_result.get("distance", 0),
-                "box": [top, right, bottom, left],
-                "crop_image": crop_b64,
-                "mode": mode,
-            }
-            results.append(face_data)
+    if "file" not in request.files:
+        return jsonify({"error": "Vui long gui kem file anh (key='file')"}), 400
+
+    file = request.files["file"]
+    if file.filename == "":
+        return jsonify({"error": "Chua chon file"}), 400
+
+    try:
+        face_encoding, box = encode_single_face(file)
+        enrolled = search_engine.enroll(face_encoding, student_id, name)
+        # Danh tính "Unknown" đang được track có thể vừa trở thành người này
+        face_tracker.invalidate_all()
 
         elapsed_ms = (time.time() - start_time) * 1000
-        return jsonify({"faces": results, "mode": mode, "elapsed_ms": elapsed_ms}), 200
+        return jsonify({
+            "status": "enrolled",
+            "student_id": enrolled["MSSV"],
+            "name": enrolled["Ten"],
+            "label": enrolled["label"],
+            "mongo_id": enrolled["MongoID"],
+            "box": box,
+            "elapsed_ms": elapsed_ms,
+        }), 201
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except EncoderBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"[ERROR] Loi enroll: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+# --- API 4: XOÁ / CẬP NHẬT NGƯỜI ĐÃ ENROLL ---
+# DELETE /people/<MSSV>: xoá mọi khuôn mặt của người này
+# PUT /people/<MSSV>, multipart/form-data: file=<ảnh có đúng 1 khuôn mặt>, name=<Tên mới, tuỳ chọn>
+@app.route("/people/<student_id>", methods=["DELETE", "PUT"])
+def manage_person(student_id):
+    start_time = time.time()
+
+    if search_engine.read_only:
+        return jsonify({"error": "Server dang o che do chi-doc"}), 403
 
+    try:
+        if request.method == "DELETE":
+            deleted = search_engine.delete_person(student_id)
+            face_tracker.invalidate_all()
+            if deleted == 0:
+                return jsonify({"error": f"Khong tim thay MSSV {student_id}"}), 404
+            elapsed_ms = (time.time() - start_time) * 1000
+            return jsonify({
+                "status": "deleted",
+                "student_id": student_id,
+                "deleted": deleted,
+                "index": search_engine.stats(),
+                "elapsed_ms": elapsed_ms,
+            }), 200
+
+        if "file" not in request.files or request.files["file"].filename == "":
+            return jsonify({"error": "Vui long gui kem file anh (key='file')"}), 400
+
+        face_encoding, box = encode_single_face(request.files["file"])
+        name = (request.form.get("name") or "").strip() or None
+        updated = search_engine.update_person(student_id, face_encoding, name)
+        face_tracker.invalidate_all()
+        if updated is None:
+            return jsonify({"error": f"Khong tim thay MSSV {student_id}"}), 404
+
+        elapsed_ms = (time.time() - start_time) * 1000
+        return jsonify({
+            "status": "updated",
+            "student_id": updated["MSSV"],
+            "name": updated["Ten"],
+            "label": updated["label"],
+            "mongo_id": updated["MongoID"],
+            "box": box,
+            "index": search_engine.stats(),
+            "elapsed_ms": elapsed_ms,
+        }), 200
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except EncoderBusyError as e:
+        return busy_response(e)
     except Exception as e:
-        print(f"[ERROR] Loi realtime: {e}")
+        print(f"[ERROR] Loi cap nhat nguoi dung: {e}")
         return jsonify({"error": str(e)}), 500
 
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Số liệu dạng Prometheus text: histogram thời gian từng bước, bộ đếm request / index / cache"""
+    body = metrics.render_metrics(search_engine.stats(), encoder_pool.stats(), len(trackers))
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    """Số liệu cache kết quả tìm kiếm (hit rate, số phần tử, số lần invalidate)"""
+    return jsonify(search_engine.result_cache.stats()), 200
+
+
 @app.route("/", methods=["GET", "HEAD"])
 def health_check():
     """
@@ -276,8 +538,13 @@ def health_check():
     return jsonify({
         "status": "online", 
         "service": "Face Recognition Server",
-        "methods": ["hnsw", "bruteforce"]
+        "methods": ["hnsw", "bruteforce"],
+        "index": search_engine.stats(),
+        "encoder": encoder_pool.stats(),
+        "tracking_sessions": len(trackers)
     }), 200
 # --- CHẠY APP ---
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
+    search_engine.start_sync()
+    # Chỉ bật debug (reloader + debugger) khi chạy local với FLASK_DEBUG=1
+    app.run(host="0.0.0.0", port=8000, debug=os.getenv("FLASK_DEBUG") == "1")
@@ -0,0 +1,297 @@
+"""
+Bản ASGI (Starlette + uvicorn) của các API nhận diện, dùng chung index HNSW, pool
+encode và các hàm xử lý với app.py.
+
+Khác với Flask (mỗi request chiếm một luồng từ lúc nhận body tới lúc trả kết quả):
+- Body upload được đọc bất đồng bộ: client gửi chậm không giữ luồng nào.
+- Detect + encode chờ pool tiến trình qua asyncio, tìm kiếm + đóng gói kết quả chạy
+  trong thread pool, event loop luôn rảnh để nhận kết nối khác.
+- Mỗi tiến trình phục vụ được nhiều kết nối webcam (WebSocket) cùng lúc.
+
+Các API còn lại (enroll, xoá / cập nhật người dùng, cache_stats) vẫn do app Flask xử
+lý, được gắn phía sau qua a2wsgi nên frontend chỉ cần một địa chỉ backend.
+
+Chạy: uvicorn asgi_app:app --host 0.0.0.0 --port 10000 --workers 2
+"""
+import asyncio
+import contextlib
+import json
+import time
+import weakref
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+from app import (app as flask_app, RAW_IMAGE_MIMETYPES, MSGPACK_MIMETYPE, search_engine, encoder_pool,
+                 trackers, parse_search_params, parse_output_options, encode_result, recognize,
+                 tracking_key)
+from faces_recognition import metrics
+from faces_recognition.face_tracker import FaceTracker
+from faces_recognition.pipeline import EncoderBusyError
+
+# Khoá asyncio theo phiên tracking: các frame của cùng một session xử lý lần lượt
+# (FaceTracker.lock là khoá luồng, giữ qua await sẽ chặn cả event loop)
+_session_locks = weakref.WeakKeyDictionary()
+
+
+def parse_mode(params):
+    mode = params.get("mode", "hnsw").lower()
+    return mode if mode in {"hnsw", "bruteforce"} else "hnsw"
+
+
+def busy_response(e):
+    return JSONResponse({"error": f"Server dang ban: {e}", "dropped": True}, status_code=503,
+                        headers={"Retry-After": "1"})
+
+
+def search_and_encode(detection, mode, search_params, start_time, use_msgpack, tracker=None):
+    """Tìm kiếm + đóng gói kết quả (chạy trong thread pool, không chặn event loop)"""
+    result = recognize(detection, mode, search_params, start_time, tracker)
+    t = time.time()
+    body = encode_result(result, use_msgpack)
+    result["timings"]["serialize_ms"] = (time.time() - t) * 1000
+    return result, body
+
+
+def result_response(endpoint, result, body, use_msgpack, start_time):
+    metrics.observe_request(endpoint, 200, (time.time() - start_time) * 1000,
+                            result["timings"], len(result["faces"]))
+    return Response(body, media_type=MSGPACK_MIMETYPE if use_msgpack else "application/json")
+
+
+def error_response(endpoint, message, status, start_time):
+    metrics.observe_request(endpoint, status, (time.time() - start_time) * 1000)
+    return JSONResponse({"error": message}, status_code=status)
+
+
+# --- API 1: UPLOAD FILE ẢNH ---
+async def search_by_file(request):
+    start_time = time.time()
+    endpoint = "/recognize_image"
+    mode = parse_mode(request.query_params)
+    try:
+        search_params = parse_search_params(request.query_params)
+        crop_format, use_msgpack = parse_output_options(request.query_params, request.headers.get("accept"))
+    except ValueError as e:
+        return error_response(endpoint, f"Tham so tim kiem khong hop le: {e}", 400, start_time)
+
+    form = await request.form()
+    file = form.get("file")
+    if file is None or isinstance(file, str):
+        return error_response(endpoint, "Vui long gui kem file anh (key='file')", 400, start_time)
+    if not file.filename:
+        return error_response(endpoint, "Chua chon file", 400, start_time)
+
+    try:
+        detection = await encoder_pool.run_async(await file.read(), source="file", crop_format=crop_format)
+        if "error" in detection:
+            return error_response(endpoint, detection["error"], 400, start_time)
+        result, body = await run_in_threadpool(search_and_encode, detection, mode, search_params,
+                                               start_time, use_msgpack)
+        return result_response(endpoint, result, body, use_msgpack, start_time)
+    except EncoderBusyError as e:
+        metrics.observe_request(endpoint, 503, (time.time() - start_time) * 1000)
+        return busy_response(e)
+    except Exception as e:
+        print(f"[ERROR] Loi xu ly file: {e}")
+        return error_response(endpoint, str(e), 500, start_time)
+
+
+# --- API 2: NHẬN DIỆN REALTIME (WEBCAM) ---
+async def search_by_base64(request):
+    start_time = time.time()
+    endpoint = "/recognize_frame"
+    mode = parse_mode(request.query_params)
+    mimetype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    raw_upload = mimetype in RAW_IMAGE_MIMETYPES
+    try:
+        search_params = parse_search_params(request.query_params)
+        crop_format, use_msgpack = parse_output_options(request.query_params, request.headers.get("accept"),
+                                                        raw_upload)
+    except ValueError as e:
+        return error_response(endpoint, f"Tham so tim kiem khong hop le: {e}", 400, start_time)
+
+    body = await request.body()
+    if raw_upload:
+        payload, source = body, "bytes"
+        if not payload:
+            return error_response(endpoint, "Body anh rong", 400, start_time)
+    else:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or "image" not in data:
+            return error_response(endpoint, "Thieu du lieu 'image'", 400, start_time)
+        payload, source = data["image"], "base64"
+
+    session_id = request.query_params.get("session") or request.headers.get("x-session-id")
+    tracker = trackers.get(session_id) if session_id else None
+
+    try:
+        if tracker is None:
+            detection = await encoder_pool.run_async(payload, source=source, crop_format=crop_format,
+                                                     drop_stale=True)
+            if "error" in detection:
+                return error_response(endpoint, "Anh loi, khong decode duoc", 400, start_time)
+            result, body = await run_in_threadpool(search_and_encode, detection, mode, search_params,
+                                                   start_time, use_msgpack)
+        else:
+            lock = _session_locks.setdefault(tracker, asyncio.Lock())
+            async with lock:
+                # Cùng session có thể đổi mode / k / threshold / margin giữa các frame
+                reuse_boxes = tracker.reusable_boxes(tracking_key(mode, search_params))
+                detection = await encoder_pool.run_async(payload, source=source, crop_format=crop_format,
+                                                         drop_stale=True, reuse_boxes=reuse_boxes)
+                if "error" in detection:
+                    return error_response(endpoint, "Anh loi, khong decode duoc", 400, start_time)
+                result, body = await run_in_threadpool(search_and_encode, detection, mode, search_params,
+                                                       start_time, use_msgpack, tracker)
+        return result_response(endpoint, result, body, use_msgpack, start_time)
+    except EncoderBusyError as e:
+        metrics.observe_request(endpoint, 503, (time.time() - start_time) * 1000)
+        return busy_response(e)
+    except Exception as e:
+        print(f"[ERROR] Loi realtime: {e}")
+        return error_response(endpoint, str(e), 500, start_time)
+
+
+# --- API 2b: NHẬN DIỆN REALTIME QUA WEBSOCKET ---
+async def ws_recognize_frame(websocket):
+    await websocket.accept()
+    params = websocket.query_params
+    mode = parse_mode(params)
+    try:
+        search_params = parse_search_params(params)
+        crop_format, use_msgpack = parse_output_options(params)
+    except ValueError as e:
+        await websocket.send_text(json.dumps({"error": f"Tham so tim kiem khong hop le: {e}"}))
+        await websocket.close()
+        return
+
+    async def send(payload):
+        if use_msgpack:
+            await websocket.send_bytes(payload if isinstance(payload, bytes) else encode_result(payload, True))
+        else:
+            await websocket.send_text(payload if isinstance(payload, str) else encode_result(payload, False))
+
+    # Nhận frame trong một task riêng, chỉ giữ frame mới nhất: client gửi nhanh hơn
+    # tốc độ xử lý thì các frame cũ đang chờ bị bỏ
+    latest = {"message": None, "frame_id": 0, "dropped": 0, "closed": False}
+    ready = asyncio.Event()
+
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if latest["message"] is not None:
+                    latest["dropped"] += 1
+                latest["message"] = message.get("bytes") if message.get("bytes") is not None else message.get("text")
+                latest["frame_id"] += 1
+                ready.set()
+        finally:
+            latest["closed"] = True
+            ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    tracker = None if params.get("tracking") == "0" else FaceTracker()
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            if latest["message"] is None:
+                if latest["closed"]:
+                    break
+                continue
+            message, frame_id, dropped = latest["message"], latest["frame_id"], latest["dropped"]
+            latest["message"], latest["dropped"] = None, 0
+
+            start_time = time.time()
+            if isinstance(message, bytes):
+                payload, source = message, "bytes"
+            else:
+                try:
+                    payload, source = json.loads(message)["image"], "base64"
+                except (ValueError, KeyError, TypeError):
+                    await send({"error": "Thieu du lieu 'image'", "frame_id": frame_id})
+                    continue
+
+            try:
+                detection = await encoder_pool.run_async(
+                    payload, source=source, crop_format=crop_format,
+                    reuse_boxes=tracker.reusable_boxes() if tracker is not None else None)
+            except EncoderBusyError as e:
+                await send({"error": f"Server dang ban: {e}", "dropped": True, "frame_id": frame_id})
+                continue
+            if "error" in detection:
+                await send({"error": detection["error"], "frame_id": frame_id})
+                continue
+
+            def finish():
+                result = recognize(detection, mode, search_params, start_time, tracker)
+                result["frame_id"] = frame_id
+                result["dropped_frames"] = dropped
+                t = time.time()
+                body = encode_result(result, use_msgpack)
+                result["timings"]["serialize_ms"] = (time.time() - t) * 1000
+                return result, body
+
+            result, body = await run_in_threadpool(finish)
+            await send(body)
+            metrics.observe_request("/ws_recognize_frame", 200, (time.time() - start_time) * 1000,
+                                    result["timings"], len(result["faces"]))
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"[ERROR] Loi websocket: {e}")
+    finally:
+        receiver.cancel()
+
+
+async def prometheus_metrics(request):
+    body = metrics.render_metrics(search_engine.stats(), encoder_pool.stats(), len(trackers))
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+async def health_check(request):
+    if request.method == "HEAD":
+        return Response(status_code=200)
+    return JSONResponse({
+        "status": "online",
+        "service": "Face Recognition Server (ASGI)",
+        "methods": ["hnsw", "bruteforce"],
+        "index": search_engine.stats(),
+        "encoder": encoder_pool.stats(),
+        "tracking_sessions": len(trackers),
+    })
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Mỗi worker uvicorn giữ index riêng: định kỳ bắt kịp thay đổi do worker khác ghi vào MongoDB
+    search_engine.start_sync()
+    yield
+
+
+app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route("/recognize_image", search_by_file, methods=["POST"]),
+        Route("/recognize_frame", search_by_base64, methods=["POST"]),
+        WebSocketRoute("/ws_recognize_frame", ws_recognize_frame),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+        Route("/", health_check, methods=["GET", "HEAD"]),
+        # Enroll / xoá / cập nhật người dùng: dùng lại các route của app Flask
+        Mount("/", WSGIMiddleware(flask_app)),
+    ],
+    # Cho phép Frontend từ mọi nguồn gọi vào (giống CORS của app Flask)
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+)
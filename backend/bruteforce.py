@@ -0,0 +1,175 @@
+import os
+import numpy as np
+
+
+class BruteForceSearchSystem:
+    """
+    Tìm kiếm chính xác (exact k-NN) trên toàn bộ vector, giữ trong bộ nhớ dưới
+    dạng một ma trận float32 liên tục. Khoảng cách L2 được tính theo lô bằng khai
+    triển ||q||² + ||x||² - 2q·x với ||x||² được cache sẵn, nên cả batch truy vấn
+    chỉ tốn một phép nhân ma trận. API giống HNSWSearchSystem để dùng làm baseline.
+    """
+
+    # Số dòng dữ liệu xử lý mỗi lượt khi tính khoảng cách (giới hạn bộ nhớ tạm)
+    CHUNK_ROWS = 65536
+
+    def __init__(self, dim: int = 16, capacity: int = 1024):
+        """
+        Khởi tạo hệ thống tìm kiếm
+
+        Args:
+            dim: Số chiều của vector
+            capacity: Số dòng cấp phát sẵn ban đầu
+        """
+        self.dim = dim
+        self.count = 0
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.norms = np.zeros(capacity, dtype=np.float32)
+        self.labels = np.zeros(capacity, dtype=np.int64)
+        self.row_of = {}
+
+    def _ensure_capacity(self, needed: int) -> None:
+        capacity = self.vectors.shape[0]
+        if needed <= capacity and self.vectors.flags.writeable:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+        for name in ("vectors", "norms", "labels"):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add_items(self, items, ids=None) -> None:
+        """
+        Thêm (hoặc ghi đè nếu id đã tồn tại) các vector
+
+        Args:
+            items: Mảng (n, dim) hoặc 1 vector (dim,)
+            ids: Nhãn tương ứng, mặc định nối tiếp từ số phần tử hiện có
+        """
+        items = np.asarray(items, dtype=np.float32).reshape(-1, self.dim)
+        if ids is None:
+            ids = np.arange(self.count, self.count + len(items))
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if len(ids) != len(items):
+            raise ValueError("Số lượng ids không khớp số vector")
+
+        self._ensure_capacity(self.count + len(items))
+        norms = np.einsum('ij,ij->i', items, items)
+        for vec, norm, label in zip(items, norms, ids):
+            label = int(label)
+            row = self.row_of.get(label)
+            if row is None:
+                row = self.count
+                self.count += 1
+                self.row_of[label] = row
+                self.labels[row] = label
+            self.vectors[row] = vec
+            self.norms[row] = norm
+
+    def delete_items(self, ids) -> None:
+        """Xoá hẳn các vector (dời dòng cuối vào chỗ trống để ma trận luôn liên tục)."""
+        if isinstance(ids, int):
+            ids = [ids]
+        self._ensure_capacity(self.count)
+        for label in ids:
+            row = self.row_of.pop(int(label), None)
+            if row is None:
+                continue
+            last = self.count - 1
+            if row != last:
+                moved = int(self.labels[last])
+                self.vectors[row] = self.vectors[last]
+                self.norms[row] = self.norms[last]
+                self.labels[row] = moved
+                self.row_of[moved] = row
+            self.count -= 1
+
+    def get_items(self, ids):
+        if isinstance(ids, int):
+            ids = [ids]
+        return self.vectors[[self.row_of[int(label)] for label in ids]].copy()
+
+    def get_size(self):
+        return self.count
+
+    def get_dim(self):
+        return self.dim
+
+    def knn_query(self, query: np.ndarray, k: int = 1) -> tuple:
+        """
+        Tìm chính xác K láng giềng gần nhất cho cả batch truy vấn
+
+        Args:
+            query: Vector truy vấn (dim,) hoặc batch (m, dim)
+            k: Số lượng kết quả trả về
+
+        Returns:
+            (labels, distances): mảng (m, k), khoảng cách là L2 bình phương
+            (cùng quy ước với không gian 'l2' của hnswlib)
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1, self.dim)
+        if self.count == 0:
+            raise ValueError("Chưa có dữ liệu để tìm kiếm.")
+        k = min(k, self.count)
+
+        query_norms = np.einsum('ij,ij->i', query, query)
+        best_dist = np.full((len(query), 0), np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(query), 0), dtype=np.int64)
+
+        for start in range(0, self.count, self.CHUNK_ROWS):
+            end = min(start + self.CHUNK_ROWS, self.count)
+            dist = query_norms[:, None] + self.norms[None, start:end] - 2.0 * (query @ self.vectors[start:end].T)
+            np.maximum(dist, 0, out=dist)
+
+            kk = min(k, end - start)
+            part = np.argpartition(dist, kk - 1, axis=1)[:, :kk]
+            best_dist = np.concatenate([best_dist, np.take_along_axis(dist, part, axis=1)], axis=1)
+            best_rows = np.concatenate([best_rows, part + start], axis=1)
+
+            if best_dist.shape[1] > k:
+                keep = np.argpartition(best_dist, k - 1, axis=1)[:, :k]
+                best_dist = np.take_along_axis(best_dist, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(best_dist, axis=1)
+        best_dist = np.take_along_axis(best_dist, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return self.labels[best_rows].astype(np.uint64), best_dist
+
+    def save(self, directory: str, prefix: str = "exact") -> None:
+        """Lưu ma trận vector và nhãn ra file .npy (mở lại được bằng mmap)."""
+        os.makedirs(directory, exist_ok=True)
+        for name in ("vectors", "labels"):
+            path = os.path.join(directory, f"{prefix}_{name}.npy")
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(getattr(self, name)[:self.count]))
+            os.replace(tmp, path)
+
+    @staticmethod
+    def exists(directory: str, prefix: str = "exact") -> bool:
+        return all(os.path.isfile(os.path.join(directory, f"{prefix}_{name}.npy"))
+                   for name in ("vectors", "labels"))
+
+    @classmethod
+    def load(cls, directory: str, prefix: str = "exact", mmap: bool = False):
+        """
+        Nạp dữ liệu đã lưu bằng save()
+
+        Args:
+            directory: Thư mục chứa file
+            mmap: True -> ma trận vector mở chỉ-đọc bằng mmap (dùng chung giữa các worker);
+                  lần ghi đầu tiên sẽ tự chép ra bộ nhớ riêng
+        """
+        mode = "r" if mmap else None
+        vectors = np.load(os.path.join(directory, f"{prefix}_vectors.npy"), mmap_mode=mode)
+        labels = np.load(os.path.join(directory, f"{prefix}_labels.npy"))
+
+        system = cls(dim=vectors.shape[1], capacity=0)
+        system.vectors = vectors
+        system.labels = labels
+        system.norms = np.einsum('ij,ij->i', vectors, vectors).astype(np.float32)
+        system.count = len(labels)
+        system.row_of = {int(label): row for row, label in enumerate(labels)}
+        return system
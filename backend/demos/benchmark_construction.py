@@ -0,0 +1,250 @@
+"""
+Quét tham số dựng đồ thị HNSW (M, ef_construction) trên dữ liệu tổng hợp và
+embedding khuôn mặt thật. Với mỗi cặp (M, ef_construction) ghi lại thời gian build,
+kích thước file index (index_file_size, xấp xỉ bộ nhớ của đồ thị), và QPS + recall@k
+cho từng ef khi tìm kiếm.
+
+Ví dụ:
+    python demos/benchmark_construction.py
+    python demos/benchmark_construction.py --datasets clustered mongo --M 8 16 32 --ef-construction 100 200
+    python demos/benchmark_construction.py --datasets npy:embeddings.npy --ef 10 20 50 100
+
+Tập dữ liệu (--datasets):
+    uniform    vector ngẫu nhiên đều trong [0, 1)^dim
+    clustered  mô phỏng embedding khuôn mặt: --identities tâm, mỗi người nhiều ảnh lệch
+               quanh tâm (độ lệch cỡ khoảng cách cùng người của face_recognition)
+    mongo      feature_vector trong MongoDB (MONGO_URI trong .env)
+    npy:PATH   ma trận (n, dim) lưu bằng np.save
+
+Với dữ liệu thật, --queries vector được tách ra làm truy vấn (không nằm trong index).
+Kết quả ghi vào --out: construction_sweep.json, construction_sweep.csv và
+pareto_<tập dữ liệu>.png (cần matplotlib).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from hnsw import HNSWSearchSystem
+
+
+# ----------------- DỮ LIỆU -----------------
+def uniform_dataset(n: int, num_queries: int, dim: int, rng) -> tuple:
+    return rng.random((n, dim), dtype=np.float32), rng.random((num_queries, dim), dtype=np.float32)
+
+
+def clustered_dataset(n: int, num_queries: int, dim: int, rng, identities: int) -> tuple:
+    # Embedding face_recognition có chuẩn ~1, hai người khác nhau cách nhau > 0.6,
+    # ảnh của cùng một người cách nhau 0.3-0.4
+    centers = rng.normal(0, 1, (identities, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    spread = 0.35 / np.sqrt(2 * dim)
+
+    def sample(count):
+        owners = rng.integers(0, identities, count)
+        return (centers[owners] + rng.normal(0, spread, (count, dim))).astype(np.float32)
+
+    return sample(n), sample(num_queries)
+
+
+def mongo_vectors() -> np.ndarray:
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    load_dotenv()
+    uri = os.getenv("MONGO_URI")
+    if not uri:
+        raise ValueError("Chưa cấu hình MONGO_URI trong file .env")
+    collection = MongoClient(uri)['FaceRecProject']['PeopleMetadata']
+    cursor = collection.find({"feature_vector": {"$exists": True}}, projection={"feature_vector": 1, "_id": 0})
+    return np.array([doc["feature_vector"] for doc in cursor], dtype=np.float32)
+
+
+def split_queries(vectors: np.ndarray, num_queries: int, rng) -> tuple:
+    num_queries = min(num_queries, len(vectors) // 10)
+    order = rng.permutation(len(vectors))
+    return vectors[order[num_queries:]], vectors[order[:num_queries]]
+
+
+def load_dataset(name: str, args, rng) -> tuple:
+    if name == "uniform":
+        return uniform_dataset(args.n, args.queries, args.dim, rng)
+    if name == "clustered":
+        return clustered_dataset(args.n, args.queries, args.dim, rng, args.identities)
+    if name == "mongo":
+        return split_queries(mongo_vectors(), args.queries, rng)
+    if name.startswith("npy:"):
+        return split_queries(np.load(name[4:]).astype(np.float32), args.queries, rng)
+    raise ValueError(f"Không biết tập dữ liệu '{name}'")
+
+
+# ----------------- ĐO -----------------
+def build(data: np.ndarray, M: int, ef_construction: int, threads: int) -> tuple:
+    """(index, thời gian build giây, kích thước file index byte)"""
+    system = HNSWSearchSystem(space='l2', dim=data.shape[1])
+    start = time.perf_counter()
+    system.build_hnsw_index(max_elements=len(data), ef_construction=ef_construction, M=M)
+    system.add_items(data, np.arange(len(data)), num_threads=threads)
+    build_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.bin")
+        system.save_index(path)
+        index_file_size = os.path.getsize(path)
+    return system, build_time, index_file_size
+
+
+def measure(system: HNSWSearchSystem, queries: np.ndarray, truth: np.ndarray, ef: int, threads: int) -> tuple:
+    """(QPS, recall@k) của một ef"""
+    k = truth.shape[1]
+    system.set_ef(ef)
+    start = time.perf_counter()
+    labels, _ = system.knn_query(queries, k=k, num_threads=threads)
+    qps = len(queries) / (time.perf_counter() - start)
+    hits = sum(len(set(a) & set(b)) for a, b in zip(labels.tolist(), truth.tolist()))
+    return qps, hits / truth.size
+
+
+# ----------------- PARETO -----------------
+def pareto_front(points: list, x: str, y: str, maximize_x: bool) -> list:
+    """Các điểm không bị điểm nào khác trội hơn (y càng lớn càng tốt; x lớn hoặc nhỏ tuỳ maximize_x)"""
+    sign = -1 if maximize_x else 1
+    ordered = sorted(points, key=lambda p: (sign * p[x], -p[y]))
+    front, best_y = [], -np.inf
+    for p in ordered:
+        if p[y] > best_y:
+            front.append(p)
+            best_y = p[y]
+    return front
+
+
+def plot_pareto(dataset: str, rows: list, out_dir: str) -> str:
+    if plt is None:
+        return None
+    # Recall tốt nhất của mỗi cấu hình dựng (ở ef lớn nhất) để so với chi phí build / bộ nhớ
+    configs = {}
+    for r in rows:
+        key = (r["M"], r["ef_construction"])
+        if key not in configs or r["ef"] > configs[key]["ef"]:
+            configs[key] = r
+    configs = list(configs.values())
+
+    panels = [
+        (rows, "qps", "QPS", True, "recall / QPS (mọi ef)"),
+        (configs, "index_file_size_mb", "Kích thước index (MB)", False, "recall / bộ nhớ (ef lớn nhất)"),
+        (configs, "build_seconds", "Thời gian build (s)", False, "recall / thời gian build (ef lớn nhất)"),
+    ]
+    fig, axes = plt.subplots(1, 3, figsize=(18, 5))
+    for ax, (points, x, xlabel, maximize_x, title) in zip(axes, panels):
+        ax.scatter([p[x] for p in points], [p["recall"] for p in points], s=12, alpha=0.5, label="cấu hình")
+        front = pareto_front(points, x, "recall", maximize_x)
+        ax.plot([p[x] for p in front], [p["recall"] for p in front], "r.-", label="Pareto")
+        for p in front:
+            label = f"M={p['M']},efc={p['ef_construction']}" + (f",ef={p['ef']}" if points is rows else "")
+            ax.annotate(label, (p[x], p["recall"]), fontsize=7, xytext=(3, -9), textcoords="offset points")
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(f"recall@{rows[0]['k']}")
+        ax.set_title(title)
+        ax.grid(alpha=0.3)
+        ax.legend()
+    fig.suptitle(f"{dataset}: {rows[0]['n']:,} vector, {rows[0]['dim']} chiều")
+    fig.tight_layout()
+    path = os.path.join(out_dir, f"pareto_{dataset.replace(':', '_').replace(os.sep, '_')}.png")
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+    return path
+
+
+# ----------------- CHẠY -----------------
+def run_dataset(name: str, args, rng) -> list:
+    data, queries = load_dataset(name, args, rng)
+    print(f"\n== {name}: {len(data):,} vector, {len(queries)} truy vấn, {data.shape[1]} chiều ==")
+    print(f"{'M':>4} | {'efc':>5} | {'build (s)':>9} | {'index (MB)':>10} | {'ef':>5} | {'QPS':>10} | {'recall@' + str(args.k):>9}")
+    print("-" * 72)
+
+    # hnswlib cần ef >= k: ef nhỏ hơn k được nâng lên k, ghi lại đúng ef đã dùng và
+    # bỏ các giá trị trùng sau khi nâng
+    efs = sorted({max(ef, args.k) for ef in args.ef})
+
+    rows, truth = [], None
+    for M in args.M:
+        for ef_construction in args.ef_construction:
+            system, build_time, file_size = build(data, M, ef_construction, args.threads)
+            if truth is None:
+                # Kết quả chính xác không phụ thuộc tham số dựng: tính một lần cho cả tập
+                truth, _ = system.exact_knn(queries, args.k)
+            for ef in efs:
+                qps, recall = measure(system, queries, truth, ef, args.threads)
+                row = {
+                    "dataset": name, "n": len(data), "dim": int(data.shape[1]), "k": args.k,
+                    "M": M, "ef_construction": ef_construction, "ef": ef,
+                    "build_seconds": build_time, "index_file_size": file_size,
+                    "index_file_size_mb": file_size / 2**20, "bytes_per_vector": file_size / len(data),
+                    "qps": qps, "recall": recall,
+                }
+                rows.append(row)
+                print(f"{M:>4} | {ef_construction:>5} | {build_time:>9.2f} | {file_size / 2**20:>10.1f} | "
+                      f"{ef:>5} | {qps:>10,.0f} | {recall:>9.4f}")
+            del system
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Quét M / ef_construction của HNSW")
+    ap.add_argument("--datasets", nargs="+", default=["uniform", "clustered"],
+                    help="uniform, clustered, mongo, npy:PATH")
+    ap.add_argument("--n", type=int, default=100000, help="Số vector của tập tổng hợp")
+    ap.add_argument("--dim", type=int, default=128)
+    ap.add_argument("--identities", type=int, default=10000, help="Số người của tập clustered")
+    ap.add_argument("--queries", type=int, default=1000)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--M", type=int, nargs="+", default=[8, 16, 32, 64, 128])
+    ap.add_argument("--ef-construction", type=int, nargs="+", default=[50, 100, 200, 400])
+    ap.add_argument("--ef", type=int, nargs="+", default=[10, 20, 50, 100, 200, 400],
+                    help="Các ef khi tìm kiếm (ef < k được nâng lên k)")
+    ap.add_argument("--threads", type=int, default=-1, help="Số luồng hnswlib (-1 = mọi core)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default=os.path.join(current_dir, "results"), help="Thư mục ghi báo cáo")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    rows = []
+    for name in args.datasets:
+        rows.extend(run_dataset(name, args, rng))
+
+    json_path = os.path.join(args.out, "construction_sweep.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"params": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+    csv_path = os.path.join(args.out, "construction_sweep.csv")
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\nĐã ghi {json_path} và {csv_path}")
+
+    if plt is None:
+        print("Chưa cài matplotlib, bỏ qua biểu đồ Pareto.")
+        return
+    for name in args.datasets:
+        path = plot_pareto(name, [r for r in rows if r["dataset"] == name], args.out)
+        print(f"Biểu đồ Pareto: {path}")
+
+
+if __name__ == "__main__":
+    main()
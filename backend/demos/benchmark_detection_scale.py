@@ -0,0 +1,104 @@
+"""
+Đo độ trễ và recall của bước detect khuôn mặt (HOG) theo tỉ lệ thu nhỏ ảnh trên
+tập Demo_Final_Images.
+
+Với mỗi ảnh, kết quả detect ở độ phân giải đầy đủ được coi là đáp án; ở mỗi tỉ lệ,
+ảnh được thu nhỏ, detect, rồi đổi box về toạ độ gốc. Một khuôn mặt được tính là
+tìm thấy nếu có box trùng với đáp án (IoU >= --iou).
+
+Ví dụ:
+    python demos/benchmark_detection_scale.py
+    python demos/benchmark_detection_scale.py --limit 200 --upscale 4 --scales 1 0.5 0.25 0.125
+
+Ảnh LFW chỉ 250x250 px; dùng --upscale để giả lập ảnh upload độ phân giải cao
+(ví dụ --upscale 8 -> 2000x2000 px, gần 4MP).
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import face_recognition
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from faces_recognition.face_tracker import match_boxes
+from faces_recognition.pipeline import scale_boxes
+
+SAMPLE_IMAGES = os.path.join(parent_dir, "faces_recognition", "Demo_Final_Images")
+
+
+def load_images(limit: int, upscale: float):
+    paths = sorted(glob.glob(os.path.join(SAMPLE_IMAGES, "*", "*.jpg")))[:limit]
+    images = []
+    for path in paths:
+        image = face_recognition.load_image_file(path)
+        if upscale != 1:
+            h, w = image.shape[:2]
+            image = cv2.resize(image, (int(w * upscale), int(h * upscale)), interpolation=cv2.INTER_CUBIC)
+        images.append(image)
+    return images
+
+
+def detect_at_scale(image, scale: float):
+    """Detect trên ảnh thu nhỏ `scale` lần, trả về (box theo toạ độ gốc, thời gian ms)"""
+    start = time.perf_counter()
+    if scale != 1:
+        h, w = image.shape[:2]
+        small = cv2.resize(image, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))),
+                           interpolation=cv2.INTER_AREA)
+    else:
+        small = image
+    locations = face_recognition.face_locations(small, model="hog")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if scale != 1:
+        locations = scale_boxes(locations, scale, image.shape)
+    return locations, elapsed_ms
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Độ trễ / recall của detect theo tỉ lệ thu nhỏ")
+    ap.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.75, 0.5, 0.35, 0.25])
+    ap.add_argument("--limit", type=int, default=300, help="Số ảnh dùng để đo")
+    ap.add_argument("--upscale", type=float, default=1.0, help="Phóng to ảnh trước khi đo")
+    ap.add_argument("--iou", type=float, default=0.5, help="IoU tối thiểu để coi là cùng khuôn mặt")
+    args = ap.parse_args()
+
+    images = load_images(args.limit, args.upscale)
+    if not images:
+        print(f"Không tìm thấy ảnh trong {SAMPLE_IMAGES}")
+        return
+    h, w = images[0].shape[:2]
+    print(f"{len(images)} ảnh, kích thước ~{w}x{h} px")
+
+    # Đáp án: detect ở độ phân giải đầy đủ
+    reference = [detect_at_scale(image, 1.0)[0] for image in images]
+    total_faces = sum(len(boxes) for boxes in reference)
+
+    print(f"{'scale':>6} | {'px/ảnh':>9} | {'mean (ms)':>9} | {'p95 (ms)':>8} | {'recall':>7} | {'box thừa':>8}")
+    print("-" * 62)
+    for scale in args.scales:
+        times = []
+        found = 0
+        extra = 0
+        for image, ref in zip(images, reference):
+            boxes, elapsed_ms = detect_at_scale(image, scale)
+            times.append(elapsed_ms)
+            matched = match_boxes(ref, list(enumerate(boxes)), args.iou)
+            hits = sum(m is not None for m in matched)
+            found += hits
+            extra += len(boxes) - hits
+
+        recall = found / total_faces if total_faces else 0.0
+        pixels = int(w * scale) * int(h * scale)
+        print(f"{scale:>6.2f} | {pixels:>9,} | {np.mean(times):>9.1f} | {np.percentile(times, 95):>8.1f} | "
+              f"{recall:>7.3f} | {extra:>8}")
+
+
+if __name__ == "__main__":
+    main()
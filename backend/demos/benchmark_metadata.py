@@ -0,0 +1,77 @@
+"""
+So sánh bộ nhớ và tốc độ tra cứu giữa metadata dạng dict of dicts (cách cũ) và
+MetadataTable (buffer UTF-8 + offsets) ở 100k, 1M người.
+
+Ví dụ:
+    python demos/benchmark_metadata.py
+    python demos/benchmark_metadata.py --sizes 100000 1000000 5000000 --queries 64 --k 5
+
+Bộ nhớ của dict đo bằng tracemalloc (gồm dict ngoài, dict từng người và các str);
+bộ nhớ của bảng là tổng kích thước các mảng numpy.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from faces_recognition.metadata_table import MetadataTable
+
+
+def make_info(i: int) -> dict:
+    return {"MSSV": f"{2000000 + i}", "Ten": f"Nguyen Van {i}", "MongoID": f"{i:024x}"}
+
+
+def build_dict(n: int):
+    tracemalloc.start()
+    mapping = {i: make_info(i) for i in range(n)}
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return mapping, size
+
+
+def build_table(n: int) -> MetadataTable:
+    table = MetadataTable()
+    for i in range(n):
+        table[i] = make_info(i)
+    return table.compacted()
+
+
+def bench_lookup(get_batch, labels: np.ndarray, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        get_batch(labels)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bộ nhớ / tốc độ tra cứu metadata: dict vs MetadataTable")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    ap.add_argument("--queries", type=int, default=64, help="Số khuôn mặt trong một batch truy vấn")
+    ap.add_argument("--k", type=int, default=5, help="Số ứng viên mỗi khuôn mặt")
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    print(f"{'N':>10} | {'dict (MB)':>10} | {'bảng (MB)':>10} | {'tỉ lệ':>6} | "
+          f"{'dict tra (ms)':>13} | {'bảng tra (ms)':>13}")
+    print("-" * 78)
+    for n in args.sizes:
+        mapping, dict_bytes = build_dict(n)
+        table = build_table(n)
+        labels = np.random.randint(0, n, size=(args.queries, args.k))
+
+        dict_ms = bench_lookup(lambda ls: [mapping.get(int(l)) for l in ls.ravel()], labels, args.repeat)
+        table_ms = bench_lookup(table.get_many, labels, args.repeat)
+        print(f"{n:>10,} | {dict_bytes / 2**20:>10.1f} | {table.nbytes / 2**20:>10.1f} | "
+              f"{dict_bytes / table.nbytes:>5.1f}x | {dict_ms:>13.3f} | {table_ms:>13.3f}")
+        del mapping, table
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Đo thông lượng cập nhật vector (set_items) của HNSWSearchSystem ở 10k, 100k, 1M
+phần tử, so với cách kiểm tra cũ (lấy + sắp xếp danh sách nhãn từ C++ cho mỗi id).
+
+Ví dụ:
+    python demos/benchmark_set_items.py
+    python demos/benchmark_set_items.py --sizes 10000 100000 --batch 2000
+
+Cách cũ tốn O(n·N log N) cho một lô n cập nhật nên chỉ đo trên vài id rồi suy ra
+thông lượng; cách mới kiểm tra trên tập nhãn mà wrapper tự giữ (O(n)).
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from hnsw import HNSWSearchSystem
+
+
+def build(num_elements: int, dim: int) -> HNSWSearchSystem:
+    system = HNSWSearchSystem(space='l2', dim=dim)
+    # M / ef_construction nhỏ để build 1M phần tử trong thời gian chấp nhận được
+    system.build_hnsw_index(max_elements=num_elements, ef_construction=40, M=8)
+    chunk = 100000
+    for start in range(0, num_elements, chunk):
+        end = min(start + chunk, num_elements)
+        system.add_items(np.float32(np.random.random((end - start, dim))), np.arange(start, end))
+    return system
+
+
+def old_membership_check(system: HNSWSearchSystem, ids) -> bool:
+    # Cách cũ: mỗi id lại lấy và sắp xếp toàn bộ danh sách nhãn từ C++
+    return all(item in sorted(system.index.get_ids_list()) for item in ids)
+
+
+def bench_set_items(system: HNSWSearchSystem, num_updates: int, batch: int, dim: int) -> float:
+    size = system.get_size()
+    start = time.perf_counter()
+    done = 0
+    while done < num_updates:
+        n = min(batch, num_updates - done)
+        ids = np.random.randint(0, size, n)
+        system.set_items(np.float32(np.random.random((n, dim))), ids)
+        done += n
+    return num_updates / (time.perf_counter() - start)
+
+
+def bench_old(system: HNSWSearchSystem, num_checks: int) -> float:
+    ids = np.random.randint(0, system.get_size(), num_checks)
+    start = time.perf_counter()
+    old_membership_check(system, ids)
+    return num_checks / (time.perf_counter() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Đo thông lượng set_items")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    ap.add_argument("--dim", type=int, default=128)
+    ap.add_argument("--updates", type=int, default=20000, help="Số vector cập nhật mỗi cỡ index")
+    ap.add_argument("--batch", type=int, default=1000, help="Số vector mỗi lần gọi set_items")
+    ap.add_argument("--old-checks", type=int, default=5, help="Số id đo với cách kiểm tra cũ")
+    args = ap.parse_args()
+
+    print(f"{'N':>9} | {'build (s)':>9} | {'set_items (vec/s)':>17} | {'kiểm tra cũ (id/s)':>18}")
+    print("-" * 64)
+    for n in args.sizes:
+        t0 = time.perf_counter()
+        system = build(n, args.dim)
+        build_time = time.perf_counter() - t0
+
+        new_rate = bench_set_items(system, args.updates, args.batch, args.dim)
+        old_rate = bench_old(system, args.old_checks)
+        print(f"{n:>9} | {build_time:>9.1f} | {new_rate:>17,.0f} | {old_rate:>18,.1f}")
+
+
+if __name__ == "__main__":
+    main()
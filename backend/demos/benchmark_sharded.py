@@ -0,0 +1,119 @@
+"""
+So sánh một index HNSW với ShardedHNSWSearchSystem (N shard) ở 1M, 5M vector:
+thời gian build, QPS khi truy vấn theo batch và từng vector một, recall@k so với
+kết quả chính xác (brute force trên một mẫu truy vấn).
+
+Ví dụ:
+    python demos/benchmark_sharded.py
+    python demos/benchmark_sharded.py --sizes 100000 1000000 --shards 2 4 8 --threads 8
+
+Dữ liệu ngẫu nhiên được sinh theo từng khối và dùng chung cho mọi cấu hình. 5M
+vector 128 chiều tốn khoảng 2.5 GB cho dữ liệu cộng 3 GB cho mỗi index, nên chỉ
+chạy cỡ đó trên máy đủ RAM.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from hnsw import HNSWSearchSystem, ShardedHNSWSearchSystem
+
+CHUNK = 100000
+
+
+def make_data(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    data = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, CHUNK):
+        end = min(start + CHUNK, n)
+        data[start:end] = rng.random((end - start, dim), dtype=np.float32)
+    return data
+
+
+def exact_knn(data: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Nhãn top-k chính xác (L2) của queries, duyệt data theo khối để giới hạn bộ nhớ"""
+    best_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_l = np.zeros((len(queries), k), dtype=np.int64)
+    q_norms = np.einsum('ij,ij->i', queries, queries)[:, None]
+    for start in range(0, len(data), CHUNK):
+        block = data[start:start + CHUNK]
+        d = q_norms + np.einsum('ij,ij->i', block, block)[None, :] - 2 * queries @ block.T
+        cand_d = np.concatenate([best_d, d], axis=1)
+        cand_l = np.concatenate([best_l, np.broadcast_to(np.arange(start, start + len(block)), d.shape)], axis=1)
+        top = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+        best_d = np.take_along_axis(cand_d, top, axis=1)
+        best_l = np.take_along_axis(cand_l, top, axis=1)
+    return best_l
+
+
+def build(system, data: np.ndarray, args) -> float:
+    start = time.perf_counter()
+    system.build_hnsw_index(max_elements=len(data), ef_construction=args.ef_construction, M=args.M)
+    for s in range(0, len(data), CHUNK * 5):
+        e = min(s + CHUNK * 5, len(data))
+        system.add_items(data[s:e], np.arange(s, e), num_threads=args.threads)
+    system.set_ef(args.ef)
+    return time.perf_counter() - start
+
+
+def bench_queries(system, queries: np.ndarray, k: int, threads: int) -> tuple:
+    """(QPS batch, QPS từng vector, nhãn trả về của batch)"""
+    start = time.perf_counter()
+    labels, _ = system.knn_query(queries, k=k, num_threads=threads)
+    batch_qps = len(queries) / (time.perf_counter() - start)
+
+    single = queries[:min(len(queries), 500)]
+    start = time.perf_counter()
+    for q in single:
+        system.knn_query(q, k=k, num_threads=threads)
+    single_qps = len(single) / (time.perf_counter() - start)
+    return batch_qps, single_qps, labels
+
+
+def recall(labels: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(labels.tolist(), truth.tolist())]))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="HNSW một index vs nhiều shard")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000000, 5000000])
+    ap.add_argument("--shards", type=int, nargs="+", default=[4])
+    ap.add_argument("--dim", type=int, default=128)
+    ap.add_argument("--M", type=int, default=16)
+    ap.add_argument("--ef-construction", type=int, default=100)
+    ap.add_argument("--ef", type=int, default=50)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--truth-queries", type=int, default=200, help="Số truy vấn dùng để tính recall")
+    ap.add_argument("--threads", type=int, default=-1, help="Tổng số luồng hnswlib (-1 = mọi core)")
+    args = ap.parse_args()
+
+    print(f"{'N':>9} | {'index':>9} | {'build (s)':>9} | {'QPS batch':>10} | {'QPS đơn':>9} | {'recall@' + str(args.k):>9}")
+    print("-" * 70)
+    for n in args.sizes:
+        data = make_data(n, args.dim)
+        queries = np.random.default_rng(1).random((args.queries, args.dim), dtype=np.float32)
+        truth = exact_knn(data, queries[:args.truth_queries], args.k)
+
+        configs = [("1 index", lambda: HNSWSearchSystem(space='l2', dim=args.dim))]
+        configs += [(f"{s} shard", lambda s=s: ShardedHNSWSearchSystem(space='l2', dim=args.dim, num_shards=s))
+                    for s in args.shards]
+        for name, factory in configs:
+            system = factory()
+            build_time = build(system, data, args)
+            batch_qps, single_qps, labels = bench_queries(system, queries, args.k, args.threads)
+            r = recall(labels[:args.truth_queries], truth)
+            print(f"{n:>9} | {name:>9} | {build_time:>9.1f} | {batch_qps:>10,.0f} | {single_qps:>9,.0f} | {r:>9.3f}")
+            del system
+        del data
+
+
+if __name__ == "__main__":
+    main()
@@ -52,16 +52,16 @@ bins = 32
 imageDataBase = HNSWSearchSystem(space='l2', dim = bins*3)
 # Build index với các tham số phù hợp cho ảnh
 imageDataBase.build_hnsw_index(
-    max_elements=100000,  # Số lượng ảnh tối đa
+    max_elements=len(images),  # Sức chứa ban đầu, add_items tự nới khi thêm ảnh mới
     ef_construction=20,  # Trade-off build time vs quality
     M=16              # Trade-off memory vs accuracy
 )
 # Thiết lập ef cho search
 imageDataBase.set_ef(10)  # Tăng ef để có độ chính xác cao hơn
 
-# thêm vector đặc trưng ảnh vào đồ thị
-for image in images:
-    imageDataBase.add_items(get_vector(image,bins))
+# thêm vector đặc trưng ảnh vào đồ thị theo lô: trích đặc trưng ảnh kế tiếp trong lúc
+# lô trước đang được chèn
+imageDataBase.bulk_add((get_vector(image, bins) for image in images), batch_size=256)
 
 query_image1 = images[28]
 query_image2 = imread_from_url("https://cdn.pixabay.com/photo/2020/10/17/11/06/pizza-5661748_1280.jpg")
@@ -0,0 +1,150 @@
+"""
+So sánh thông lượng / độ trễ giữa bản Flask (gunicorn) và bản ASGI (uvicorn) khi
+nhiều client gửi frame cùng lúc, có thêm các client upload chậm.
+
+Chạy hai server trước (cùng số worker để so sánh công bằng):
+    gunicorn -c gunicorn.conf.py app:app                                   # cổng 10000
+    uvicorn asgi_app:app --host 0.0.0.0 --port 10001 --workers 2           # cổng 10001
+
+Rồi:
+    python demos/load_test.py
+    python demos/load_test.py --clients 32 --slow-clients 16 --duration 30
+    python demos/load_test.py --targets flask=http://localhost:10000 --endpoint recognize_image
+
+Client upload chậm gửi header + body từng byte một (--slow-interval giây/byte): với
+Flask mỗi client như vậy giữ một luồng worker suốt thời gian upload, với ASGI thì không.
+"""
+import argparse
+import glob
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+
+SAMPLE_IMAGES = os.path.join(parent_dir, "faces_recognition", "Demo_Final_Images")
+
+
+def load_frames(limit: int) -> list:
+    paths = sorted(glob.glob(os.path.join(SAMPLE_IMAGES, "*", "*.jpg")))[:limit]
+    frames = []
+    for path in paths:
+        with open(path, "rb") as f:
+            frames.append(f.read())
+    return frames
+
+
+def send_request(session, base_url, endpoint, frame, mode):
+    if endpoint == "recognize_image":
+        return session.post(f"{base_url}/recognize_image", params={"mode": mode, "crops": "none"},
+                            files={"file": ("frame.jpg", frame, "image/jpeg")}, timeout=60)
+    return session.post(f"{base_url}/recognize_frame", params={"mode": mode}, data=frame,
+                        headers={"Content-Type": "image/jpeg"}, timeout=60)
+
+
+def client_loop(base_url, endpoint, frames, mode, deadline, offset):
+    """Một client gửi liên tục tới hết thời gian đo; trả về [(độ trễ ms, mã trạng thái)]"""
+    session = requests.Session()
+    samples = []
+    i = offset
+    while time.time() < deadline:
+        frame = frames[i % len(frames)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            status = send_request(session, base_url, endpoint, frame, mode).status_code
+        except requests.exceptions.RequestException:
+            status = "error"
+        samples.append(((time.perf_counter() - start) * 1000, status))
+    return samples
+
+
+def slow_upload(base_url, frame, interval, deadline, stop):
+    """Mở kết nối, gửi header rồi nhỏ giọt body tới hết thời gian đo (không bao giờ gửi xong)"""
+    url = urlparse(base_url)
+    try:
+        sock = socket.create_connection((url.hostname, url.port or 80), timeout=10)
+    except OSError:
+        return
+    try:
+        sock.sendall((f"POST /recognize_frame HTTP/1.1\r\nHost: {url.hostname}\r\n"
+                      f"Content-Type: image/jpeg\r\nContent-Length: {len(frame) * 1000}\r\n\r\n").encode())
+        while time.time() < deadline and not stop.is_set():
+            sock.sendall(frame[:1])
+            time.sleep(interval)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+def run_target(name, base_url, args, frames):
+    try:
+        requests.get(base_url + "/", timeout=5)
+    except requests.exceptions.RequestException:
+        print(f"{name:>8} | không kết nối được {base_url}, bỏ qua")
+        return
+
+    deadline = time.time() + args.duration
+    stop = threading.Event()
+    slow_threads = [threading.Thread(target=slow_upload, args=(base_url, frames[0], args.slow_interval, deadline, stop),
+                                     daemon=True) for _ in range(args.slow_clients)]
+    for t in slow_threads:
+        t.start()
+    # Để các client chậm chiếm chỗ trước
+    time.sleep(0.5 if slow_threads else 0)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        futures = [pool.submit(client_loop, base_url, args.endpoint, frames, args.mode, deadline, i)
+                   for i in range(args.clients)]
+        samples = [s for f in futures for s in f.result()]
+    elapsed = time.time() - start
+    stop.set()
+
+    latencies = np.array([ms for ms, status in samples if status == 200])
+    statuses = Counter(str(status) for _, status in samples)
+    if len(latencies) == 0:
+        print(f"{name:>8} | không có request thành công: {dict(statuses)}")
+        return
+    print(f"{name:>8} | {len(latencies) / elapsed:>8.1f} | {np.percentile(latencies, 50):>8.1f} | "
+          f"{np.percentile(latencies, 95):>8.1f} | {np.percentile(latencies, 99):>8.1f} | {dict(statuses)}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test Flask vs ASGI")
+    ap.add_argument("--targets", nargs="+", default=["flask=http://localhost:10000", "asgi=http://localhost:10001"],
+                    help="Danh sách tên=url")
+    ap.add_argument("--endpoint", choices=["recognize_frame", "recognize_image"], default="recognize_frame")
+    ap.add_argument("--mode", default="hnsw", choices=["hnsw", "bruteforce"])
+    ap.add_argument("--clients", type=int, default=16, help="Số client gửi liên tục")
+    ap.add_argument("--slow-clients", type=int, default=0, help="Số client upload chậm")
+    ap.add_argument("--slow-interval", type=float, default=1.0, help="Giây giữa hai byte của client chậm")
+    ap.add_argument("--duration", type=float, default=20, help="Thời gian đo mỗi server (giây)")
+    ap.add_argument("--frames", type=int, default=50, help="Số ảnh mẫu dùng làm frame")
+    args = ap.parse_args()
+
+    frames = load_frames(args.frames)
+    if not frames:
+        print(f"Không tìm thấy ảnh trong {SAMPLE_IMAGES}")
+        return
+
+    print(f"{args.clients} client, {args.slow_clients} client chậm, {args.duration:.0f}s / server, "
+          f"endpoint /{args.endpoint}")
+    print(f"{'server':>8} | {'req/s':>8} | {'p50 (ms)':>8} | {'p95 (ms)':>8} | {'p99 (ms)':>8} | mã trạng thái")
+    print("-" * 80)
+    for target in args.targets:
+        name, _, url = target.partition("=")
+        run_target(name, url.rstrip("/"), args, frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Đo bộ nhớ (RSS / PSS) của từng worker gunicorn khi phục vụ index HNSW với
+1, 2, 4, 8 worker. Chỉ chạy được trên Linux (đọc /proc/<pid>/smaps_rollup).
+
+Ví dụ:
+    python demos/worker_rss.py
+    python demos/worker_rss.py --workers 1 2 4 --read-only --requests 50
+
+PSS (Proportional Set Size) chia đều các trang dùng chung cho các tiến trình,
+nên nếu index được chia sẻ đúng cách thì tổng PSS gần như không tăng theo số worker.
+"""
+import argparse
+import glob
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+
+SAMPLE_IMAGES = os.path.join(parent_dir, "faces_recognition", "Demo_Final_Images")
+
+
+def read_memory_kb(pid: int) -> dict:
+    """Đọc Rss, Pss, Shared_*, Private_* (kB) của một tiến trình."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[-1] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(pid: int) -> list:
+    pids = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        with open(path) as f:
+            pids.extend(int(p) for p in f.read().split())
+    return pids
+
+
+def wait_until_ready(url: str, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+def send_requests(url: str, num_requests: int) -> None:
+    """Gửi một số request thật để các worker chạm vào đường tìm kiếm."""
+    images = sorted(glob.glob(os.path.join(SAMPLE_IMAGES, "*", "*.jpg")))[:max(num_requests, 1)]
+    for i in range(num_requests):
+        with open(images[i % len(images)], "rb") as f:
+            try:
+                requests.post(f"{url}/recognize_image", files={"file": f}, timeout=60)
+            except requests.exceptions.RequestException as e:
+                print(f"[WARN] Request lỗi: {e}")
+
+
+def measure(num_workers: int, port: int, read_only: bool, num_requests: int, timeout: float) -> dict:
+    env = dict(os.environ)
+    env["WEB_CONCURRENCY"] = str(num_workers)
+    env["GUNICORN_BIND"] = f"127.0.0.1:{port}"
+    if read_only:
+        env["INDEX_READ_ONLY"] = "1"
+
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=parent_dir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        if not wait_until_ready(url, timeout):
+            raise RuntimeError(f"Server với {num_workers} worker không khởi động được trong {timeout}s")
+
+        send_requests(url, num_requests)
+        time.sleep(1)
+
+        master = read_memory_kb(proc.pid)
+        workers = [read_memory_kb(pid) for pid in child_pids(proc.pid)]
+        return {"master": master, "workers": workers}
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Đo RSS/PSS của các worker gunicorn")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    ap.add_argument("--port", type=int, default=18000)
+    ap.add_argument("--read-only", action="store_true", help="Bật INDEX_READ_ONLY=1 (metadata mmap)")
+    ap.add_argument("--requests", type=int, default=20, help="Số request gửi trước khi đo")
+    ap.add_argument("--timeout", type=float, default=600, help="Thời gian chờ server khởi động (s)")
+    args = ap.parse_args()
+
+    print(f"{'workers':>7} | {'RSS/worker (MB)':>15} | {'PSS/worker (MB)':>15} | "
+          f"{'private/worker (MB)':>19} | {'tổng PSS (MB)':>13}")
+    print("-" * 82)
+    for n in args.workers:
+        result = measure(n, args.port, args.read_only, args.requests, args.timeout)
+        workers = result["workers"]
+        if not workers:
+            print(f"{n:>7} | không tìm thấy worker")
+            continue
+        avg = lambda key: sum(w[key] for w in workers) / len(workers) / 1024
+        total_pss = (result["master"]["pss"] + sum(w["pss"] for w in workers)) / 1024
+        print(f"{n:>7} | {avg('rss'):>15.1f} | {avg('pss'):>15.1f} | {avg('private'):>19.1f} | {total_pss:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,198 @@
 import os
+import argparse
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 import numpy as np
-from pymongo import MongoClient
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
 import face_recognition
 from dotenv import load_dotenv
 
 load_dotenv()
-uri = os.getenv("MONGO_URI")
-
-if not uri:
-    raise ValueError("Lỗi: Không tìm thấy biến MONGO_URI trong file .env")
-client = MongoClient(uri)
-db = client['FaceRecProject']
-collection = db['PeopleMetadata']
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 image_stored = os.path.join(current_dir, "Demo_Final_Images")
 
-def update_vectors():
-    documents = collection.find({})
-    count = 0
-    for doc in documents:
-        doc_id = doc['_id']
-        relative_path = doc['File_Path_Demo']
-        full_image_path = os.path.join(image_stored, relative_path)
-
-        if os.path.exists(full_image_path):
-            try:
-                image = face_recognition.load_image_file(full_image_path)
-                all_faces = face_recognition.face_encodings(image)
-
-                if len(all_faces) > 0:
-                    face_vector = all_faces[0]
-                    result_vector = face_vector.tolist()
-                    #print(result_vector)
-                    collection.update_one(
-                        {'_id': doc_id},
-                        {'$set': {'feature_vector': result_vector}}
-                    )
-                    print(f"Updated: {doc['Ten']}")
-                    count += 1
+# Số document đọc mỗi trang / số lệnh update gộp trong một bulk_write
+PAGE_SIZE = int(os.getenv("IMPORT_PAGE_SIZE", "500"))
+WRITE_BATCH = int(os.getenv("IMPORT_WRITE_BATCH", "200"))
+# File lưu tiến độ (_id cuối cùng đã ghi xong) để chạy tiếp khi bị ngắt giữa chừng
+CHECKPOINT_PATH = os.getenv("IMPORT_CHECKPOINT", os.path.join(current_dir, ".import_checkpoint.json"))
+# Đổi giá trị này khi đổi model encode để mọi ảnh được encode lại dù nội dung không đổi
+ENCODER_VERSION = os.getenv("ENCODER_VERSION", "face_recognition_dlib_v1")
+
+
+def get_collection():
+    uri = os.getenv("MONGO_URI")
+    if not uri:
+        raise ValueError("Lỗi: Không tìm thấy biến MONGO_URI trong file .env")
+    client = MongoClient(uri)
+    return client['FaceRecProject']['PeopleMetadata']
+
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encode_image(task):
+    """
+    Chạy trong tiến trình con: băm nội dung ảnh, bỏ qua nếu ảnh và model không
+    đổi so với lần encode trước, ngược lại decode + encode khuôn mặt đầu tiên.
+
+    Input: (doc_id, đường dẫn ảnh, image_hash cũ hoặc None)
+    Output: (doc_id, status, vector hoặc None, image_hash hoặc thông báo lỗi)
+    """
+    doc_id, full_image_path, known_hash = task
+    if not os.path.isfile(full_image_path):
+        return doc_id, "missing", None, None
+    try:
+        digest = file_hash(full_image_path)
+        if digest == known_hash:
+            return doc_id, "skipped", None, digest
+
+        image = face_recognition.load_image_file(full_image_path)
+        all_faces = face_recognition.face_encodings(image)
+        if len(all_faces) == 0:
+            return doc_id, "no_face", None, digest
+        return doc_id, "ok", np.asarray(all_faces[0], dtype=np.float64).tolist(), digest
+    except Exception as e:
+        return doc_id, "error", None, str(e)
+
+
+def load_checkpoint(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def flush_updates(collection, ops):
+    if ops:
+        collection.bulk_write(ops, ordered=False)
+        ops.clear()
+
+
+def update_vectors(workers=None, page_size=PAGE_SIZE, write_batch=WRITE_BATCH,
+                   force=False, restart=False, checkpoint_path=CHECKPOINT_PATH):
+    """
+    Encode lại feature_vector cho toàn bộ collection.
+
+    Args:
+        workers: Số tiến trình encode (mặc định = số CPU)
+        page_size: Số document đọc mỗi trang (phân trang theo _id)
+        write_batch: Số UpdateOne gộp trong một bulk_write
+        force: Encode lại cả những ảnh không đổi
+        restart: Bỏ qua checkpoint cũ, chạy lại từ đầu
+    """
+    collection = get_collection()
+
+    state = None if restart else load_checkpoint(checkpoint_path)
+    if state and state.get("encoder_version") != ENCODER_VERSION:
+        state = None
+    if state:
+        print(f"Resuming after _id {state['last_id']} ({state['updated']} updated so far)")
+    else:
+        state = {"last_id": None, "encoder_version": ENCODER_VERSION,
+                 "updated": 0, "skipped": 0, "no_face": 0, "missing": 0, "error": 0}
+    # Checkpoint của bản cũ chưa có bộ đếm này
+    state.setdefault("no_image", 0)
+
+    projection = {"_id": 1, "File_Path_Demo": 1, "Ten": 1, "image_hash": 1, "encoder_version": 1}
+    start_time = time.time()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            query = {}
+            if state["last_id"] is not None:
+                query["_id"] = {"$gt": ObjectId(state["last_id"])}
+            page = list(collection.find(query, projection).sort("_id", 1).limit(page_size))
+            if not page:
+                break
+
+            names = {}
+            tasks = []
+            for doc in page:
+                if not doc.get('File_Path_Demo'):
+                    # Document tạo qua API /enroll không có ảnh gốc trong Demo_Final_Images:
+                    # giữ nguyên feature_vector, không gửi sang pool
+                    state["no_image"] += 1
+                    continue
+                doc_id = str(doc['_id'])
+                names[doc_id] = (doc['_id'], doc.get('Ten', doc_id))
+                known_hash = None
+                if not force and doc.get("encoder_version") == ENCODER_VERSION:
+                    known_hash = doc.get("image_hash")
+                tasks.append((doc_id, os.path.join(image_stored, doc['File_Path_Demo']), known_hash))
+
+            ops = []
+            chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))
+            for doc_id, status, vector, info in pool.map(encode_image, tasks, chunksize=chunksize):
+                mongo_id, name = names[doc_id]
+                if status == "ok":
+                    ops.append(UpdateOne(
+                        {'_id': mongo_id},
+                        {'$set': {'feature_vector': vector,
+                                  'image_hash': info,
+                                  'encoder_version': ENCODER_VERSION,
+                                  'updated_at': datetime.now(timezone.utc)}}
+                    ))
+                    state["updated"] += 1
+                    if len(ops) >= write_batch:
+                        flush_updates(collection, ops)
+                elif status == "skipped":
+                    state["skipped"] += 1
+                elif status == "no_face":
+                    print(f"No face found: {name}")
+                    state["no_face"] += 1
+                elif status == "missing":
+                    print(f"Path not found: {name}")
+                    state["missing"] += 1
                 else:
-                    print(f"No face found: {doc['Ten']}")
-            except Exception as e:
-                print(f"Error {doc['Ten']}: {e}")
-        else:
-            print(f"Path not found: {full_image_path}")
+                    print(f"Error {name}: {info}")
+                    state["error"] += 1
+            flush_updates(collection, ops)
+
+            # Chỉ ghi checkpoint khi cả trang đã được ghi xuống Mongo
+            state["last_id"] = str(page[-1]['_id'])
+            save_checkpoint(checkpoint_path, state)
+            processed = sum(state[key] for key in ("updated", "skipped", "no_face", "missing", "error", "no_image"))
+            print(f"Page done: {processed} processed, {state['updated']} updated, "
+                  f"{processed / max(time.time() - start_time, 1e-9):.1f} docs/s")
+
+    if os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(f"Done. Updated {state['updated']} documents "
+          f"(skipped {state['skipped']} unchanged, {state['no_face']} no face, "
+          f"{state['missing']} missing, {state['error']} errors, "
+          f"{state['no_image']} without an image file).")
+    return state
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Encode ảnh trong Demo_Final_Images và ghi feature_vector lên MongoDB")
+    ap.add_argument("--workers", type=int, default=None, help="Số tiến trình encode (mặc định = số CPU)")
+    ap.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    ap.add_argument("--write-batch", type=int, default=WRITE_BATCH)
+    ap.add_argument("--force", action="store_true", help="Encode lại cả ảnh không đổi")
+    ap.add_argument("--restart", action="store_true", help="Bỏ qua checkpoint, chạy lại từ đầu")
+    args = ap.parse_args()
+    update_vectors(workers=args.workers, page_size=args.page_size, write_batch=args.write_batch,
+                   force=args.force, restart=args.restart)
 
-    print(f"Done. Updated {count} documents.")
 
 if __name__ == "__main__":
-    update_vectors()
\ No newline at end of file
+    main()
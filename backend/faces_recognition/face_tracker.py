@@ -0,0 +1,215 @@
+"""
+Theo dõi khuôn mặt qua các frame liên tiếp của cùng một phiên webcam (IoU tracking).
+
+Khuôn mặt ở frame mới có box trùng đủ nhiều (IoU) với một track còn "mới" thì dùng
+lại danh tính + encoding của track đó, không encode / tìm kiếm lại. Mỗi track được
+encode lại sau REENCODE_EVERY frame, hoặc khi box dịch chuyển nhiều (IoU thấp).
+
+Module không import face_recognition để hàm match_boxes dùng được cả trong tiến
+trình encode lẫn tiến trình web.
+"""
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+
+IOU_THRESHOLD = float(os.getenv("TRACK_IOU", "0.5"))
+REENCODE_EVERY = int(os.getenv("TRACK_REENCODE_EVERY", "5"))
+MAX_MISSED = int(os.getenv("TRACK_MAX_MISSED", "2"))
+SESSION_TTL = float(os.getenv("TRACK_SESSION_TTL", "60"))
+MAX_SESSIONS = int(os.getenv("TRACK_MAX_SESSIONS", "1000"))
+
+# Tăng mỗi khi dữ liệu người dùng đổi (enroll / xoá / cập nhật): mọi tracker
+# thấy thế hệ mới sẽ bỏ các danh tính đã cache. Nằm trong bộ nhớ chia sẻ tạo lúc
+# import: với preload_app của gunicorn module được import ở master trước khi fork,
+# nên mọi worker dùng chung một bộ đếm (worker tạo bằng spawn thì mỗi tiến trình một bộ đếm riêng)
+_generation = multiprocessing.Value("q", 0)
+
+
+def current_generation():
+    return _generation.value
+
+
+def invalidate_all():
+    with _generation.get_lock():
+        _generation.value += 1
+
+
+def box_iou(a, b):
+    """IoU của 2 box theo định dạng face_recognition (top, right, bottom, left)"""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+def match_boxes(boxes, candidates, iou_threshold=IOU_THRESHOLD):
+    """
+    Ghép tham lam (IoU cao nhất trước) mỗi box với tối đa một candidate.
+
+    Args:
+        boxes: list box của frame hiện tại
+        candidates: list (key, box)
+    Returns:
+        list cùng độ dài boxes, phần tử là key của candidate được ghép hoặc None
+    """
+    pairs = []
+    for i, box in enumerate(boxes):
+        for key, cand in candidates:
+            iou = box_iou(box, cand)
+            if iou >= iou_threshold:
+                pairs.append((iou, i, key))
+    pairs.sort(key=lambda p: p[0], reverse=True)
+
+    matched = [None] * len(boxes)
+    used = set()
+    for _, i, key in pairs:
+        if matched[i] is None and key not in used:
+            matched[i] = key
+            used.add(key)
+    return matched
+
+
+class Track:
+    def __init__(self, track_id, box, encoding, result):
+        self.id = track_id
+        self.box = box
+        self.encoding = encoding
+        self.result = result
+        self.age = 0      # số frame kể từ lần encode gần nhất
+        self.missed = 0   # số frame liên tiếp không thấy
+
+
+class FaceTracker:
+    """Trạng thái tracking của một phiên (một kết nối WebSocket / một session HTTP)."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, iou_threshold=IOU_THRESHOLD, reencode_every=REENCODE_EVERY, max_missed=MAX_MISSED):
+        self.iou_threshold = iou_threshold
+        self.reencode_every = reencode_every
+        self.max_missed = max_missed
+        self.tracks = {}
+        self.generation = current_generation()
+        # Chế độ + tham số tìm kiếm mà kết quả của các track được tính theo
+        self.search_key = None
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self.frames = 0
+        self.reused = 0
+        self.encoded = 0
+
+    def reusable_boxes(self, search_key=None):
+        """
+        Các (track_id, box) còn dùng lại được, gửi kèm frame cho tiến trình encode.
+
+        Args:
+            search_key: chế độ + tham số tìm kiếm của frame này (mode, k, threshold,
+                margin); khác với frame trước thì kết quả đã cache không còn đúng, bỏ mọi track
+        """
+        generation = current_generation()
+        if self.generation != generation or self.search_key != search_key:
+            self.reset()
+            self.generation = generation
+            self.search_key = search_key
+        return [(t.id, t.box) for t in self.tracks.values() if t.age < self.reencode_every]
+
+    def update(self, locations, reuse, encodings, results):
+        """
+        Cập nhật track sau một frame.
+
+        Args:
+            locations: box mọi khuôn mặt phát hiện được
+            reuse: reuse[i] = track_id nếu khuôn mặt i dùng lại track (không encode), None nếu đã encode
+            encodings: vector của các khuôn mặt đã encode (theo thứ tự xuất hiện trong locations)
+            results: kết quả tìm kiếm tương ứng encodings
+        Returns:
+            list (track_id, kết quả tìm kiếm, reused) cùng độ dài locations
+        """
+        self.last_used = time.time()
+        self.frames += 1
+        seen = set()
+        out = [None] * len(locations)
+
+        # 1. Khuôn mặt dùng lại track cũ: giữ danh tính, chỉ cập nhật box
+        for i, track_id in enumerate(reuse):
+            track = self.tracks.get(track_id) if track_id is not None else None
+            if track is None:
+                continue
+            track.box = locations[i]
+            track.age += 1
+            track.missed = 0
+            seen.add(track.id)
+            out[i] = (track.id, track.result, True)
+            self.reused += 1
+
+        # 2. Khuôn mặt vừa encode: ghép với track chưa dùng (để giữ track_id) hoặc tạo mới
+        fresh = [i for i, track_id in enumerate(reuse) if track_id is None]
+        free = [(t.id, t.box) for t in self.tracks.values() if t.id not in seen]
+        matched = match_boxes([locations[i] for i in fresh], free, self.iou_threshold)
+        for j, i in enumerate(fresh):
+            if j >= len(results):
+                break
+            track = self.tracks.get(matched[j])
+            if track is None:
+                track = Track(next(self._ids), locations[i], encodings[j], results[j])
+                self.tracks[track.id] = track
+            else:
+                track.box, track.encoding, track.result = locations[i], encodings[j], results[j]
+                track.age = 0
+                track.missed = 0
+            seen.add(track.id)
+            out[i] = (track.id, track.result, False)
+            self.encoded += 1
+
+        # 3. Track không thấy quá MAX_MISSED frame thì bỏ
+        for track in list(self.tracks.values()):
+            if track.id not in seen:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    del self.tracks[track.id]
+        return out
+
+    def reset(self):
+        """Bỏ mọi track (ví dụ sau khi enroll / xoá người làm danh tính cũ không còn đúng)."""
+        self.tracks.clear()
+
+    def stats(self):
+        return {"tracks": len(self.tracks), "frames": self.frames,
+                "reused": self.reused, "encoded": self.encoded}
+
+
+class TrackerRegistry:
+    """Tracker theo session id cho HTTP (giới hạn số session, hết hạn sau SESSION_TTL giây)."""
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            tracker = self._sessions.pop(session_id, None)
+            if tracker is None or now - tracker.last_used > self.ttl:
+                tracker = FaceTracker()
+            self._sessions[session_id] = tracker
+
+            # Bỏ các session lâu không dùng / vượt giới hạn
+            while self._sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                if len(self._sessions) > self.max_sessions or now - oldest.last_used > self.ttl:
+                    del self._sessions[oldest_id]
+                else:
+                    break
+            return tracker
+
+    def __len__(self):
+        return len(self._sessions)
@@ -2,29 +2,91 @@ import numpy as np
 from pymongo import MongoClient
 import sys
 import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
 
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
+from bruteforce import BruteForceSearchSystem
+from faces_recognition.rwlock import ReadWriteLock
+from faces_recognition.metadata_table import MetadataTable
+from faces_recognition.result_cache import QueryResultCache
+from faces_recognition.search_batcher import SearchBatcher
 
 try:
     from hnsw import HNSWSearchSystem
+    from faces_recognition.index_snapshot import IndexSnapshot, collection_fingerprint, delta_query
 except ImportError:
         print("[WARN] Không tìm thấy module 'hnsw'")
+        HNSWSearchSystem = None
+        IndexSnapshot = None
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# Tham số quyết định mặc định (có thể ghi đè theo từng request)
+# - SEARCH_K: số ứng viên lấy về từ index trong một lần truy vấn
+# - SEARCH_THRESHOLD: ngưỡng khoảng cách tuyệt đối để coi là "found"
+# - SEARCH_MARGIN: chênh lệch tối thiểu giữa người gần nhất và người gần thứ hai
+DEFAULT_K = int(os.getenv("SEARCH_K", "5"))
+DEFAULT_THRESHOLD = float(os.getenv("SEARCH_THRESHOLD", "0.5"))
+DEFAULT_MARGIN = float(os.getenv("SEARCH_MARGIN", "0.0"))
+
+# ef khi tìm kiếm; được thay bằng ef đã tự chỉnh (lưu trong snapshot) nếu bật AUTOTUNE_RECALL
+DEFAULT_EF = int(os.getenv("SEARCH_EF", "50"))
+# Tự chỉnh ef sau khi build: chọn ef nhỏ nhất đạt recall@AUTOTUNE_K >= AUTOTUNE_RECALL
+# (0 = tắt) trên AUTOTUNE_SAMPLES truy vấn mẫu. Truy vấn mẫu là vector trong index cộng
+# nhiễu Gauss độ lệch AUTOTUNE_NOISE mỗi chiều, mô phỏng ảnh mới của người đã có
+# (khoảng cách cùng người của face_recognition cỡ 0.3-0.4 trên 128 chiều)
+AUTOTUNE_RECALL = float(os.getenv("AUTOTUNE_RECALL", "0"))
+AUTOTUNE_K = int(os.getenv("AUTOTUNE_K", str(DEFAULT_K)))
+AUTOTUNE_SAMPLES = int(os.getenv("AUTOTUNE_SAMPLES", "500"))
+AUTOTUNE_NOISE = float(os.getenv("AUTOTUNE_NOISE", "0.03"))
+
+# Tỉ lệ phần tử đã xoá (trên tổng số chỗ trong đồ thị) để kích hoạt build lại nền
+COMPACT_RATIO = float(os.getenv("INDEX_COMPACT_RATIO", "0.3"))
+
+# Tự nới index khi thêm vượt sức chứa: nhân max_elements với INDEX_GROWTH_FACTOR,
+# mỗi lần thêm tối đa INDEX_GROWTH_CAP chỗ (0 = không giới hạn)
+GROWTH_FACTOR = float(os.getenv("INDEX_GROWTH_FACTOR", "2.0"))
+GROWTH_CAP = int(os.getenv("INDEX_GROWTH_CAP", "0")) or None
+
+# Mỗi worker bắt kịp thay đổi do worker / tiến trình khác ghi vào MongoDB sau mỗi
+# INDEX_SYNC_INTERVAL giây (0 = tắt, chỉ thấy thay đổi đó khi khởi động lại)
+SYNC_INTERVAL = float(os.getenv("INDEX_SYNC_INTERVAL", "5"))
+
+# Nạp dữ liệu từ MongoDB khi build index:
+# - LOAD_BATCH_SIZE: số document mỗi lần cursor lấy về từ server
+# - LOAD_CHUNK_SIZE: số vector mỗi lần add_items (kích thước buffer float32 cấp sẵn)
+# - LOAD_THREADS: số luồng hnswlib dùng cho add_items (-1 = mọi core)
+LOAD_BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "10000"))
+LOAD_CHUNK_SIZE = int(os.getenv("LOAD_CHUNK_SIZE", "20000"))
+LOAD_THREADS = int(os.getenv("LOAD_THREADS", "-1"))
+# Projection khi nạp: chỉ lấy các trường cần cho index + metadata (_id luôn có)
+LOAD_PROJECTION = {"feature_vector": 1, "MSSV": 1, "Ten": 1}
+
 class FaceSearchEngine:
-    def __init__(self):
+    def __init__(self, read_only: bool = None):
+        """
+        Args:
+            read_only: Chế độ phục vụ chỉ-đọc (mặc định lấy từ biến môi trường
+                INDEX_READ_ONLY=1): nạp snapshot với metadata mở bằng mmap, không
+                replay / ghi snapshot, để các worker gunicorn dùng chung bộ nhớ.
+        """
+        if read_only is None:
+            read_only = os.getenv("INDEX_READ_ONLY", "0") == "1"
+        self.read_only = read_only
+
         # Cấu hình MongoDB
         self.uri = os.getenv("MONGO_URI")
         if not self.uri:
              raise ValueError("Chưa cấu hình MONGO_URI trong file .env")
-        self.client = MongoClient(self.uri)
-        self.collection = self.client['FaceRecProject']['PeopleMetadata']
+        self.connect()
         
         # Khởi tạo search system
         self.dim = 128
@@ -32,67 +94,634 @@ class FaceSearchEngine:
         
         # Nếu import được class wrapper thì dùng, không thì dùng thư viện gốc
         if HNSWSearchSystem:
-            self.search_system = HNSWSearchSystem(space='l2', dim=self.dim)
+            self.search_system = self._new_search_system()
         else:
             # Fallback dùng trực tiếp thư viện gốc nếu không có wrapper
             import hnswlib
             self.search_system = hnswlib.Index(space='l2', dim=self.dim)
 
-        self.metadata_mapping = {}
-    
+        # label -> {MSSV, Ten, MongoID}, lưu dạng cột (buffer UTF-8 + offsets)
+        self.metadata_mapping = MetadataTable()
+        # Ma trận vector cho tìm kiếm chính xác (mode=bruteforce), luôn đồng bộ với HNSW
+        self.exact_index = BruteForceSearchSystem(dim=self.dim)
+        # MongoID -> label, dùng khi replay các document đã cập nhật
+        self.label_by_mongo_id = {}
+        self.next_label = 0
+        self.fingerprint = None
+        # ef đang dùng và kết quả lần tự chỉnh gần nhất (đường recall / QPS)
+        self.ef_search = DEFAULT_EF
+        self.ef_tuning = None
+
+        # Tìm kiếm giữ khoá đọc, thêm / cập nhật vector giữ khoá ghi
+        self.lock = ReadWriteLock()
+        # Cache kết quả theo embedding (webcam gửi embedding gần như trùng nhau liên tục)
+        self.result_cache = QueryResultCache(dim=self.dim)
+        # Gộp truy vấn của các request đồng thời thành một lần knn_query nhiều luồng
+        self.batcher = SearchBatcher(self._knn_query)
+
+        # Build lại nền khi có quá nhiều phần tử đã xoá
+        self.compact_ratio = COMPACT_RATIO
+        self._compaction_guard = threading.Lock()
+        self._compaction_thread = None
+        self._compaction_log = None
+
+        # Đồng bộ định kỳ với MongoDB (xem start_sync); mỗi lúc chỉ một lần bắt kịp
+        self._sync_guard = threading.Lock()
+        self._sync_pid = None
+
+        # Snapshot trên đĩa để khởi động nhanh (chỉ dùng được với class wrapper)
+        self.snapshot = IndexSnapshot() if IndexSnapshot and HNSWSearchSystem else None
+
+    def connect(self):
+        # MongoClient không an toàn khi fork: mỗi worker gunicorn gọi lại hàm này
+        # sau khi fork (xem gunicorn.conf.py)
+        self.client = MongoClient(self.uri)
+        self.collection = self.client['FaceRecProject']['PeopleMetadata']
+
     def load_data_and_build_index(self):
+        """
+        Khởi động index: ưu tiên nạp snapshot trên đĩa và chỉ replay phần dữ liệu
+        thay đổi kể từ lần lưu; nếu không được thì build lại toàn bộ từ MongoDB.
+        """
+        if self.snapshot is not None:
+            try:
+                if self.warm_start():
+                    if self.maybe_autotune_ef() and not self.read_only:
+                        self.save_snapshot()
+                    return
+            except Exception as e:
+                print(f"[WARN] Không nạp được snapshot, build lại từ MongoDB: {e}")
+
+        self.build_index_from_db()
+        self.maybe_autotune_ef()
+
+        if self.read_only:
+            # Không ghi snapshot; dồn bảng metadata cho gọn (không còn ghi thêm)
+            self.metadata_mapping = self.metadata_mapping.compacted()
+            self.label_by_mongo_id = {}
+            return
+
+        if self.snapshot is not None and self.fingerprint is not None:
+            try:
+                self.save_snapshot()
+            except Exception as e:
+                print(f"[WARN] Không lưu được snapshot: {e}")
+
+    def save_snapshot(self):
+        """
+        Lưu index + metadata + fingerprint hiện tại ra đĩa. Chỉ một tiến trình (người
+        giữ quyền ghi, xem IndexSnapshot.acquire_writer) ghi vào mỗi thư mục snapshot.
+
+        Returns: True nếu đã lưu
+        """
+        if not self.snapshot.acquire_writer():
+            print("Bỏ qua lưu snapshot: một tiến trình khác đang giữ quyền ghi.")
+            return False
+        self.snapshot.save(self.search_system, self.metadata_mapping, {
+            "next_label": self.next_label,
+            "fingerprint": self.fingerprint,
+            "ef_search": self.ef_search,
+            "ef_tuning": self.ef_tuning,
+        }, exact_index=self.exact_index)
+        print(f"Đã lưu snapshot index vào {self.snapshot.directory}")
+        return True
+
+    def _restore_ef(self, state):
+        self.ef_search = state.get("ef_search", DEFAULT_EF)
+        self.ef_tuning = state.get("ef_tuning")
+        self.search_system.set_ef(self.ef_search)
+
+    def maybe_autotune_ef(self):
+        """
+        Tự chỉnh ef nếu bật AUTOTUNE_RECALL và chưa có kết quả chỉnh cho đúng mục tiêu
+        hiện tại (kết quả cũ được lưu trong snapshot).
+
+        Returns: True nếu vừa chỉnh lại ef
+        """
+        if AUTOTUNE_RECALL <= 0 or not hasattr(self.search_system, 'autotune_ef'):
+            return False
+        live = self.search_system.get_live_count()
+        if live == 0:
+            return False
+        tuning = self.ef_tuning or {}
+        if tuning.get("target_recall") == AUTOTUNE_RECALL and tuning.get("k") == min(AUTOTUNE_K, live):
+            return False
+        self.autotune_ef(AUTOTUNE_RECALL, AUTOTUNE_K, AUTOTUNE_SAMPLES, AUTOTUNE_NOISE)
+        return True
+
+    def autotune_ef(self, target_recall, k=DEFAULT_K, num_samples=AUTOTUNE_SAMPLES, noise=AUTOTUNE_NOISE):
+        """
+        Chọn ef nhỏ nhất đạt recall@k >= target_recall với truy vấn mẫu lấy từ chính
+        index (vector đã có + nhiễu), áp dụng cho index đang chạy.
+
+        Returns: kết quả của HNSWSearchSystem.autotune_ef (gồm đường recall / QPS)
+        """
+        rng = np.random.default_rng(0)
+        with self.lock.read_locked():
+            labels = self.metadata_mapping.labels()
+            sample = rng.choice(labels, size=min(num_samples, len(labels)), replace=False)
+            vectors = np.asarray(self.search_system.get_items(sample.tolist()), dtype=np.float32)
+        queries = vectors + rng.normal(0, noise, vectors.shape).astype(np.float32)
+
+        print(f"Đang tự chỉnh ef (recall@{k} >= {target_recall}, {len(queries)} truy vấn mẫu)...")
+        # Giữ khoá ghi: autotune đổi ef của index trong lúc đo
+        with self.lock.write_locked():
+            result = self.search_system.autotune_ef(queries, target_recall=target_recall, k=k)
+            self.ef_search = result["ef"]
+            self.ef_tuning = result
+        for point in result["curve"]:
+            print(f"  ef={point['ef']:>5}  recall={point['recall']:.4f}  QPS={point['qps']:,.0f}")
+        status = "đạt" if result["met"] else "chưa đạt (dùng ef lớn nhất)"
+        print(f"Chọn ef={result['ef']} (recall={result['recall']:.4f}, {status} mục tiêu).")
+        return result
+
+    def warm_start(self):
+        """
+        Nạp snapshot rồi replay các document mới / đã cập nhật / đã xoá sau snapshot.
+
+        Returns:
+            True nếu khởi động thành công từ snapshot, False nếu cần build lại
+        """
+        if not self.snapshot.exists():
+            return False
+
+        print("Đang nạp snapshot index từ đĩa...")
+
+        if self.read_only:
+            # Phục vụ nguyên trạng snapshot: không cần MongoDB lúc khởi động
+            loaded = self.snapshot.load(self.search_system, mmap_metadata=True)
+            if loaded is None:
+                return False
+            state, self.metadata_mapping, exact_index = loaded
+            self.exact_index = exact_index or self.exact_index_from_hnsw()
+            self.next_label = state["next_label"]
+            self.fingerprint = state["fingerprint"]
+            self._restore_ef(state)
+            print(f"Nạp xong snapshot chỉ-đọc ({self.search_system.get_size()} phần tử).")
+            return True
+
+        loaded = self.snapshot.load(self.search_system)
+        if loaded is None:
+            return False
+
+        state, table, exact_index = loaded
+        old_fp = state["fingerprint"]
+        self.metadata_mapping = table
+        self.exact_index = exact_index or self.exact_index_from_hnsw()
+        self.next_label = state["next_label"]
+        self.label_by_mongo_id = dict(zip(table.values("MongoID"), table.labels().tolist()))
+
+        replayed, removed = self._catch_up(old_fp)
+        self._restore_ef(state)
+
+        if replayed > 0 or removed:
+            try:
+                self.save_snapshot()
+            except Exception as e:
+                print(f"[WARN] Không lưu được snapshot: {e}")
+
+        print(f"Nạp xong snapshot ({self.search_system.get_size()} phần tử), replay {replayed} document "
+              f"thay đổi, {len(removed)} document đã xoá.")
+        if removed:
+            self.maybe_compact()
+        return True
+
+    def _catch_up(self, old_fp, quick_check=False):
+        """
+        Đưa index về khớp với MongoDB kể từ fingerprint old_fp: replay document thêm
+        mới / cập nhật (delta_query) và quên document không còn trong Mongo.
+
+        Args:
+            quick_check: bỏ qua bước quét _id khi không có delta và số document trong
+                Mongo bằng số document index đang giữ (không có document nào bị xoá)
+
+        Returns: (số document đã replay, danh sách MongoID đã quên)
+        """
+        query = {"feature_vector": {"$exists": True}}
+        changed = list(self.collection.find(delta_query(old_fp), projection={"_id": 1, "updated_at": 1}))
+        if quick_check and not changed and self.collection.count_documents(query) == len(self.label_by_mongo_id):
+            return 0, []
+
+        with self.lock.read_locked():
+            known = set(self.label_by_mongo_id)
+        # Tập _id hiện có trong Mongo (chỉ lấy _id), lấy SAU truy vấn delta: so với MongoID
+        # index đang giữ để biết document nào đã bị xoá, và bắt kịp document thêm vào
+        # giữa hai truy vấn (số lượng thôi không đủ: xoá N + thêm N vẫn giữ nguyên count)
+        current_ids = [d["_id"] for d in self.collection.find(query, projection={"_id": 1})]
+        current_keys = {str(i) for i in current_ids}
+        changed = [d for d in changed if str(d["_id"]) in current_keys]
+        changed_keys = {str(d["_id"]) for d in changed}
+        replay_ids = [d["_id"] for d in changed]
+        replay_ids += [i for i in current_ids if str(i) not in known and str(i) not in changed_keys]
+        # Chỉ xoá MongoID đã có trước khi quét: người vừa enroll trong lúc quét không bị quên
+        removed = [mid for mid in known if mid not in current_keys]
+
+        with self.lock.write_locked():
+            # Lấy nội dung document dưới khoá ghi (enroll / xoá / cập nhật cũng giữ khoá
+            # này): không đưa lại vào index người vừa bị xoá, không ghi đè vector mới hơn
+            docs = list(self.collection.find({"_id": {"$in": replay_ids}})) if replay_ids else []
+            # Không có gì đổi thì giữ nguyên cache kết quả
+            if removed:
+                self._forget_documents(removed)
+            replayed = self._apply_documents(docs) if docs else 0
+
+        # Fingerprint suy ra từ kết quả truy vấn delta (không đọc lại collection): document
+        # ghi vào Mongo sau truy vấn đó sẽ được replay ở lần bắt kịp sau
+        updated_at = [d["updated_at"] for d in changed if d.get("updated_at") is not None]
+        if old_fp.get("max_updated_at") is not None:
+            updated_at.append(old_fp["max_updated_at"])
+        self.fingerprint = {
+            "count": len(current_ids),
+            "max_id": max(current_ids) if current_ids else None,
+            "max_updated_at": max(updated_at) if updated_at else None,
+        }
+        return replayed, removed
+
+    def sync_from_db(self):
+        """
+        Bắt kịp các thay đổi mà tiến trình khác (worker gunicorn khác, data_import.py)
+        đã ghi vào MongoDB kể từ lần bắt kịp trước. Mỗi worker giữ index riêng nên
+        enroll / xoá / cập nhật ở một worker chỉ tới các worker còn lại qua hàm này
+        (gọi định kỳ bởi start_sync).
+
+        Returns: (số document đã replay, số document đã xoá)
+        """
+        if self.read_only or self.fingerprint is None:
+            return 0, 0
+        with self._sync_guard:
+            replayed, removed = self._catch_up(self.fingerprint, quick_check=True)
+        if replayed > 0 or removed:
+            print(f"Đồng bộ từ MongoDB: replay {replayed} document thay đổi, {len(removed)} document đã xoá.")
+        if removed:
+            self.maybe_compact()
+        return replayed, len(removed)
+
+    def start_sync(self, interval=None):
+        """
+        Chạy sync_from_db mỗi `interval` giây (mặc định INDEX_SYNC_INTERVAL, 0 = tắt)
+        trong một luồng nền của tiến trình hiện tại. Gọi sau khi fork (luồng không đi
+        theo sang tiến trình con); gọi lại trong cùng tiến trình thì bỏ qua.
+
+        Returns: True nếu vừa khởi động luồng đồng bộ
+        """
+        interval = SYNC_INTERVAL if interval is None else interval
+        if self.read_only or interval <= 0 or self._sync_pid == os.getpid():
+            return False
+        self._sync_pid = os.getpid()
+        threading.Thread(target=self._sync_loop, args=(interval,), name="index-sync", daemon=True).start()
+        return True
+
+    def _sync_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sync_from_db()
+            except Exception as e:
+                print(f"[WARN] Không đồng bộ được index từ MongoDB: {e}")
+
+    def apply_documents(self, docs):
+        """
+        Đưa các document (mới hoặc đã cập nhật vector) vào index đang chạy.
+        Document đã có label thì ghi đè vector, document mới thì cấp label mới.
+        Toàn bộ thay đổi (index, ma trận chính xác, metadata) diễn ra dưới khoá ghi
+        nên các luồng tìm kiếm không bao giờ thấy trạng thái nửa vời.
+
+        Returns: số document đã đưa vào index
+        """
+        with self.lock.write_locked():
+            return self._apply_documents(docs)
+
+    def _apply_documents(self, docs):
+        # Gọi khi đang giữ khoá ghi; dữ liệu đổi nên kết quả đã cache không còn đúng
+        self.result_cache.invalidate()
+        new_vectors, new_ids = [], []
+        updated_vectors, updated_ids = [], []
+        for doc in docs:
+            vec = doc.get('feature_vector')
+            if not (isinstance(vec, list) and len(vec) == self.dim):
+                continue
+
+            mongo_id = str(doc["_id"])
+            label = self.label_by_mongo_id.get(mongo_id)
+            if label is None:
+                label = self.next_label
+                self.next_label += 1
+                self.label_by_mongo_id[mongo_id] = label
+                new_vectors.append(vec)
+                new_ids.append(label)
+            else:
+                updated_vectors.append(vec)
+                updated_ids.append(label)
+
+            self.metadata_mapping[label] = {
+                "MSSV": doc.get("MSSV", "Unknown"),
+                "Ten": doc.get("Ten", "Unknown"),
+                "MongoID": mongo_id
+            }
+
+        if new_vectors:
+            data = np.array(new_vectors, dtype=np.float32)
+            # Hết sức chứa (max_elements) thì add_items tự nới index theo INDEX_GROWTH_FACTOR
+            # Nhãn mới được ghi vào chỗ của phần tử đã xoá (nếu có) thay vì làm phình index
+            self.search_system.add_items(data, np.array(new_ids),
+                                         replace_deleted=getattr(self.search_system, 'allow_replace_deleted', False))
+            self.exact_index.add_items(data, new_ids)
+            self._log_compaction("add", new_ids, data)
+
+        if updated_vectors:
+            # Nhãn đã có: hnswlib cập nhật vector tại chỗ
+            data = np.array(updated_vectors, dtype=np.float32)
+            self.search_system.add_items(data, np.array(updated_ids))
+            self.exact_index.add_items(data, updated_ids)
+            self._log_compaction("add", updated_ids, data)
+
+        return len(new_vectors) + len(updated_vectors)
+
+    def delete_person(self, mssv):
+        """
+        Xoá mọi khuôn mặt của một người (theo MSSV) khỏi MongoDB và khỏi index
+        đang chạy. Chỗ trống trong đồ thị được tái sử dụng cho lần thêm kế tiếp;
+        khi tỉ lệ phần tử đã xoá vượt INDEX_COMPACT_RATIO thì build lại nền.
+
+        Output: số vector đã xoá
+        """
+        if self.read_only:
+            raise PermissionError("Server đang chạy ở chế độ chỉ-đọc (INDEX_READ_ONLY=1)")
+
+        # Xoá trong MongoDB và trong index dưới cùng một khoá ghi: snapshot / build lại nền
+        # (giữ khoá đọc khi lấy fingerprint) không bao giờ thấy Mongo đã xoá mà index chưa
+        with self.lock.write_locked():
+            docs = list(self.collection.find({"MSSV": mssv}, projection={"_id": 1}))
+            if not docs:
+                return 0
+            self.collection.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+            labels = self._forget_documents([str(d["_id"]) for d in docs])
+        self.maybe_compact()
+        return len(labels)
+
+    def update_person(self, mssv, face_vector, ten=None):
+        """
+        Thay toàn bộ khuôn mặt của một người bằng một vector mới.
+        Document đầu tiên của người này được cập nhật tại chỗ (giữ nguyên MongoID và
+        label, hnswlib ghi đè vector của label đó); các document còn lại bị xoá. Mongo
+        và index đổi dưới cùng một khoá ghi nên người này không lúc nào biến mất khỏi
+        kết quả tìm kiếm, và lỗi giữa chừng không làm mất dữ liệu cũ.
+
+        Output: như enroll(), hoặc None nếu không có người này
+        """
+        if self.read_only:
+            raise PermissionError("Server đang chạy ở chế độ chỉ-đọc (INDEX_READ_ONLY=1)")
+
+        vector = self._check_vector(face_vector)
+        with self.lock.write_locked():
+            docs = list(self.collection.find({"MSSV": mssv}, projection={"Ten": 1}).sort("_id", 1))
+            if not docs:
+                return None
+            keep, extra = docs[0], docs[1:]
+            ten = ten or keep.get("Ten", "Unknown")
+            changes = {"Ten": ten, "feature_vector": vector.tolist(), "updated_at": datetime.now(timezone.utc)}
+            self.collection.update_one({"_id": keep["_id"]}, {"$set": changes})
+            if extra:
+                self.collection.delete_many({"_id": {"$in": [d["_id"] for d in extra]}})
+                self._forget_documents([str(d["_id"]) for d in extra])
+            self._apply_documents([dict(changes, _id=keep["_id"], MSSV=mssv)])
+            mongo_id = str(keep["_id"])
+            label = self.label_by_mongo_id[mongo_id]
+        if extra:
+            self.maybe_compact()
+        return {"label": label, "MongoID": mongo_id, "MSSV": mssv, "Ten": ten}
+
+    def _forget_documents(self, mongo_ids):
+        # Gọi khi đang giữ khoá ghi
+        self.result_cache.invalidate()
+        labels = [self.label_by_mongo_id.pop(mid) for mid in mongo_ids if mid in self.label_by_mongo_id]
+        if labels:
+            self.search_system.delete_items(labels)
+            self.exact_index.delete_items(labels)
+            for label in labels:
+                self.metadata_mapping.pop(label, None)
+            self._log_compaction("delete", labels, None)
+        return labels
+
+    def _log_compaction(self, op, labels, vectors):
+        # Trong lúc build lại nền, ghi lại các thay đổi để áp lên index mới trước khi hoán đổi
+        if self._compaction_log is not None:
+            self._compaction_log.append((op, list(labels), vectors))
+
+    def maybe_compact(self):
+        """Chạy build lại nền nếu tỉ lệ phần tử đã xoá vượt ngưỡng."""
+        if not hasattr(self.search_system, 'get_deleted_ratio'):
+            return False
+        if self.search_system.get_deleted_ratio() < self.compact_ratio:
+            return False
+        with self._compaction_guard:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return False
+            self._compaction_thread = threading.Thread(target=self.compact, daemon=True)
+            self._compaction_thread.start()
+        return True
+
+    def compact(self):
+        """
+        Build lại index HNSW chỉ từ các vector còn sống, không chặn tìm kiếm:
+        copy dữ liệu dưới khoá đọc, build ngoài khoá, rồi dưới khoá ghi áp các
+        thay đổi phát sinh trong lúc build và hoán đổi sang index mới.
+        """
+        old_system = self.search_system
+        with self.lock.read_locked():
+            self._compaction_log = []
+            count = self.exact_index.get_size()
+            labels = self.exact_index.labels[:count].copy()
+            vectors = np.array(self.exact_index.vectors[:count], dtype=np.float32)
+
+        print(f"Đang build lại index (đã xoá {old_system.get_deleted_count()}/{old_system.get_size()} phần tử)...")
+        new_system = self._new_search_system(space=old_system.space)
+        new_system.build_hnsw_index(
+            max_elements=max(count, 1),
+            ef_construction=old_system.ef_construction,
+            M=old_system.M,
+            allow_replace_deleted=True
+        )
+        if count > 0:
+            new_system.add_items(vectors, labels)
+        new_system.set_ef(self.ef_search)
+
+        with self.lock.write_locked():
+            for op, op_labels, op_vectors in self._compaction_log:
+                if op == "delete":
+                    new_system.delete_items(op_labels)
+                    continue
+                new_system.add_items(op_vectors, np.array(op_labels))
+            self._compaction_log = None
+            self.search_system = new_system
+
+        print(f"Build lại xong index với {new_system.get_size()} phần tử.")
+
+        # Lưu snapshot mới để lần khởi động sau không phải build lại vì đã có document bị xoá
+        if self.snapshot is not None:
+            try:
+                # Giữ fingerprint của lần bắt kịp gần nhất (không đọc lại collection):
+                # Mongo có thể đã có thay đổi của worker khác mà index này chưa replay
+                with self.lock.read_locked():
+                    self.save_snapshot()
+            except Exception as e:
+                print(f"[WARN] Không lưu được snapshot: {e}")
+
+    def stats(self):
+        """Thông số hiện tại của index (dùng cho health check / giám sát)."""
+        size = self.search_system.get_size() if hasattr(self.search_system, 'get_size') else self.search_system.get_current_count()
+        deleted = self.search_system.get_deleted_count() if hasattr(self.search_system, 'get_deleted_count') else 0
+        return {
+            "size": size,
+            "live": size - deleted,
+            "deleted": deleted,
+            "deleted_ratio": deleted / size if size > 0 else 0.0,
+            "compacting": self._compaction_log is not None,
+            "metadata_bytes": self.metadata_mapping.nbytes,
+            "cache": self.result_cache.stats(),
+            "batcher": self.batcher.stats(),
+            "search": self.search_system.get_metric_stats() if hasattr(self.search_system, 'get_metric_stats') else None,
+            "ef": {"ef_search": self.ef_search, "tuning": self.ef_tuning},
+            "growth": self.search_system.get_growth_stats() if hasattr(self.search_system, 'get_growth_stats') else None,
+        }
+
+    def _new_search_system(self, space='l2'):
+        return HNSWSearchSystem(space=space, dim=self.dim, growth_factor=GROWTH_FACTOR, growth_cap=GROWTH_CAP)
+
+    def exact_index_from_hnsw(self):
+        """Dựng lại ma trận vector chính xác từ các vector đang nằm trong index HNSW."""
+        labels = self.metadata_mapping.labels().tolist()
+        exact_index = BruteForceSearchSystem(dim=self.dim, capacity=len(labels) + 1000)
+        if labels:
+            exact_index.add_items(self.search_system.get_items(labels), labels)
+        return exact_index
+
+    def build_index_from_db(self):
         print("Đang tải dữ liệu vector từ MongoDB...")
-        cursor = self.collection.find({"feature_vector": {"$exists": True}})
-        
-        vectors = []
-        ids = []
-        self.metadata_mapping = {}
-        current_id = 0
-        
-        for doc in cursor:
-            vec = doc['feature_vector']
-            
-            if isinstance(vec, list) and len(vec) == 128:
-                vectors.append(vec)
-                ids.append(current_id)
-                
-                self.metadata_mapping[current_id] = {
-                    "MSSV": doc.get("MSSV", "Unknown"),
-                    "Ten": doc.get("Ten", "Unknown"),
-                    "MongoID": str(doc["_id"])
-                }
-                current_id += 1
-            
-        if len(vectors) == 0:
+        if HNSWSearchSystem and getattr(self.search_system, 'is_built', False):
+            # Index đã được nạp (dở dang) từ snapshot -> tạo index mới để build lại
+            self.search_system = self._new_search_system()
+        if self.snapshot is not None:
+            self.fingerprint = collection_fingerprint(self.collection)
+        query = {"feature_vector": {"$exists": True}}
+        expected = self.collection.count_documents(query)
+
+        self.metadata_mapping = MetadataTable()
+        self.label_by_mongo_id = {}
+        self.next_label = 0
+
+        if expected == 0:
             print("Database rỗng hoặc chưa chạy data_import.py!")
+            self.fingerprint = None
             return
 
-        print(f"Đã tải {len(vectors)} vector. Đang xây dựng HNSW Index...")
-
-        # Xây dựng index bằng phương thức của class HNSWSearchSystem
-        # Lưu ý: Class wrapper của bạn có method build_hnsw_index và add_items
+        print(f"Đang nạp {expected} vector từ MongoDB và xây dựng HNSW Index...")
+        capacity = expected
+        self.exact_index = BruteForceSearchSystem(dim=self.dim, capacity=capacity)
         if hasattr(self.search_system, 'build_hnsw_index'):
-             self.search_system.build_hnsw_index(
-                max_elements=len(vectors) + 1000, 
-                ef_construction=200, 
-                M=16
+            self.search_system.build_hnsw_index(
+                max_elements=capacity,
+                ef_construction=200,
+                M=16,
+                allow_replace_deleted=True
             )
-             self.search_system.add_items(np.array(vectors), np.array(ids))
-             self.search_system.set_ef(50)
         else:
             # Fallback cho thư viện gốc hnswlib (nếu không dùng wrapper)
-            self.search_system.init_index(max_elements=len(vectors) + 1000, ef_construction=200, M=16)
-            self.search_system.add_items(np.array(vectors), np.array(ids))
-            self.search_system.set_ef(50)
-        
+            self.search_system.init_index(max_elements=capacity, ef_construction=200, M=16)
+
+        # Luồng phụ đọc cursor và điền vector vào các buffer cấp sẵn; luồng chính đưa
+        # từng buffer vào index (hnswlib nhả GIL khi add_items) -> I/O mạng chạy song
+        # song với việc dựng đồ thị, bộ nhớ đỉnh chỉ cỡ vài buffer
+        cursor = self.collection.find(query, projection=LOAD_PROJECTION).batch_size(LOAD_BATCH_SIZE)
+        for data, ids in self._stream_chunks(cursor):
+            # Collection có thêm document trong lúc nạp thì add_items tự nới index
+            self.search_system.add_items(data, ids, num_threads=LOAD_THREADS)
+            self.exact_index.add_items(data, ids)
+
+        self.ef_tuning = None
+        self.search_system.set_ef(self.ef_search)
+        if self.next_label == 0:
+            print("Database rỗng hoặc chưa chạy data_import.py!")
+            self.fingerprint = None
+            return
+
         # Lấy kích thước index (wrapper có hàm get_size, thư viện gốc có get_current_count)
         size = self.search_system.get_size() if hasattr(self.search_system, 'get_size') else self.search_system.get_current_count()
         print(f"Xây dựng xong Index với {size} phần tử!")
     
+    def _stream_chunks(self, cursor, chunk_size=LOAD_CHUNK_SIZE, num_buffers=3):
+        """
+        Đọc cursor ở luồng phụ, điền vector vào num_buffers buffer float32 (chunk_size, dim)
+        dùng xoay vòng; metadata / label được ghi ngay khi đọc.
+        Yield (data, ids) cho từng chunk; buffer được tái sử dụng sau khi vòng lặp
+        bên gọi xử lý xong chunk đó (add_items đã chép dữ liệu).
+        """
+        free = queue.Queue()
+        for _ in range(num_buffers):
+            free.put(np.empty((chunk_size, self.dim), dtype=np.float32))
+        ready = queue.Queue()
+
+        def produce():
+            try:
+                buf, n = free.get(), 0
+                ids = np.empty(chunk_size, dtype=np.int64)
+                for doc in cursor:
+                    vec = doc.get('feature_vector')
+                    if not (isinstance(vec, list) and len(vec) == self.dim):
+                        continue
+                    label = self.next_label
+                    self.next_label += 1
+                    buf[n] = vec
+                    ids[n] = label
+                    n += 1
+                    mongo_id = str(doc["_id"])
+                    self.metadata_mapping[label] = {
+                        "MSSV": doc.get("MSSV", "Unknown"),
+                        "Ten": doc.get("Ten", "Unknown"),
+                        "MongoID": mongo_id
+                    }
+                    self.label_by_mongo_id[mongo_id] = label
+                    if n == chunk_size:
+                        ready.put((buf, ids, n))
+                        buf, n = free.get(), 0
+                        ids = np.empty(chunk_size, dtype=np.int64)
+                if n > 0:
+                    ready.put((buf, ids, n))
+                ready.put(None)
+            except Exception as e:
+                ready.put(e)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            buf, ids, n = item
+            yield buf[:n], ids[:n]
+            free.put(buf)
+        producer.join()
+
     def search_face(self, query_vector):
         """
         Input: query_vector (list hoặc numpy array 128 chiều)
         """
+        return self.search_faces([query_vector])[0]
+
+    def search_faces(self, query_vectors, k=None, threshold=None, margin=None):
+        """
+        Tìm kiếm tất cả khuôn mặt của một request bằng một lần gọi knn_query
+        (hnswlib tự chia batch cho nhiều luồng).
+
+        Input:
+            query_vectors: n x 128 (list hoặc numpy array)
+            k: số ứng viên lấy về cho mỗi khuôn mặt
+            threshold: ngưỡng khoảng cách để coi là "found"
+            margin: chênh lệch khoảng cách tối thiểu với người gần thứ hai
+        Output: list n kết quả theo đúng thứ tự đầu vào, phần tử None nếu lỗi
+        """
         # Kiểm tra xem index đã build chưa
         is_built = False
         if hasattr(self.search_system, 'is_built'):
@@ -101,33 +730,194 @@ class FaceSearchEngine:
             # Thư viện gốc coi như đã build nếu đã init
             is_built = True 
 
+        if len(query_vectors) == 0:
+            return []
+
         if self.search_system is None or not is_built:
             print("Lỗi: Chưa build index.")
-            return None
+            return [None] * len(query_vectors)
 
-        # Query
-        query_np = np.array([query_vector])
-        
-        try:
-            # Dùng hàm knn_query của wrapper hoặc thư viện gốc
-            labels, distances = self.search_system.knn_query(query_np, k=1)
-            
-            found_id = labels[0][0]
-            distance = distances[0][0]
-            
-            # Ngưỡng (Threshold): 0.5 - 0.6 là mức trung bình cho Euclidean Distance (l2)
-            if distance > 0.5: 
-                return {"status": "unknown", "distance": float(distance)}
-                
-            info = self.metadata_mapping.get(found_id)
-            return {
+        # Query: gộp thành 1 mảng (n, 128) float32 liên tục
+        query_np = np.ascontiguousarray(query_vectors, dtype=np.float32).reshape(-1, self.dim)
+
+        # Khuôn mặt gần như trùng một truy vấn vừa tìm (cùng tham số) thì lấy kết quả từ cache
+        # (cache bị xoá mỗi khi dữ liệu đổi nên cùng k yêu cầu thì cũng cùng k thực tế)
+        requested_k = k or DEFAULT_K
+        results = [None] * len(query_np)
+        misses = list(range(len(query_np)))
+        cache = self.result_cache
+        if cache.enabled:
+            params = (requested_k, threshold, margin)
+            generation = cache.generation
+            misses = []
+            for i, vec in enumerate(query_np):
+                results[i] = cache.get(vec, params)
+                if results[i] is None:
+                    misses.append(i)
+            if not misses:
+                return results
+
+        with self.lock.read_locked():
+            # k không được vượt quá số phần tử còn sống (hnswlib báo lỗi nếu không đủ k kết quả;
+            # get_size() còn tính cả chỗ của phần tử đã xoá). Đọc dưới khoá đọc để không lệch
+            # với một lần xoá chen vào giữa
+            live = self.search_system.get_live_count() if hasattr(self.search_system, 'get_live_count') else self.search_system.get_current_count()
+            k = min(requested_k, live)
+            if k < 1:
+                for i, result in zip(misses, self._empty_results(len(misses))):
+                    results[i] = result
+                return results
+
+            try:
+                labels, distances = self.batcher.search(query_np[misses], k)
+            except Exception as e:
+                print(f"Lỗi khi search vector: {e}")
+                return [None] * len(query_np)
+
+            for i, result in zip(misses, self.decide(labels, self._euclidean(distances), threshold, margin)):
+                results[i] = result
+                if cache.enabled:
+                    cache.put(query_np[i], params, result, generation)
+            return results
+
+    def _knn_query(self, query, k, num_threads):
+        # Dùng hàm knn_query của wrapper hoặc thư viện gốc (gọi khi đang giữ khoá đọc)
+        return self.search_system.knn_query(query, k=k, num_threads=num_threads)
+
+    @staticmethod
+    def _euclidean(distances):
+        # hnswlib / BruteForceSearchSystem ('l2') trả về bình phương khoảng cách Euclid
+        return np.sqrt(np.maximum(distances, 0))
+
+    @staticmethod
+    def _empty_results(n):
+        # Index rỗng: cùng dạng với kết quả "unknown" của decide()
+        return [{"status": "unknown", "distance": None, "margin": None, "candidates": []} for _ in range(n)]
+
+    def decide(self, labels, distances, threshold=None, margin=None):
+        """
+        Quyết định found / unknown từ top-k ứng viên của mỗi khuôn mặt.
+        distances là khoảng cách Euclid (không bình phương) ở cả hai chế độ tìm kiếm,
+        nên threshold / margin có cùng ý nghĩa với hnsw và bruteforce:
+        - Gộp các vector theo MSSV (một người có thể có nhiều ảnh), giữ khoảng
+          cách nhỏ nhất của mỗi người
+        - "found" khi người gần nhất nằm trong threshold VÀ cách người gần thứ
+          hai (khác MSSV) ít nhất margin; ngược lại là "unknown"
+        """
+        # Ngưỡng (Threshold): 0.5 - 0.6 là mức trung bình cho Euclidean Distance (l2)
+        threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+        margin = DEFAULT_MARGIN if margin is None else margin
+
+        # Loại trước các khuôn mặt mà ứng viên gần nhất đã vượt ngưỡng
+        within_threshold = distances[:, 0] <= threshold
+
+        # Tra metadata cho toàn bộ ma trận top-k một lượt
+        k = labels.shape[1] if labels.ndim == 2 else 1
+        infos = self.metadata_mapping.get_many(labels)
+
+        results = []
+        for i, (row_distances, in_range) in enumerate(zip(distances, within_threshold)):
+            # Ứng viên theo từng người, đã sắp xếp tăng dần theo khoảng cách
+            candidates = []
+            seen = set()
+            for info, distance in zip(infos[i * k:(i + 1) * k], row_distances):
+                if info is None:
+                    continue
+                person = info.get("MSSV", "Unknown")
+                if person in seen:
+                    continue
+                seen.add(person)
+                candidates.append({"info": info, "distance": float(distance)})
+
+            if not candidates:
+                results.append({"status": "unknown", "distance": float(row_distances[0]), "margin": None,
+                                "candidates": []})
+                continue
+
+            best = candidates[0]
+            gap = candidates[1]["distance"] - best["distance"] if len(candidates) > 1 else None
+            public_candidates = [
+                {"MSSV": c["info"].get("MSSV", "Unknown"), "Ten": c["info"].get("Ten", "Unknown"), "distance": c["distance"]}
+                for c in candidates
+            ]
+
+            if not in_range or (gap is not None and gap < margin):
+                results.append({
+                    "status": "unknown",
+                    "distance": best["distance"],
+                    "margin": gap,
+                    "candidates": public_candidates,
+                })
+                continue
+
+            results.append({
                 "status": "found",
-                "info": info,
-                "distance": float(distance)
-            }
-        except Exception as e:
-            print(f"Lỗi khi search vector: {e}")
-            return None
+                "info": best["info"],
+                "distance": best["distance"],
+                "margin": gap,
+                "candidates": public_candidates,
+            })
+        return results
+
+    def exact_search(self, query_vectors, k=None, threshold=None, margin=None):
+        """
+        Tìm kiếm chính xác (brute-force) cho tất cả khuôn mặt của một request
+        trong một phép tính ma trận duy nhất, cùng quy tắc quyết định và cùng dạng
+        kết quả với search_faces (distance là khoảng cách Euclid).
+
+        Input: query_vectors (n x 128)
+        Output: list n kết quả {"status", "distance", "margin", "candidates", "info" nếu found}
+        """
+        query_np = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self.lock.read_locked():
+            k = min(k or DEFAULT_K, self.exact_index.get_size())
+            if k < 1:
+                return self._empty_results(len(query_np))
+            labels, distances = self.exact_index.knn_query(query_np, k=k)
+            return self.decide(labels, self._euclidean(distances), threshold, margin)
+
+    def enroll(self, face_vector, mssv, ten):
+        """
+        Thêm một khuôn mặt mới vào hệ thống mà không cần build lại index:
+        ghi document vào MongoDB rồi add_items vào index đang phục vụ.
+        Lần khởi động sau, document này được replay từ snapshot như mọi thay đổi khác.
+
+        Lưu ý: mỗi worker gunicorn giữ index riêng, worker khác thấy người mới sau
+        lần đồng bộ kế tiếp (tối đa INDEX_SYNC_INTERVAL giây, xem sync_from_db).
+
+        Input: face_vector (128 chiều), mssv, ten
+        Output: {"label", "MongoID", "MSSV", "Ten"}
+        """
+        if self.read_only:
+            raise PermissionError("Server đang chạy ở chế độ chỉ-đọc (INDEX_READ_ONLY=1)")
+        if not getattr(self.search_system, 'is_built', False):
+            raise ValueError("Chưa build index! Gọi load_data_and_build_index() trước.")
+
+        vector = self._check_vector(face_vector)
+        doc = {
+            "MSSV": mssv,
+            "Ten": ten,
+            "feature_vector": vector.tolist(),
+            "updated_at": datetime.now(timezone.utc),
+        }
+        # Ghi Mongo và thêm vào index dưới cùng một khoá ghi (xem delete_person)
+        with self.lock.write_locked():
+            doc["_id"] = self.collection.insert_one(doc).inserted_id
+            self._apply_documents([doc])
+            mongo_id = str(doc["_id"])
+            label = self.label_by_mongo_id[mongo_id]
+        return {
+            "label": label,
+            "MongoID": mongo_id,
+            "MSSV": mssv,
+            "Ten": ten,
+        }
+
+    def _check_vector(self, face_vector):
+        vector = np.asarray(face_vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Vector phải có {self.dim} chiều")
+        return vector
 
 # --- PHẦN TEST ---
 if __name__ == "__main__":
@@ -0,0 +1,265 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: không có flock, chỉ nên chạy một tiến trình ghi snapshot
+    fcntl = None
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from hnsw import HNSWSearchSystem
+from bruteforce import BruteForceSearchSystem
+from faces_recognition.metadata_table import MetadataTable
+
+# Thư mục mặc định chứa snapshot (có thể đổi bằng biến môi trường INDEX_SNAPSHOT_DIR)
+DEFAULT_SNAPSHOT_DIR = os.path.join(parent_dir, "index_snapshot")
+
+SNAPSHOT_VERSION = 4
+
+# Khoá "người ghi snapshot" của tiến trình này: {đường dẫn file khoá: (pid, file đang mở)}
+_writer_locks = {}
+_writer_guard = threading.Lock()
+
+
+def collection_fingerprint(collection):
+    """
+    Dấu vân tay của collection tại thời điểm build index:
+    - count: số document có feature_vector
+    - max_id: _id lớn nhất (ObjectId tăng dần theo thời gian tạo)
+    - max_updated_at: mốc updated_at mới nhất (do data_import.py ghi), None nếu chưa có
+    """
+    query = {"feature_vector": {"$exists": True}}
+    count = collection.count_documents(query)
+
+    last_doc = collection.find_one(query, sort=[("_id", -1)], projection={"_id": 1})
+    last_update = collection.find_one(
+        {"feature_vector": {"$exists": True}, "updated_at": {"$exists": True}},
+        sort=[("updated_at", -1)],
+        projection={"updated_at": 1},
+    )
+
+    return {
+        "count": count,
+        "max_id": last_doc["_id"] if last_doc else None,
+        "max_updated_at": last_update["updated_at"] if last_update else None,
+    }
+
+
+def delta_query(fingerprint):
+    """Truy vấn Mongo lấy các document thêm mới / cập nhật sau thời điểm snapshot."""
+    conditions = []
+    if fingerprint.get("max_id") is not None:
+        conditions.append({"_id": {"$gt": fingerprint["max_id"]}})
+    if fingerprint.get("max_updated_at") is not None:
+        conditions.append({"updated_at": {"$gt": fingerprint["max_updated_at"]}})
+    else:
+        # Lúc snapshot chưa document nào có updated_at: document nào có thì đã được cập nhật sau đó
+        conditions.append({"updated_at": {"$exists": True}})
+
+    query = {"feature_vector": {"$exists": True}}
+    if conditions:
+        query["$or"] = conditions
+    return query
+
+
+class IndexSnapshot:
+    """
+    Lưu / nạp trạng thái của FaceSearchEngine ra đĩa. Mỗi lần lưu là một bộ file
+    trong thư mục con riêng (set-<thời điểm>-<pid>):
+    - face_index.bin: đồ thị HNSW (save_index của hnswlib)
+    - metadata_*.npy: bảng metadata dạng cột (MetadataTable), mở được bằng mmap
+    - exact_*.npy: ma trận vector của BruteForceSearchSystem (baseline chính xác)
+    - face_index_meta.pkl: fingerprint của collection, next_label và tham số index
+    File CURRENT ghi tên bộ đang dùng và chỉ được đổi (os.replace) khi cả bộ mới đã
+    ghi xong, nên không bao giờ nạp phải index của lần lưu này với metadata của lần
+    khác. Ghi giữ khoá độc quyền trên file .lock (nhiều worker cùng lưu thì lần lượt),
+    nạp giữ khoá chia sẻ để bộ đang đọc không bị dọn đi giữa chừng.
+    """
+
+    INDEX_FILE = "face_index.bin"
+    META_FILE = "face_index_meta.pkl"
+    CURRENT_FILE = "CURRENT"
+    LOCK_FILE = ".lock"
+    WRITER_LOCK_FILE = "writer.lock"
+    SET_PREFIX = "set-"
+    TMP_PREFIX = ".tmp-set-"
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or os.getenv("INDEX_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+        self.current_path = os.path.join(self.directory, self.CURRENT_FILE)
+        self.lock_path = os.path.join(self.directory, self.LOCK_FILE)
+        self.writer_lock_path = os.path.join(self.directory, self.WRITER_LOCK_FILE)
+
+    def acquire_writer(self) -> bool:
+        """
+        Nhận quyền ghi snapshot cho cả tiến trình (flock không chờ trên writer.lock, giữ
+        tới khi tiến trình thoát). Nhiều worker gunicorn cùng trỏ vào một thư mục thì chỉ
+        worker nhận được khoá đầu tiên ghi snapshot; worker đó chết thì worker khác nhận thay.
+
+        Returns: True nếu tiến trình này là người ghi
+        """
+        if fcntl is None:
+            return True
+        with _writer_guard:
+            held = _writer_locks.get(self.writer_lock_path)
+            if held is not None and held[0] == os.getpid():
+                return True
+            os.makedirs(self.directory, exist_ok=True)
+            f = open(self.writer_lock_path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return False
+            _writer_locks[self.writer_lock_path] = (os.getpid(), f)
+            return True
+
+    def release_writer(self) -> None:
+        """
+        Trả quyền ghi. Master gunicorn (preload_app) gọi trước khi fork worker: nếu không,
+        các worker thừa hưởng file đang giữ khoá và không worker nào nhận được quyền ghi.
+        """
+        with _writer_guard:
+            held = _writer_locks.pop(self.writer_lock_path, None)
+            if held is not None:
+                held[1].close()
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def current_set(self) -> str:
+        """Thư mục của bộ snapshot đang dùng, None nếu chưa có."""
+        try:
+            with open(self.current_path, "r", encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        if not name.startswith(self.SET_PREFIX):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isdir(path) else None
+
+    def _set_complete(self, set_dir: str) -> bool:
+        return (os.path.isfile(os.path.join(set_dir, self.INDEX_FILE))
+                and os.path.isfile(os.path.join(set_dir, self.META_FILE))
+                and MetadataTable.exists(set_dir))
+
+    def exists(self) -> bool:
+        set_dir = self.current_set()
+        return set_dir is not None and self._set_complete(set_dir)
+
+    def save(self, search_system: HNSWSearchSystem, metadata, state: dict,
+             exact_index: BruteForceSearchSystem = None) -> None:
+        """
+        Ghi snapshot: ghi cả bộ file vào thư mục tạm riêng của lần lưu này, đổi tên
+        thành bộ mới rồi mới trỏ CURRENT sang nó. Tiến trình bị tắt ở bất kỳ bước nào
+        thì CURRENT vẫn trỏ tới bộ cũ, nguyên vẹn.
+
+        Args:
+            search_system: Index HNSW đã build
+            metadata: metadata_mapping (dict) hoặc MetadataTable
+            state: fingerprint, next_label, ... (phải pickle được)
+            exact_index: Ma trận vector dùng cho tìm kiếm chính xác (tuỳ chọn)
+        """
+        if not isinstance(metadata, MetadataTable):
+            metadata = MetadataTable.from_mapping(metadata)
+
+        with self._locked(exclusive=True):
+            tmp_dir = tempfile.mkdtemp(prefix=self.TMP_PREFIX, dir=self.directory)
+            try:
+                metadata.save(tmp_dir)
+                if exact_index is not None:
+                    exact_index.save(tmp_dir)
+
+                index_path = os.path.join(tmp_dir, self.INDEX_FILE)
+                search_system.save_index(index_path)
+                meta = dict(state)
+                meta["version"] = SNAPSHOT_VERSION
+                meta["space"] = search_system.space
+                meta["dim"] = search_system.dim
+                meta["allow_replace_deleted"] = search_system.allow_replace_deleted
+                meta["num_deleted"] = search_system.get_deleted_count()
+                meta["index_file_size"] = os.path.getsize(index_path)
+                with open(os.path.join(tmp_dir, self.META_FILE), "wb") as f:
+                    pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+                name = f"{self.SET_PREFIX}{time.time_ns()}-{os.getpid()}"
+                os.rename(tmp_dir, os.path.join(self.directory, name))
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+
+            tmp_current = f"{self.current_path}.{os.getpid()}.tmp"
+            with open(tmp_current, "w", encoding="utf-8") as f:
+                f.write(name)
+            os.replace(tmp_current, self.current_path)
+            self._prune(keep=name)
+
+    def _prune(self, keep: str) -> None:
+        """Xoá các bộ cũ và thư mục tạm bị bỏ lại (đang giữ khoá ghi nên không bộ nào đang được ghi)."""
+        for name in os.listdir(self.directory):
+            if name != keep and name.startswith((self.SET_PREFIX, self.TMP_PREFIX)):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def load(self, search_system: HNSWSearchSystem, extra_capacity: int = 0, mmap_metadata: bool = False):
+        """
+        Nạp snapshot vào search_system.
+
+        Args:
+            search_system: Index (chưa build) để nạp đồ thị vào
+            extra_capacity: Sức chứa dự phòng cho các phần tử sẽ thêm sau khi nạp
+            mmap_metadata: Mở bảng metadata và ma trận vector bằng mmap (chế độ chỉ-đọc)
+
+        Returns:
+            (state, MetadataTable, BruteForceSearchSystem hoặc None nếu không lưu),
+            hoặc None nếu snapshot không tồn tại / không khớp
+        """
+        with self._locked(exclusive=False):
+            set_dir = self.current_set()
+            if set_dir is None or not self._set_complete(set_dir):
+                return None
+            index_path = os.path.join(set_dir, self.INDEX_FILE)
+
+            with open(os.path.join(set_dir, self.META_FILE), "rb") as f:
+                meta = pickle.load(f)
+
+            if (meta.get("version") != SNAPSHOT_VERSION
+                    or meta.get("space") != search_system.space
+                    or meta.get("dim") != search_system.dim
+                    or meta.get("index_file_size") != os.path.getsize(index_path)):
+                print("[WARN] Snapshot không khớp phiên bản / cấu hình, bỏ qua.")
+                return None
+
+            # Nhãn còn sống = nhãn có metadata (hnswlib vẫn giữ nhãn đã mark_deleted trong file)
+            table = MetadataTable.load(set_dir, mmap=mmap_metadata)
+            search_system.load_index(index_path,
+                                     allow_replace_deleted=meta.get("allow_replace_deleted", False),
+                                     num_deleted=meta.get("num_deleted", 0),
+                                     live_ids=table.labels())
+            needed = search_system.get_size() + extra_capacity
+            if needed > search_system.get_max_elements():
+                search_system.resize_index(needed)
+
+            exact_index = None
+            if BruteForceSearchSystem.exists(set_dir):
+                exact_index = BruteForceSearchSystem.load(set_dir, mmap=mmap_metadata)
+            return meta, table, exact_index
@@ -0,0 +1,262 @@
+import os
+import numpy as np
+
+
+def _grow(arr: np.ndarray, needed: int, fill=None) -> np.ndarray:
+    """Mảng mới sức chứa >= needed (tăng gấp đôi), chép dữ liệu cũ; luôn ghi được (kể cả khi arr là mmap)"""
+    capacity = max(needed, 2 * len(arr), 16)
+    new = np.empty(capacity, dtype=arr.dtype)
+    new[:len(arr)] = arr
+    if fill is not None:
+        new[len(arr):] = fill
+    return new
+
+
+class MetadataTable:
+    """
+    Bảng metadata (MSSV, Ten, MongoID) dạng cột thay cho dict of dicts.
+
+    Mỗi cột là một buffer UTF-8 nối liền (uint8) + mảng offsets: giá trị của
+    dòng r nằm ở data[offsets[r]:offsets[r + 1]]. rows[label] là chỉ số dòng của
+    label (-1 nếu không có). Mỗi người chỉ tốn vài chục byte thay vì vài trăm byte
+    của dict + 3 object str, và toàn bộ bảng lưu được bằng np.save rồi mở lại bằng
+    mmap: các worker gunicorn dùng chung page cache, việc tra cứu không chạm vào
+    refcount của hàng triệu object Python.
+
+    Ghi (enroll / cập nhật) thêm dòng mới vào cuối buffer, dòng cũ (và dòng của label
+    đã xoá) thành rác. Khi số dòng rác vượt số dòng còn dùng, bảng tự dồn lại tại chỗ
+    nên bộ nhớ không tăng mãi khi cập nhật liên tục; save() luôn ghi bản đã dồn. Bảng
+    mở bằng mmap được chép ra bộ nhớ ở lần ghi đầu tiên (file trên đĩa không đổi).
+    """
+
+    COLUMNS = ("MSSV", "Ten", "MongoID")
+    FILE_PREFIX = "metadata"
+    # Chỉ dồn tại chỗ khi có ít nhất chừng này dòng rác (tránh dồn liên tục với bảng nhỏ)
+    MIN_GARBAGE_ROWS = 1024
+
+    def __init__(self, data: dict = None, offsets: dict = None, rows: np.ndarray = None):
+        """
+        Args:
+            data: {tên cột: buffer uint8}
+            offsets: {tên cột: mảng int64 (hoặc uint32 với bảng đã dồn) >= số dòng + 1}, offsets[0] = 0
+            rows: rows[label] = chỉ số dòng của label, -1 nếu label không tồn tại
+        """
+        self._data = data or {name: np.zeros(0, dtype=np.uint8) for name in self.COLUMNS}
+        self._offsets = offsets or {name: np.zeros(1, dtype=np.int64) for name in self.COLUMNS}
+        self.rows = rows if rows is not None else np.zeros(0, dtype=np.int32)
+        self._num_rows = len(self._offsets[self.COLUMNS[0]]) - 1
+        self._data_size = {name: int(self._offsets[name][self._num_rows]) for name in self.COLUMNS}
+        # Số dòng không còn label nào trỏ tới (bị ghi đè hoặc đã xoá)
+        self._garbage_rows = self._num_rows - len(self)
+
+    @classmethod
+    def from_mapping(cls, mapping: dict):
+        """Tạo bảng từ dict {label: {"MSSV", "Ten", "MongoID"}}."""
+        table = cls()
+        for label in sorted(mapping.keys()):
+            table[label] = mapping[label]
+        return table
+
+    # ----------------- ĐỌC -----------------
+    def _value(self, name: str, row: int) -> str:
+        offsets = self._offsets[name]
+        return self._data[name][offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+
+    def _row_info(self, row: int) -> dict:
+        return {name: self._value(name, row) for name in self.COLUMNS}
+
+    def _rows_of(self, labels) -> np.ndarray:
+        """Chỉ số dòng của từng label (vector hoá), -1 nếu không có"""
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        rows = np.full(len(labels), -1, dtype=np.int64)
+        valid = (labels >= 0) & (labels < len(self.rows))
+        rows[valid] = self.rows[labels[valid]]
+        return rows
+
+    def get(self, label, default=None):
+        row = self._rows_of([label])[0]
+        if row < 0:
+            return default
+        return self._row_info(int(row))
+
+    def get_many(self, labels) -> list:
+        """
+        Metadata của nhiều label một lượt (ví dụ toàn bộ ma trận top-k của một batch
+        truy vấn): tra dòng bằng numpy, mỗi dòng chỉ decode một lần dù xuất hiện nhiều lần.
+        Output: list cùng độ dài labels (đã làm phẳng), phần tử None nếu không có.
+        """
+        rows = self._rows_of(labels)
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        found = unique_rows[unique_rows >= 0]
+        mssv, ten, mongo_id = self._gather(found)
+        decoded = [None] * (len(unique_rows) - len(found))
+        decoded += [{"MSSV": a, "Ten": b, "MongoID": c} for a, b, c in zip(mssv, ten, mongo_id)]
+        return [decoded[i] for i in inverse.ravel().tolist()]
+
+    def _gather(self, rows: np.ndarray) -> list:
+        """
+        Giá trị của các dòng rows cho từng cột. Mọi ô được chép (bằng chỉ số numpy) vào
+        một buffer, ngăn nhau bởi byte 0, rồi decode + split một lần thay vì từng ô.
+        """
+        n = len(rows)
+        starts = np.empty(len(self.COLUMNS) * n, dtype=np.int64)
+        lengths = np.empty(len(self.COLUMNS) * n, dtype=np.int64)
+        for c, name in enumerate(self.COLUMNS):
+            offsets = self._offsets[name]
+            starts[c * n:(c + 1) * n] = offsets[rows]
+            lengths[c * n:(c + 1) * n] = offsets[rows + 1]
+        lengths -= starts
+        packed = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=packed[1:])
+        pos = np.arange(packed[-1], dtype=np.int64)
+        # Ô thứ i bắt đầu ở packed[i] + i trong buffer ra (thêm i byte phân cách phía trước)
+        dst = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths) + pos
+        src = np.repeat(starts - packed[:-1], lengths) + pos
+        out = np.zeros(max(int(packed[-1]) + len(lengths) - 1, 0), dtype=np.uint8)
+        for c, name in enumerate(self.COLUMNS):
+            a, b = packed[c * n], packed[(c + 1) * n]
+            out[dst[a:b]] = self._data[name][src[a:b]]
+        values = out.tobytes().decode("utf-8").split("\x00") if n else []
+        if len(values) != len(lengths):
+            # Có giá trị chứa byte 0: cắt từng ô
+            buf = out.tobytes()
+            values = [buf[packed[i] + i:packed[i + 1] + i].decode("utf-8") for i in range(len(lengths))]
+        return [values[c * n:(c + 1) * n] for c in range(len(self.COLUMNS))]
+
+    def values(self, name: str) -> list:
+        """Giá trị của một cột cho mọi label đang có (theo thứ tự labels())."""
+        return [self._value(name, int(row)) for row in self.rows[self.labels()]]
+
+    def __contains__(self, label) -> bool:
+        return self._rows_of([label])[0] >= 0
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(np.asarray(self.rows) >= 0))
+
+    def labels(self) -> np.ndarray:
+        """Các nhãn có metadata (tăng dần)."""
+        return np.flatnonzero(np.asarray(self.rows) >= 0)
+
+    def items(self):
+        for label in self.labels():
+            yield int(label), self._row_info(int(self.rows[label]))
+
+    def to_mapping(self) -> dict:
+        return dict(self.items())
+
+    @property
+    def nbytes(self) -> int:
+        """Bộ nhớ dùng cho dữ liệu (không tính phần sức chứa dự phòng)."""
+        used = self.rows.nbytes
+        for name in self.COLUMNS:
+            used += self._data_size[name] + (self._num_rows + 1) * self._offsets[name].itemsize
+        return used
+
+    # ----------------- GHI -----------------
+    def __setitem__(self, label, info: dict) -> None:
+        label = int(label)
+        row = self._num_rows
+        for name in self.COLUMNS:
+            value = str(info.get(name, "Unknown")).encode("utf-8")
+            start = self._data_size[name]
+            end = start + len(value)
+            if end > len(self._data[name]) or not self._data[name].flags.writeable:
+                self._data[name] = _grow(self._data[name][:start], end)
+            self._data[name][start:end] = np.frombuffer(value, dtype=np.uint8)
+            self._data_size[name] = end
+
+            if (row + 2 > len(self._offsets[name]) or not self._offsets[name].flags.writeable
+                    or self._offsets[name].dtype != np.int64):
+                self._offsets[name] = _grow(self._offsets[name][:row + 1].astype(np.int64), row + 2)
+            self._offsets[name][row + 1] = end
+        self._num_rows += 1
+
+        if label >= len(self.rows) or not self.rows.flags.writeable:
+            self.rows = _grow(self.rows, label + 1, fill=-1)
+        if self.rows[label] >= 0:
+            self._garbage_rows += 1
+        self.rows[label] = row
+        self._maybe_compact()
+
+    def pop(self, label, default=None):
+        info = self.get(label)
+        if info is None:
+            return default
+        if not self.rows.flags.writeable:
+            self.rows = np.array(self.rows)
+        self.rows[int(label)] = -1
+        self._garbage_rows += 1
+        self._maybe_compact()
+        return info
+
+    def _maybe_compact(self) -> None:
+        """Dồn tại chỗ khi rác nhiều hơn dữ liệu còn dùng (chi phí O(n) chia đều cho các lần ghi)."""
+        if self._garbage_rows < max(self.MIN_GARBAGE_ROWS, self._num_rows - self._garbage_rows):
+            return
+        table = self.compacted()
+        self._data, self._offsets, self.rows = table._data, table._offsets, table.rows
+        self._num_rows, self._data_size = table._num_rows, table._data_size
+        self._garbage_rows = 0
+
+    # ----------------- LƯU / NẠP -----------------
+    def compacted(self):
+        """Bản sao chỉ gồm các dòng còn được tham chiếu, sắp theo label, đúng kích thước."""
+        labels = self.labels()
+        old_rows = np.asarray(self.rows)[labels].astype(np.int64)
+        rows = np.full(labels[-1] + 1 if len(labels) else 0, -1, dtype=np.int32)
+        rows[labels] = np.arange(len(labels), dtype=np.int32)
+
+        data, offsets = {}, {}
+        for name in self.COLUMNS:
+            starts = self._offsets[name][old_rows].astype(np.int64)
+            lengths = self._offsets[name][old_rows + 1].astype(np.int64) - starts
+            new_offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=new_offsets[1:])
+            # Vị trí nguồn của từng byte: starts[i] + (j - new_offsets[i]) với j trong dòng i
+            src = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1], dtype=np.int64)
+            data[name] = self._data[name][src]
+            # Buffer dưới 4 GiB thì offsets uint32 là đủ (giảm một nửa)
+            offsets[name] = new_offsets.astype(np.uint32) if new_offsets[-1] < 2**32 else new_offsets
+        return MetadataTable(data, offsets, rows)
+
+    @classmethod
+    def _path(cls, directory: str, name: str) -> str:
+        return os.path.join(directory, f"{cls.FILE_PREFIX}_{name}.npy")
+
+    @classmethod
+    def _file_names(cls) -> list:
+        return [f"{name}_{part}" for name in cls.COLUMNS for part in ("data", "offsets")] + ["rows"]
+
+    def save(self, directory: str) -> None:
+        """Ghi bản đã dồn của từng mảng ra một file .npy (ghi file tạm rồi os.replace)."""
+        os.makedirs(directory, exist_ok=True)
+        table = self.compacted()
+        arrays = {"rows": table.rows}
+        for name in self.COLUMNS:
+            arrays[f"{name}_data"] = table._data[name]
+            arrays[f"{name}_offsets"] = table._offsets[name]
+        for name, arr in arrays.items():
+            path = self._path(directory, name)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmp, path)
+
+    @classmethod
+    def exists(cls, directory: str) -> bool:
+        return all(os.path.isfile(cls._path(directory, name)) for name in cls._file_names())
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True):
+        """
+        Nạp bảng đã lưu.
+
+        Args:
+            directory: Thư mục chứa các file metadata_*.npy
+            mmap: True -> mở chỉ-đọc bằng mmap (chia sẻ page cache giữa các tiến trình)
+        """
+        mode = "r" if mmap else None
+        data = {name: np.load(cls._path(directory, f"{name}_data"), mmap_mode=mode) for name in cls.COLUMNS}
+        offsets = {name: np.load(cls._path(directory, f"{name}_offsets"), mmap_mode=mode) for name in cls.COLUMNS}
+        rows = np.load(cls._path(directory, "rows"), mmap_mode=mode)
+        return cls(data, offsets, rows)
@@ -0,0 +1,177 @@
+"""
+Đo thời gian từng bước xử lý và xuất số liệu dạng Prometheus text (GET /metrics).
+
+Mỗi request nhận diện có dict timings (decode_ms, detect_ms, encode_ms, search_ms,
+crop_ms, serialize_ms, ...); observe_request() ghi từng bước vào histogram
+`face_stage_seconds{stage=...}` và toàn bộ request vào `face_request_seconds`.
+Request chậm hơn SLOW_REQUEST_MS được in ra log (lấy mẫu theo SLOW_LOG_SAMPLE)
+kèm thời gian từng bước để biết chậm ở dlib, HNSW hay bước đóng gói JSON.
+
+Số liệu nằm trong bộ nhớ của từng tiến trình: chạy gunicorn nhiều worker thì mỗi
+worker có bộ đếm riêng (Prometheus cộng lại theo instance / pid).
+"""
+import json
+import os
+import random
+import threading
+
+# Ngưỡng (ms) coi là request chậm, <= 0 để tắt log
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+# Tỉ lệ request chậm được in ra log (1 = in tất cả)
+SLOW_LOG_SAMPLE = float(os.getenv("SLOW_LOG_SAMPLE", "0.1"))
+
+# Ranh giới bucket (giây): từ 1 ms tới 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+
+class Histogram:
+    """Histogram Prometheus có nhãn; mỗi bộ nhãn giữ số đếm theo bucket, tổng và số lần."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(s[0]), s[1], s[2]) for key, s in sorted(self._series.items())]
+        for key, counts, total, count in snapshot:
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Counter:
+    """Bộ đếm Prometheus có nhãn (chỉ tăng)."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for key, value in snapshot:
+            lines.append(f"{self.name}{_format_labels(zip(self.label_names, key))} {_format_value(value)}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("face_request_seconds", "Thoi gian xu ly request", ("endpoint",))
+STAGE_SECONDS = Histogram("face_stage_seconds", "Thoi gian tung buoc xu ly", ("endpoint", "stage"))
+REQUESTS_TOTAL = Counter("face_requests_total", "So request theo endpoint va ma trang thai", ("endpoint", "status"))
+FACES_TOTAL = Counter("face_faces_total", "So khuon mat tra ve", ("endpoint",))
+SLOW_REQUESTS_TOTAL = Counter("face_slow_requests_total", "So request cham hon SLOW_REQUEST_MS", ("endpoint",))
+
+# Kích thước các lô knn_query của SearchBatcher (số vector / số request gộp chung)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+SEARCH_BATCH_SIZE = Histogram("hnsw_batch_size", "So vector trong moi lan knn_query", buckets=BATCH_BUCKETS)
+SEARCH_BATCH_REQUESTS = Histogram("hnsw_batch_requests", "So request gop chung moi lan knn_query",
+                                  buckets=BATCH_BUCKETS)
+
+METRICS = [REQUEST_SECONDS, STAGE_SECONDS, REQUESTS_TOTAL, FACES_TOTAL, SLOW_REQUESTS_TOTAL,
+           SEARCH_BATCH_SIZE, SEARCH_BATCH_REQUESTS]
+
+
+def observe_request(endpoint, status, elapsed_ms, timings=None, faces=None) -> None:
+    """Ghi một request (thời gian tổng + từng bước) và in log nếu request chậm."""
+    REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+    REQUEST_SECONDS.observe(elapsed_ms / 1000, endpoint=endpoint)
+    for key, value in (timings or {}).items():
+        if key.endswith("_ms") and value is not None:
+            STAGE_SECONDS.observe(value / 1000, endpoint=endpoint, stage=key[:-3])
+    if faces:
+        FACES_TOTAL.inc(faces, endpoint=endpoint)
+
+    if 0 < SLOW_REQUEST_MS <= elapsed_ms:
+        SLOW_REQUESTS_TOTAL.inc(endpoint=endpoint)
+        if random.random() < SLOW_LOG_SAMPLE:
+            stages = {k: round(v, 1) for k, v in (timings or {}).items() if v is not None}
+            print(f"[WARN] Request cham: {endpoint} status={status} {elapsed_ms:.1f}ms "
+                  f"timings={json.dumps(stages)}")
+
+
+def _gauge_lines(name, help_text, value, metric_type="gauge") -> list:
+    if value is None:
+        return []
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {_format_value(value)}"]
+
+
+def render_metrics(index_stats=None, encoder_stats=None, tracking_sessions=None) -> str:
+    """Toàn bộ số liệu dạng Prometheus text exposition (version 0.0.4)."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    index_stats = index_stats or {}
+    search = index_stats.get("search") or {}
+    lines += _gauge_lines("hnsw_queries_total", "So vector truy van da tim tren HNSW",
+                          search.get("queries"), "counter")
+    lines += _gauge_lines("hnsw_index_size", "So cho da dung trong index", index_stats.get("size"))
+    lines += _gauge_lines("hnsw_index_deleted", "So phan tu da xoa nhung con chiem cho", index_stats.get("deleted"))
+    growth = index_stats.get("growth") or {}
+    lines += _gauge_lines("hnsw_index_capacity", "Suc chua hien tai (max_elements)", growth.get("max_elements"))
+    lines += _gauge_lines("hnsw_resizes_total", "So lan resize index", growth.get("resizes"), "counter")
+    lines += _gauge_lines("hnsw_resize_seconds_total", "Tong thoi gian resize index (giay)",
+                          growth.get("resize_seconds"), "counter")
+
+    cache = index_stats.get("cache") or {}
+    lines += _gauge_lines("result_cache_hits_total", "So lan tim thay trong cache ket qua", cache.get("hits"), "counter")
+    lines += _gauge_lines("result_cache_misses_total", "So lan khong co trong cache ket qua", cache.get("misses"), "counter")
+    lines += _gauge_lines("result_cache_size", "So ket qua dang nam trong cache", cache.get("size"))
+
+    encoder_stats = encoder_stats or {}
+    lines += _gauge_lines("encoder_pending", "So frame dang cho / dang xu ly trong pool encode",
+                          encoder_stats.get("in_flight"))
+    lines += _gauge_lines("encoder_rejected_total", "So frame bi tu choi vi hang doi day",
+                          encoder_stats.get("rejected"), "counter")
+    lines += _gauge_lines("tracking_sessions", "So phien tracking dang giu", tracking_sessions)
+    return "\n".join(lines) + "\n"
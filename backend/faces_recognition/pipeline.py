@@ -0,0 +1,339 @@
+"""
+Tầng detect + encode khuôn mặt chạy trong một pool tiến trình riêng.
+
+Các hàm chạy trong tiến trình con chỉ phụ thuộc vào module này (không import app
+hay hnsw_manager), nên pool có thể dùng start method "spawn" mà không phải nạp lại
+index HNSW / kết nối MongoDB trong từng tiến trình encode.
+"""
+import asyncio
+import base64
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import multiprocessing
+
+import cv2
+import numpy as np
+import face_recognition
+from PIL import Image
+
+from faces_recognition.face_tracker import match_boxes
+
+
+def _default_workers():
+    # Mỗi worker gunicorn có pool riêng: chia số core cho số worker web
+    web_workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+# Số tiến trình encode (0 = chạy ngay trong luồng xử lý request, dùng khi debug)
+ENCODER_WORKERS = int(os.getenv("ENCODER_WORKERS", str(_default_workers())))
+# Số việc được phép chờ thêm khi mọi tiến trình đều bận (ngoài số đang chạy)
+ENCODER_QUEUE = int(os.getenv("ENCODER_QUEUE", str(max(1, ENCODER_WORKERS) * 2)))
+# Thời gian tối đa chờ chỗ trong hàng đợi với ảnh upload (frame webcam không chờ)
+ENCODER_QUEUE_WAIT = float(os.getenv("ENCODER_QUEUE_WAIT", "5"))
+# Frame webcam nằm trong hàng đợi lâu hơn ngưỡng này thì bỏ, không detect nữa
+MAX_FRAME_AGE_MS = float(os.getenv("MAX_FRAME_AGE_MS", "1000"))
+ENCODER_START_METHOD = os.getenv("ENCODER_START_METHOD", "spawn")
+# Ảnh upload lớn hơn cạnh này (px) bị thu nhỏ ngay sau khi decode (0 = không giới hạn);
+# detect, encode và cắt ảnh đều chạy trên bản đã thu nhỏ này
+MAX_IMAGE_DIM = int(os.getenv("MAX_IMAGE_DIM", "1600"))
+# Các mức detect (cạnh dài tối đa, px), thử lần lượt tới khi tìm thấy mặt;
+# 0 = không thu nhỏ thêm (ảnh đã giới hạn theo MAX_IMAGE_DIM). Ví dụ "480,960,0" cho ảnh upload có mặt nhỏ
+DETECT_PYRAMID = [int(v) for v in os.getenv("DETECT_PYRAMID", "640").split(",") if v.strip()] or [0]
+
+
+# Số chiều vector đặc trưng của face_recognition (dlib)
+ENCODING_DIM = 128
+
+
+class EncoderBusyError(RuntimeError):
+    """Hàng đợi encode đã đầy (hoặc frame đã cũ) -> HTTP trả 503 để client gửi lại sau."""
+
+
+# ----------------- CÁC HÀM CHẠY TRONG TIẾN TRÌNH CON -----------------
+def decode_base64_image(base64_string):
+    """Chuyển chuỗi Base64 từ Webcam thành ảnh OpenCV (RGB)"""
+    try:
+        # Nếu chuỗi có header (ví dụ: "data:image/jpeg;base64,..."), hãy cắt bỏ nó
+        if "," in base64_string:
+            base64_string = base64_string.split(",")[1]
+
+        img_bytes = base64.b64decode(base64_string)
+        nparr = np.frombuffer(img_bytes, np.uint8)
+        img_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+        # Quan trọng: OpenCV dùng BGR, face_recognition cần RGB
+        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        return img_rgb
+    except Exception as e:
+        print(f"[ERROR] Loi decode anh: {e}")
+        return None
+
+
+def decode_image_bytes(img_bytes):
+    """Decode bytes ảnh (JPEG/PNG gửi thẳng, không base64) thành ảnh RGB bằng OpenCV"""
+    try:
+        img_bgr = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if img_bgr is None:
+            return None
+        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+    except Exception as e:
+        print(f"[ERROR] Loi decode anh: {e}")
+        return None
+
+
+def crop_face_to_jpeg(image_rgb, top, right, bottom, left, quality=80):
+    """Cắt khuôn mặt và nén JPEG bằng OpenCV, trả về bytes (không qua PIL / base64)"""
+    try:
+        face_bgr = cv2.cvtColor(np.ascontiguousarray(image_rgb[top:bottom, left:right]), cv2.COLOR_RGB2BGR)
+        ok, buf = cv2.imencode(".jpg", face_bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buf.tobytes() if ok else b""
+    except Exception as e:
+        print(f"[ERROR] Loi crop anh: {e}")
+        return b""
+
+
+def crop_face_to_base64(image_rgb, top, right, bottom, left):
+    try:
+        # Cắt ảnh theo toạ độ [y:y+h, x:x+w]
+        face_image = image_rgb[top:bottom, left:right]
+
+        # Chuyển sang PIL Image
+        pil_img = Image.fromarray(face_image)
+
+        # Lưu vào buffer
+        buffered = BytesIO()
+        pil_img.save(buffered, format="JPEG")
+
+        # Encode base64
+        img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        return f"data:image/jpeg;base64,{img_str}"
+    except Exception as e:
+        print(f"[ERROR] Loi crop anh: {e}")
+        return ""
+
+
+def resize_max_dim(image, max_dim):
+    """Thu nhỏ ảnh để cạnh dài <= max_dim. Output: (ảnh, tỉ lệ đã thu nhỏ)"""
+    h, w = image.shape[:2]
+    if max_dim <= 0 or max(h, w) <= max_dim:
+        return image, 1.0
+    scale = max_dim / float(max(h, w))
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+def scale_boxes(locations, scale, shape):
+    """Đổi box trên ảnh đã thu nhỏ `scale` lần về toạ độ ảnh gốc có kích thước `shape`"""
+    h, w = shape[:2]
+    return [(max(0, int(round(top / scale))), min(w, int(round(right / scale))),
+             min(h, int(round(bottom / scale))), max(0, int(round(left / scale))))
+            for top, right, bottom, left in locations]
+
+
+def detect_faces(image, pyramid=None):
+    """
+    Tìm khuôn mặt (HOG) trên bản thu nhỏ của ảnh; chi phí HOG tỉ lệ với số pixel.
+    Thử từng mức trong pyramid, mức đầu tiên tìm thấy mặt được dùng.
+    Output: list box (top, right, bottom, left) theo toạ độ của `image`
+    """
+    for max_dim in (pyramid or DETECT_PYRAMID):
+        small, scale = resize_max_dim(image, max_dim)
+        locations = face_recognition.face_locations(small, model="hog")
+        if locations:
+            return locations if scale == 1.0 else scale_boxes(locations, scale, image.shape)
+        if scale == 1.0:
+            # Các mức sau cũng là chính ảnh này, không detect lại
+            break
+    return []
+
+
+def detect_and_encode(payload, source="file", crop_format="base64", submitted_at=None, max_age_ms=None,
+                      reuse_boxes=None):
+    """
+    Decode ảnh, tìm vị trí khuôn mặt (HOG), encode 128D và cắt ảnh từng khuôn mặt.
+    Ảnh lớn hơn MAX_IMAGE_DIM được thu nhỏ trước: encode và cắt ảnh chạy ở độ phân
+    giải đã giới hạn đó (không phải ảnh gốc), chỉ box trả về được đổi về toạ độ ảnh gốc.
+
+    Args:
+        payload: bytes của file ảnh upload (source="file", đọc bằng PIL), bytes JPEG
+            gửi thẳng (source="bytes", đọc bằng OpenCV) hoặc chuỗi base64 (source="base64")
+        crop_format: "base64" (data URL), "jpeg" (bytes) hoặc None (không cắt ảnh)
+        submitted_at: time.time() lúc request đưa việc vào hàng đợi
+        max_age_ms: Việc chờ lâu hơn ngưỡng này thì bỏ qua (frame webcam đã cũ)
+        reuse_boxes: list (track_id, box) của FaceTracker; khuôn mặt trùng box (IoU)
+            với một track thì không encode lại
+
+    Returns:
+        dict: locations, reuse (track_id hoặc None cho từng khuôn mặt), encodings
+        (m, 128) của các khuôn mặt có reuse = None, crops, timings (ms từng bước),
+        hoặc {"dropped": True} nếu frame đã cũ, {"error": ...} nếu ảnh lỗi
+    """
+    timings = {}
+    start = time.time()
+    if submitted_at is not None:
+        timings["queue_ms"] = (start - submitted_at) * 1000
+        if max_age_ms is not None and timings["queue_ms"] > max_age_ms:
+            return {"dropped": True, "timings": timings}
+
+    t = time.time()
+    if source == "base64":
+        image = decode_base64_image(payload)
+    elif source == "bytes":
+        image = decode_image_bytes(payload)
+    else:
+        try:
+            image = face_recognition.load_image_file(BytesIO(payload))
+        except Exception as e:
+            print(f"[ERROR] Loi decode anh: {e}")
+            image = None
+    timings["decode_ms"] = (time.time() - t) * 1000
+    if image is None:
+        return {"error": "Anh loi, khong decode duoc", "timings": timings}
+
+    # Ảnh quá lớn (ảnh điện thoại 12MP) thu nhỏ về MAX_IMAGE_DIM; encode / cắt ảnh
+    # trên bản này (dlib căn mặt về chip 150x150 nên mặt lớn không mất chi tiết),
+    # box trả về vẫn theo toạ độ ảnh gốc
+    original_shape = image.shape
+    image, image_scale = resize_max_dim(image, MAX_IMAGE_DIM)
+
+    t = time.time()
+    locations = detect_faces(image)
+    timings["detect_ms"] = (time.time() - t) * 1000
+
+    boxes = locations if image_scale == 1.0 else scale_boxes(locations, image_scale, original_shape)
+    reuse = match_boxes(boxes, reuse_boxes) if reuse_boxes else [None] * len(locations)
+    fresh = [loc for loc, track_id in zip(locations, reuse) if track_id is None]
+
+    t = time.time()
+    encodings = face_recognition.face_encodings(image, fresh) if fresh else []
+    timings["encode_ms"] = (time.time() - t) * 1000
+
+    crops = []
+    if crop_format:
+        t = time.time()
+        crop = crop_face_to_jpeg if crop_format == "jpeg" else crop_face_to_base64
+        crops = [crop(image, *loc) for loc in locations]
+        timings["crop_ms"] = (time.time() - t) * 1000
+
+    return {
+        "locations": [tuple(int(v) for v in box) for box in boxes],
+        "reuse": reuse,
+        "encodings": np.array(encodings, dtype=np.float64).reshape(len(fresh), ENCODING_DIM),
+        "crops": crops,
+        "timings": timings,
+    }
+
+
+# ----------------- POOL PHÍA HTTP -----------------
+class EncoderPool:
+    """
+    Pool tiến trình encode với hàng đợi có giới hạn (backpressure):
+    - Tối đa workers + max_pending việc cùng lúc; vượt quá thì raise EncoderBusyError
+      ngay (frame webcam) hoặc sau khi chờ queue_wait giây (ảnh upload).
+    - Executor được tạo lười trong chính tiến trình dùng nó, nên an toàn với
+      preload_app của gunicorn (master không giữ tiến trình con nào để fork theo).
+    """
+
+    def __init__(self, workers: int = ENCODER_WORKERS, max_pending: int = ENCODER_QUEUE,
+                 start_method: str = ENCODER_START_METHOD):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(max(1, workers) + max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                ctx = multiprocessing.get_context(self.start_method)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _acquire(self, blocking: bool) -> None:
+        """Giữ một chỗ trong hàng đợi, raise EncoderBusyError nếu không có chỗ"""
+        acquired = self._slots.acquire(blocking=blocking, timeout=ENCODER_QUEUE_WAIT if blocking else None)
+        with self._lock:
+            if not acquired:
+                self.rejected += 1
+                raise EncoderBusyError("Hang doi encode da day")
+            self.in_flight += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _finish(self, result, submitted_at):
+        if result.get("dropped"):
+            with self._lock:
+                self.rejected += 1
+            raise EncoderBusyError("Frame da cu, bo qua")
+        result["timings"]["pool_ms"] = (time.time() - submitted_at) * 1000
+        return result
+
+    def run(self, payload, source="file", crop_format="base64", drop_stale=False, reuse_boxes=None):
+        """
+        Chạy detect_and_encode trong pool và chờ kết quả.
+
+        Args:
+            reuse_boxes: Các track có thể dùng lại (FaceTracker.reusable_boxes())
+            drop_stale: True với frame webcam: không chờ chỗ trống, và bỏ frame nếu
+                nó nằm trong hàng đợi quá MAX_FRAME_AGE_MS
+        """
+        self._acquire(blocking=not drop_stale)
+        submitted_at = time.time()
+        max_age_ms = MAX_FRAME_AGE_MS if drop_stale else None
+        try:
+            if self.workers <= 0:
+                result = detect_and_encode(payload, source, crop_format, submitted_at, max_age_ms,
+                                           reuse_boxes)
+            else:
+                future = self._get_executor().submit(detect_and_encode, payload, source, crop_format,
+                                                     submitted_at, max_age_ms, reuse_boxes)
+                result = future.result()
+        finally:
+            self._release()
+        return self._finish(result, submitted_at)
+
+    async def run_async(self, payload, source="file", crop_format="base64", drop_stale=False, reuse_boxes=None):
+        """
+        Bản async của run() cho server ASGI: chờ kết quả từ pool tiến trình mà không
+        chiếm luồng nào, nên một event loop phục vụ được nhiều kết nối webcam cùng lúc.
+        """
+        loop = asyncio.get_running_loop()
+        if self.workers <= 0:
+            # Không có pool tiến trình: chạy run() trong thread pool mặc định của event loop
+            return await loop.run_in_executor(None, functools.partial(
+                self.run, payload, source, crop_format, drop_stale, reuse_boxes))
+
+        if drop_stale:
+            self._acquire(blocking=False)
+        else:
+            await loop.run_in_executor(None, self._acquire, True)
+        submitted_at = time.time()
+        max_age_ms = MAX_FRAME_AGE_MS if drop_stale else None
+        try:
+            future = self._get_executor().submit(detect_and_encode, payload, source, crop_format,
+                                                 submitted_at, max_age_ms, reuse_boxes)
+            result = await asyncio.wrap_future(future)
+        finally:
+            self._release()
+        return self._finish(result, submitted_at)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
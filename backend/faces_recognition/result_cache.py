@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Số kết quả tối đa giữ trong cache (0 = tắt cache)
+CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+# Truy vấn mới cách truy vấn đã cache không quá epsilon (L2) thì dùng lại kết quả
+CACHE_EPSILON = float(os.getenv("RESULT_CACHE_EPS", "0.06"))
+# Thời gian sống của một kết quả (giây)
+CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "30"))
+
+
+class QueryResultCache:
+    """
+    Cache LRU kết quả tìm kiếm, khoá theo dạng lượng tử hoá của embedding.
+
+    Embedding 128D được chiếu lên `num_projections` hướng ngẫu nhiên cố định rồi
+    làm tròn theo ô rộng `bucket_width` (LSH kiểu lưới): các truy vấn gần nhau rơi
+    vào cùng một bucket. Trong bucket, kết quả chỉ được dùng lại khi khoảng cách
+    thật tới truy vấn đã cache <= epsilon, nên cache không bao giờ trả kết quả của
+    một truy vấn ở xa (chỉ có thể bỏ lỡ khi hai truy vấn gần nhau nằm ở hai bên ranh
+    giới ô).
+
+    Mọi thay đổi dữ liệu (enroll / xoá / cập nhật) gọi invalidate(): xoá toàn bộ
+    cache và tăng generation để kết quả đang tính dở không được ghi vào nữa.
+    """
+
+    def __init__(self, capacity: int = CACHE_SIZE, epsilon: float = CACHE_EPSILON, ttl: float = CACHE_TTL,
+                 dim: int = 128, num_projections: int = 8, bucket_width: float = None, seed: int = 0):
+        self.capacity = capacity
+        self.epsilon = epsilon
+        self.ttl = ttl
+        # Ô lưới rộng hơn epsilon vài lần để hai truy vấn gần nhau ít khi bị tách bucket
+        # (độ lệch của chúng sau khi chiếu chỉ cỡ epsilon / sqrt(dim))
+        self.bucket_width = bucket_width or max(epsilon * 4, 1e-6)
+        rng = np.random.default_rng(seed)
+        projections = rng.standard_normal((dim, num_projections)).astype(np.float32)
+        self.projections = projections / np.linalg.norm(projections, axis=0, keepdims=True)
+
+        self._buckets = OrderedDict()  # key -> list [(vector, result, created_at)]
+        self._size = 0
+        self._lock = threading.Lock()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _key(self, vector: np.ndarray, params) -> tuple:
+        cell = np.floor(vector @ self.projections / self.bucket_width).astype(np.int32)
+        return (params, cell.tobytes())
+
+    def get(self, vector: np.ndarray, params):
+        """Trả về kết quả đã cache cho truy vấn gần vector (cùng params), hoặc None."""
+        vector = np.asarray(vector, dtype=np.float32)
+        key = self._key(vector, params)
+        now = time.time()
+        with self._lock:
+            entries = self._buckets.get(key)
+            if entries:
+                fresh = [e for e in entries if now - e[2] <= self.ttl]
+                if len(fresh) != len(entries):
+                    self.expired += len(entries) - len(fresh)
+                    self._size -= len(entries) - len(fresh)
+                    if fresh:
+                        self._buckets[key] = fresh
+                    else:
+                        del self._buckets[key]
+                for cached_vector, result, _ in fresh:
+                    if np.linalg.norm(cached_vector - vector) <= self.epsilon:
+                        self._buckets.move_to_end(key)
+                        self.hits += 1
+                        return result
+            self.misses += 1
+            return None
+
+    def put(self, vector: np.ndarray, params, result, generation: int) -> None:
+        """Lưu kết quả; bỏ qua nếu dữ liệu đã đổi kể từ lúc bắt đầu tìm kiếm (generation cũ)."""
+        if result is None:
+            return
+        vector = np.array(vector, dtype=np.float32)
+        key = self._key(vector, params)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._buckets.setdefault(key, []).append((vector, result, time.time()))
+            self._buckets.move_to_end(key)
+            self._size += 1
+            while self._size > self.capacity and self._buckets:
+                _, evicted = self._buckets.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += len(evicted)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._size = 0
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": self._size,
+            "capacity": self.capacity,
+            "epsilon": self.epsilon,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,173 @@
+"""
+Gộp truy vấn của nhiều request đồng thời thành một lần knn_query.
+
+Luồng đến đầu tiên làm "leader". Nếu không có truy vấn nào khác đang chờ hay đang
+chạy, leader tìm ngay (không trả giá cửa sổ chờ khi tải thấp); ngược lại nó chờ tối
+đa BATCH_WINDOW_MS (hoặc tới khi đủ BATCH_MAX vector), lấy mọi truy vấn đang chờ, gọi một lần knn_query với num_threads
+(hnswlib chia batch cho nhiều luồng C++), rồi trả kết quả về từng request. Các luồng
+khác chỉ chờ kết quả. Truy vấn còn dư (vượt BATCH_MAX) được giao cho luồng đang chờ
+đầu tiên làm leader của lô kế tiếp.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from faces_recognition import metrics
+
+
+def _default_threads():
+    web_workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+# Thời gian leader chờ gom truy vấn (ms), 0 = tắt gộp (mỗi request gọi knn_query riêng)
+BATCH_WINDOW_MS = float(os.getenv("SEARCH_BATCH_WINDOW_MS", "2"))
+# Số vector tối đa trong một lần knn_query
+BATCH_MAX = int(os.getenv("SEARCH_BATCH_MAX", "64"))
+# Số luồng hnswlib dùng cho một lô
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", str(_default_threads())))
+
+
+class _Request:
+    __slots__ = ("vectors", "k", "labels", "distances", "error", "done", "lead")
+
+    def __init__(self, vectors, k):
+        self.vectors = vectors
+        self.k = k
+        self.labels = None
+        self.distances = None
+        self.error = None
+        self.done = False
+        self.lead = False
+
+
+class SearchBatcher:
+    def __init__(self, search_fn, window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_MAX,
+                 num_threads: int = SEARCH_THREADS):
+        """
+        Args:
+            search_fn: hàm (query (n, dim) float32, k, num_threads) -> (labels, distances)
+            window_ms: thời gian chờ gom truy vấn
+            max_batch: số vector tối đa mỗi lô
+            num_threads: số luồng cho knn_query của một lô
+        """
+        self.search_fn = search_fn
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.num_threads = num_threads
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pending_count = 0
+        self._has_leader = False
+        # Số lô đang chạy knn_query (ngoài khoá)
+        self._running = 0
+
+        self.batches = 0
+        self.requests = 0
+        self.vectors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def search(self, vectors: np.ndarray, k: int) -> tuple:
+        """knn_query cho vectors (n, dim), có thể được gộp chung lô với request khác."""
+        if not self.enabled:
+            labels, distances = self.search_fn(vectors, k, self.num_threads)
+            self._record([len(vectors)])
+            return labels, distances
+
+        req = _Request(vectors, k)
+        with self._cond:
+            self._pending.append(req)
+            self._pending_count += len(vectors)
+            if not self._has_leader:
+                self._has_leader = True
+                req.lead = True
+            else:
+                # Đánh thức leader để nó kiểm tra lô đã đủ chưa
+                self._cond.notify_all()
+            while not req.done and not req.lead:
+                self._cond.wait()
+            if req.done:
+                return self._result(req)
+
+            batch = self._collect()
+
+        self._run(batch)
+        return self._result(req)
+
+    def _collect(self) -> list:
+        """Leader (đang giữ khoá) chờ gom đủ lô rồi lấy các request ra khỏi hàng đợi."""
+        deadline = time.monotonic() + self.window
+        # Chỉ chờ khi còn request khác đang xếp hàng hoặc một lô khác đang chạy
+        while self._pending_count < self.max_batch and (len(self._pending) > 1 or self._running):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+
+        batch, count = [], 0
+        while self._pending and (not batch or count + len(self._pending[0].vectors) <= self.max_batch):
+            req = self._pending.pop(0)
+            batch.append(req)
+            count += len(req.vectors)
+        self._pending_count -= count
+        self._running += 1
+
+        if self._pending:
+            # Còn truy vấn chờ: giao cho request đầu hàng đợi làm leader lô kế tiếp
+            self._pending[0].lead = True
+            self._cond.notify_all()
+        else:
+            self._has_leader = False
+        return batch
+
+    def _run(self, batch) -> None:
+        try:
+            query = batch[0].vectors if len(batch) == 1 else np.concatenate([r.vectors for r in batch])
+            # Mỗi request có thể hỏi k khác nhau: lấy k lớn nhất rồi cắt (kết quả đã sắp theo khoảng cách)
+            labels, distances = self.search_fn(query, max(r.k for r in batch), self.num_threads)
+            offset = 0
+            for r in batch:
+                n = len(r.vectors)
+                r.labels = labels[offset:offset + n, :r.k]
+                r.distances = distances[offset:offset + n, :r.k]
+                offset += n
+        except Exception as e:
+            for r in batch:
+                r.error = e
+        with self._cond:
+            for r in batch:
+                r.done = True
+            self._running -= 1
+            self._cond.notify_all()
+        self._record([len(r.vectors) for r in batch])
+
+    def _record(self, sizes) -> None:
+        with self._cond:
+            self.batches += 1
+            self.requests += len(sizes)
+            self.vectors += sum(sizes)
+        metrics.SEARCH_BATCH_SIZE.observe(sum(sizes))
+        metrics.SEARCH_BATCH_REQUESTS.observe(len(sizes))
+
+    @staticmethod
+    def _result(req) -> tuple:
+        if req.error is not None:
+            raise req.error
+        return req.labels, req.distances
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "num_threads": self.num_threads,
+            "batches": self.batches,
+            "requests": self.requests,
+            "vectors": self.vectors,
+            "mean_batch_size": self.vectors / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,36 @@
+# Cấu hình gunicorn cho backend
+# Chạy: gunicorn -c gunicorn.conf.py app:app
+import gc
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:10000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Mỗi worker xử lý nhiều request song song bằng luồng (gthread): phần nặng
+# (detect + encode) chạy trong pool tiến trình encode, luồng request chỉ chờ kết quả
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Nạp app (và build / nạp index HNSW) đúng một lần trong tiến trình master,
+# các worker được fork ra và dùng chung bộ nhớ đó theo cơ chế copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    # Master đã ghi snapshot lúc nạp app: trả quyền ghi trước khi fork, để worker đầu
+    # tiên cần lưu (sau khi dồn index) nhận quyền ghi duy nhất
+    from app import search_engine
+    if search_engine.snapshot is not None:
+        search_engine.snapshot.release_writer()
+
+    # Đưa toàn bộ object đã tạo lúc nạp app vào thế hệ "permanent" của GC để các
+    # lần thu gom rác trong worker không ghi vào header của chúng (tránh copy page)
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # MongoClient tạo trong master không dùng lại được sau khi fork
+    from app import search_engine
+    search_engine.connect()
+    # Mỗi worker giữ index riêng: định kỳ bắt kịp enroll / xoá / cập nhật do worker
+    # khác ghi vào MongoDB (luồng nền không đi theo khi fork nên khởi động ở đây)
+    search_engine.start_sync()
@@ -1,22 +1,52 @@
+import heapq
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
 import hnswlib
 import numpy as np
 import pickle
 
 class HNSWSearchSystem:
-    def __init__(self, space: str = 'l2', dim: int = 16):
+    def __init__(self, space: str = 'l2', dim: int = 16, growth_factor: float = 2.0, growth_cap: int = None):
         """
         Khởi tạo hệ thống tìm kiếm
         
         Args:
             space: Không gian khoảng cách ('l2', 'cosine', 'ip')
             dim: Số chiều của vector
+            growth_factor: add_items sắp vượt max_elements thì tự resize lên
+                max_elements * growth_factor (>= 1, 1 = vừa đủ chỗ cho lô đang thêm)
+            growth_cap: Số chỗ tối đa thêm vào trong một lần tự resize (None = không giới hạn)
         """
+        if growth_factor < 1:
+            raise ValueError("growth_factor phải >= 1")
+        if growth_cap is not None and growth_cap < 1:
+            raise ValueError("growth_cap phải >= 1")
         self.space = space
         self.dim = dim
+        self.growth_factor = growth_factor
+        self.growth_cap = growth_cap
+        # Số lần resize và tổng thời gian resize (để chỉnh max_elements ban đầu)
+        self.resize_count = 0
+        self.resize_seconds = 0.0
         self.index = hnswlib.Index(space, dim)
         self.is_built = False
+        self.allow_replace_deleted = False
+        # Số phần tử đã mark_deleted nhưng vẫn chiếm chỗ trong đồ thị
+        self.num_deleted = 0
+        # Tập nhãn đang sống (chưa xoá), giữ song song với hnswlib để kiểm tra
+        # thành viên O(1) thay vì lấy + sắp xếp cả danh sách nhãn từ C++ mỗi lần
+        self.labels = set()
+        self._sorted_ids = None
+        # Số vector truy vấn đã tìm (cộng dồn, dùng cho /metrics)
+        self.num_queries = 0
 
-    def build_hnsw_index(self, max_elements: int = 10000, ef_construction: int = 200, M: int = 128) -> None:
+    def build_hnsw_index(self, max_elements: int = 10000, ef_construction: int = 200, M: int = 128,
+                         allow_replace_deleted: bool = False) -> None:
             """
             Xây dựng chỉ mục HNSW
             
@@ -25,15 +55,19 @@ class HNSWSearchSystem:
                 max_elements: Số lượng phần tử tối đa
                 ef_construction: Tham số ef cho quá trình xây dựng 
                 M: Tham số M (số lượng kết nối tối đa)
+                allow_replace_deleted: Cho phép phần tử mới chiếm chỗ của phần tử đã xoá
             """
             #xây dựng index
             self.max_elements = max_elements
             self.ef_construction = ef_construction
             self.M = M
+            self.allow_replace_deleted = allow_replace_deleted
+            self.num_deleted = 0
             self.is_built = True
             
             # FIXED: Used keyword arguments to ensure M and ef_construction are not swapped
-            self.index.init_index(max_elements=max_elements, M=M, ef_construction=ef_construction)       
+            self.index.init_index(max_elements=max_elements, M=M, ef_construction=ef_construction,
+                                  allow_replace_deleted=allow_replace_deleted)
 
     def set_ef(self, val: int):
          # higher ef leads to better accuracy, but slower search
@@ -46,13 +80,127 @@ class HNSWSearchSystem:
          self.num_threads = val
          self.index.set_num_threads(val)
 
-    def add_items(self, items,  ids = None) -> None:
+    def add_items(self, items,  ids = None, replace_deleted: bool = False, num_threads: int = -1) -> None:
         """
         Thêm các phần tử vào self index
+
+        Args:
+            items: Các vector cần thêm
+            ids: Nhãn tương ứng (mặc định nối tiếp)
+            replace_deleted: Ghi phần tử mới vào chỗ của phần tử đã xoá (cần build
+                với allow_replace_deleted=True và ids phải là nhãn mới)
+            num_threads: Số luồng hnswlib dùng để chèn (-1 = mặc định của index)
         """
         if not self.is_built:
             raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
-        self.index.add_items(items, ids)
+        if replace_deleted and not self.allow_replace_deleted:
+            raise ValueError("Index chưa bật allow_replace_deleted")
+
+        items = np.atleast_2d(items)
+        if ids is None:
+            # hnswlib tự đánh nhãn nối tiếp từ số phần tử hiện có
+            start = self.index.get_current_count()
+            ids = np.arange(start, start + len(items))
+        ids = np.atleast_1d(np.asarray(ids))
+        self._ensure_capacity(ids, replace_deleted)
+
+        if replace_deleted and self.num_deleted > 0:
+            self.index.add_items(items, ids, num_threads=num_threads, replace_deleted=True)
+            # Mỗi nhãn mới lấp một chỗ trống (cho tới khi hết chỗ đã xoá)
+            self.num_deleted = max(0, self.num_deleted - len(items))
+        else:
+            self.index.add_items(items, ids, num_threads=num_threads)
+        self._track_labels(ids)
+
+    def bulk_add(self, vectors, batch_size: int = 4096, start_id: int = None, num_threads: int = -1,
+                 num_buffers: int = 3) -> np.ndarray:
+        """
+        Thêm vector từ một iterable (list, generator...) theo lô lớn thay vì gọi add_items
+        cho từng vector. Vector được chép vào các block float32 (batch_size, dim) cấp sẵn;
+        block đầy được một luồng phụ đưa vào add_items nhiều luồng, trong lúc luồng gọi
+        tiếp tục lấy vector kế tiếp từ iterable (ví dụ trích đặc trưng ảnh) -> trích xuất và
+        chèn chạy chồng lên nhau.
+
+        Args:
+            vectors: Iterable, mỗi phần tử là 1 vector (dim,) hoặc một khối (n, dim)
+            batch_size: Số vector mỗi lần add_items
+            start_id: Nhãn của vector đầu tiên, các vector sau nối tiếp (mặc định = get_size())
+            num_threads: Số luồng hnswlib cho mỗi lần add_items (-1 = mặc định của index)
+            num_buffers: Số block dùng xoay vòng
+
+        Returns: mảng nhãn đã gán, theo thứ tự vector
+        """
+        if not self.is_built:
+            raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
+        next_id = self.get_size() if start_id is None else int(start_id)
+        first_id = next_id
+
+        free = queue.Queue()
+        for _ in range(num_buffers):
+            free.put(np.empty((batch_size, self.dim), dtype=np.float32))
+        full = queue.Queue()
+        errors = []
+
+        def flush():
+            while True:
+                item = full.get()
+                if item is None:
+                    return
+                block, start, n = item
+                try:
+                    if not errors:
+                        self.add_items(block[:n], np.arange(start, start + n), num_threads=num_threads)
+                except Exception as e:
+                    errors.append(e)
+                free.put(block)
+
+        flusher = threading.Thread(target=flush, daemon=True)
+        flusher.start()
+        try:
+            block, n = free.get(), 0
+            for item in vectors:
+                rows = np.asarray(item, dtype=np.float32).reshape(-1, self.dim)
+                while len(rows):
+                    take = min(batch_size - n, len(rows))
+                    block[n:n + take] = rows[:take]
+                    rows = rows[take:]
+                    n += take
+                    if n == batch_size:
+                        full.put((block, next_id, n))
+                        next_id += n
+                        block, n = free.get(), 0
+                if errors:
+                    break
+            if n > 0 and not errors:
+                full.put((block, next_id, n))
+                next_id += n
+        finally:
+            full.put(None)
+            flusher.join()
+        if errors:
+            raise errors[0]
+        return np.arange(first_id, next_id)
+
+    def _ensure_capacity(self, ids, replace_deleted: bool) -> None:
+         """Tự resize trước khi lô nhãn mới vượt max_elements (hnswlib sẽ báo lỗi nếu vượt)"""
+         new = sum(1 for i in ids if int(i) not in self.labels)
+         if replace_deleted:
+              # Nhãn mới lấp chỗ của phần tử đã xoá trước
+              new = max(0, new - self.num_deleted)
+         needed = self.get_size() + new
+         current = self.get_max_elements()
+         if needed <= current:
+              return
+         target = int(current * self.growth_factor)
+         if self.growth_cap is not None:
+              target = min(target, current + self.growth_cap)
+         self.resize_index(max(needed, target))
+
+    def _track_labels(self, ids) -> None:
+         added = set(int(i) for i in ids)
+         if not added.issubset(self.labels):
+              self.labels.update(added)
+              self._sorted_ids = None
 
     def get_items(self, ids):
          if isinstance(ids, int):
@@ -63,35 +211,99 @@ class HNSWSearchSystem:
          return self.dim
     
     def get_size(self):
+         # Số chỗ đã dùng trong đồ thị (gồm cả phần tử đã mark_deleted)
          return self.index.get_current_count()
+
+    def get_live_count(self) -> int:
+         return len(self.labels)
+
+    def has_item(self, label) -> bool:
+         return int(label) in self.labels
+
+    def __contains__(self, label) -> bool:
+         return self.has_item(label)
+
+    def get_max_elements(self):
+         return self.index.get_max_elements()
+
+    def resize_index(self, new_size: int) -> None:
+         # Tăng sức chứa của index (hnswlib cấp phát lại bộ nhớ, giữ nguyên đồ thị)
+         if not self.is_built:
+              raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
+         start = time.perf_counter()
+         self.index.resize_index(new_size)
+         self.resize_seconds += time.perf_counter() - start
+         self.resize_count += 1
+         self.max_elements = new_size
+
+    def get_growth_stats(self) -> dict:
+         """Số lần resize, tổng thời gian resize (giây) và sức chứa hiện tại"""
+         return {
+              "resizes": self.resize_count,
+              "resize_seconds": self.resize_seconds,
+              "max_elements": self.get_max_elements() if self.is_built else 0,
+         }
     
     def get_ids_list(self):
-         return sorted(self.index.get_ids_list())
-    
+         # Danh sách nhãn đang sống, đã sắp xếp; chỉ sắp xếp lại khi tập nhãn thay đổi
+         if self._sorted_ids is None:
+              self._sorted_ids = sorted(self.labels)
+         return list(self._sorted_ids)
+
     def get_all_items(self):
-         ids = self.get_ids_list()
-         return self.get_items(ids)
-    
+         if self._sorted_ids is None:
+              self._sorted_ids = sorted(self.labels)
+         return self.get_items(self._sorted_ids)
+
     def set_items(self, items, ids):
+         # Ghi đè vector của các nhãn đã có, kiểm tra thành viên trên tập nhãn (O(n))
          if isinstance(ids, int):
               ids = [ids]
-         if (all(item in self.get_ids_list() for item in ids)): # for item in ids, if item also in self.ids.list then return true
-              self.index.add_items(items, ids)
-              return
-         else:
+         ids = np.atleast_1d(np.asarray(ids))
+         if not self.labels.issuperset(int(i) for i in ids):
               raise ValueError("ids is invalid")
+         self.index.add_items(items, ids)
          
     def delete_items(self,ids):
+         """
+         Xoá (mark_deleted) một lô nhãn. Nhãn không tồn tại hoặc đã xoá thì bỏ qua.
+
+         Returns: số phần tử thực sự bị xoá
+         """
+         if not self.is_built:
+              raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
          if isinstance(ids, int):
               ids = [ids]
+         deleted = 0
          for id in ids:
-             self.index.mark_deleted(id)
+              try:
+                   self.index.mark_deleted(int(id))
+              except RuntimeError:
+                   continue
+              self.labels.discard(int(id))
+              deleted += 1
+         if deleted:
+              self._sorted_ids = None
+         self.num_deleted += deleted
+         return deleted
+
+    def get_deleted_count(self) -> int:
+         return self.num_deleted
+
+    def get_deleted_ratio(self) -> float:
+         # Tỉ lệ chỗ trong đồ thị đang bị chiếm bởi phần tử đã xoá
+         size = self.get_size()
+         return self.num_deleted / size if size > 0 else 0.0
      
     def clear(self) -> None:
           self.index = hnswlib.Index(self.space, self.dim)
+          self.num_deleted = 0
+          self.labels = set()
+          self._sorted_ids = None
           if hasattr(self, 'max_elements') and hasattr(self, 'ef_construction') and hasattr(self, 'M'):
                # FIXED: Used keyword arguments here as well
-               self.index.init_index(max_elements=self.max_elements, M=self.M, ef_construction=self.ef_construction)
+               self.index.init_index(max_elements=self.max_elements, M=self.M, ef_construction=self.ef_construction,
+                                     allow_replace_deleted=self.allow_replace_deleted)
         
                # Thiết lập lại các tham số tìm kiếm nếu tồn tại
                if hasattr(self, 'ef_search'):
@@ -102,18 +314,64 @@ class HNSWSearchSystem:
                # Nếu chưa từng được build, đánh dấu là chưa build
                self.is_built = False  
       
-    def generate_data(self, num_elements:int) -> None:
-         #Tạo ngẫu nhiên một só các vector để add vào đồ thị
-         data = np.float32(np.random.random((num_elements, self.dim)))
-         self.add_items(data)
+    def save_index(self, path: str) -> None:
+        """
+        Lưu đồ thị HNSW ra file nhị phân (định dạng save_index của hnswlib)
+
+        Args:
+            path: Đường dẫn file index
+        """
+        if not self.is_built:
+            raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
+        self.index.save_index(path)
+
+    def load_index(self, path: str, max_elements: int = 0, allow_replace_deleted: bool = False,
+                   num_deleted: int = 0, live_ids=None) -> None:
+        """
+        Nạp đồ thị HNSW đã lưu bằng save_index(), thay cho việc build lại từ đầu
+
+        Args:
+            path: Đường dẫn file index
+            max_elements: Sức chứa mới sau khi nạp (0 = giữ nguyên như lúc lưu)
+            allow_replace_deleted: Cho phép tái sử dụng chỗ của phần tử đã xoá
+            num_deleted: Số phần tử đã xoá lúc lưu (hnswlib không trả về giá trị này)
+            live_ids: Các nhãn còn sống lúc lưu; None = mọi nhãn trong file
+                (get_ids_list của hnswlib không loại các nhãn đã mark_deleted)
+        """
+        self.index = hnswlib.Index(self.space, self.dim)
+        self.index.load_index(path, max_elements=max_elements, allow_replace_deleted=allow_replace_deleted)
+        self.allow_replace_deleted = allow_replace_deleted
+        self.num_deleted = num_deleted
+        if live_ids is None:
+             live_ids = self.index.get_ids_list()
+        self.labels = set(int(i) for i in live_ids)
+        self._sorted_ids = None
+        self.max_elements = self.index.max_elements
+        self.ef_construction = self.index.ef_construction
+        self.M = self.index.M
+        self.is_built = True
+
+        # Thiết lập lại các tham số tìm kiếm nếu tồn tại
+        if hasattr(self, 'ef_search'):
+             self.index.set_ef(self.ef_search)
+        if hasattr(self, 'num_threads'):
+             self.index.set_num_threads(self.num_threads)
 
-    def knn_query(self, query: np.ndarray, k: int = 1) -> tuple:
+    def generate_data(self, num_elements:int, batch_size: int = 4096) -> None:
+         #Tạo ngẫu nhiên một só các vector để add vào đồ thị, sinh theo từng khối
+         #để không phải giữ cả ma trận num_elements x dim trong bộ nhớ
+         blocks = (np.float32(np.random.random((min(batch_size, num_elements - start), self.dim)))
+                   for start in range(0, num_elements, batch_size))
+         self.bulk_add(blocks, batch_size=batch_size)
+
+    def knn_query(self, query: np.ndarray, k: int = 1, num_threads: int = -1) -> tuple:
         """
         Tìm kiếm K láng giềng gần nhất
         
         Args:
             query: Vector truy vấn (có thể là 1 vector hoặc nhiều vector)
             k: Số lượng kết quả trả về
+            num_threads: Số luồng cho truy vấn batch (-1 = mặc định của index)
         
         Returns:
             (labels, distances): Tuple chứa nhãn và khoảng cách của K kết quả gần nhất
@@ -121,8 +379,115 @@ class HNSWSearchSystem:
         if not self.is_built:
             raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
         
-        labels, distances = self.index.knn_query(query, k)
+        labels, distances = self.index.knn_query(query, k, num_threads=num_threads)
+        self.num_queries += len(labels)
         return labels, distances
+
+    def exact_knn(self, query: np.ndarray, k: int = 1, block_size: int = 65536) -> tuple:
+        """
+        K láng giềng chính xác (brute force) trên các nhãn đang sống, cùng hàm khoảng cách
+        với hnswlib. Duyệt index theo khối block_size vector, mỗi khối một phép nhân ma trận.
+
+        Returns:
+            (labels, distances): mảng (n, k), sắp theo khoảng cách tăng dần
+        """
+        query = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        if self.space == 'cosine':
+            # hnswlib chuẩn hoá vector khi thêm, get_items trả về vector đã chuẩn hoá
+            query = query / np.maximum(np.linalg.norm(query, axis=1, keepdims=True), 1e-30)
+        ids = np.asarray(self.get_ids_list(), dtype=np.int64)
+        if k > len(ids):
+            raise ValueError("k lớn hơn số phần tử trong index")
+
+        best_d = np.full((len(query), k), np.inf, dtype=np.float32)
+        best_l = np.zeros((len(query), k), dtype=np.int64)
+        q_norms = np.einsum('ij,ij->i', query, query)[:, None]
+        for start in range(0, len(ids), block_size):
+            block_ids = ids[start:start + block_size]
+            block = np.asarray(self.get_items(block_ids.tolist()), dtype=np.float32)
+            dots = query @ block.T
+            if self.space == 'l2':
+                d = q_norms + np.einsum('ij,ij->i', block, block)[None, :] - 2 * dots
+            else:
+                d = 1 - dots
+            cand_d = np.concatenate([best_d, d], axis=1)
+            cand_l = np.concatenate([best_l, np.broadcast_to(block_ids, d.shape)], axis=1)
+            top = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+            best_d = np.take_along_axis(cand_d, top, axis=1)
+            best_l = np.take_along_axis(cand_l, top, axis=1)
+
+        order = np.argsort(best_d, axis=1)
+        return np.take_along_axis(best_l, order, axis=1), np.take_along_axis(best_d, order, axis=1)
+
+    def autotune_ef(self, sample_queries, target_recall: float = 0.95, k: int = 10, ef_max: int = 1024,
+                    num_threads: int = -1, apply: bool = True) -> dict:
+        """
+        Chọn ef nhỏ nhất đạt recall@k >= target_recall trên tập truy vấn mẫu.
+
+        Kết quả chính xác được tính một lần bằng exact_knn, sau đó tìm nhị phân ef trong
+        [k, ef_max] (recall tăng theo ef); mỗi ef thử được đo recall và QPS của cả batch.
+
+        Args:
+            sample_queries: Các truy vấn đại diện cho tải thực tế, mảng (n, dim)
+            target_recall: Recall@k cần đạt (0..1]
+            k: Số láng giềng dùng để tính recall
+            ef_max: ef lớn nhất được thử
+            num_threads: Số luồng cho knn_query khi đo QPS
+            apply: True -> set_ef(ef đã chọn); False -> giữ nguyên ef hiện tại
+
+        Returns:
+            {"ef", "recall", "qps", "target_recall", "k", "met", "curve": [{"ef", "recall", "qps"}, ...]}
+            met = False nếu ef_max vẫn chưa đạt target (khi đó chọn ef_max)
+        """
+        if not self.is_built:
+            raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
+        if not 0 < target_recall <= 1:
+            raise ValueError("target_recall phải nằm trong (0, 1]")
+        queries = np.atleast_2d(np.asarray(sample_queries, dtype=np.float32))
+        k = min(k, self.get_live_count())
+        if len(queries) == 0 or k < 1:
+            raise ValueError("Cần ít nhất một truy vấn mẫu và một phần tử trong index")
+        ef_max = max(ef_max, k)
+
+        truth, _ = self.exact_knn(queries, k)
+        truth_sets = [set(row) for row in truth.tolist()]
+        previous_ef = getattr(self, 'ef_search', None)
+        curve = {}
+
+        def evaluate(ef):
+            if ef not in curve:
+                self.set_ef(ef)
+                start = time.perf_counter()
+                labels, _ = self.index.knn_query(queries, k, num_threads=num_threads)
+                elapsed = time.perf_counter() - start
+                hits = sum(len(t.intersection(row)) for t, row in zip(truth_sets, labels.tolist()))
+                curve[ef] = {"ef": ef, "recall": hits / (len(queries) * k),
+                             "qps": len(queries) / elapsed if elapsed > 0 else float('inf')}
+            return curve[ef]["recall"]
+
+        met = evaluate(ef_max) >= target_recall
+        lo, hi = k, ef_max
+        if met:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if evaluate(mid) >= target_recall:
+                    hi = mid
+                else:
+                    lo = mid + 1
+        chosen = curve[hi]
+
+        if apply:
+            self.set_ef(hi)
+        elif previous_ef is not None:
+            self.set_ef(previous_ef)
+        result = dict(chosen, target_recall=target_recall, k=k, met=met,
+                      curve=[curve[ef] for ef in sorted(curve)])
+        self.ef_tuning = result
+        return result
+
+    def get_metric_stats(self) -> dict:
+        """Bộ đếm cộng dồn khi tìm kiếm: số vector truy vấn đã tìm trên index."""
+        return {"queries": self.num_queries}
     
     def get_graph_max_level(self) -> int:
         """Trả về tầng cao nhất của toàn bộ đồ thị HNSW."""
@@ -154,5 +519,238 @@ class HNSWSearchSystem:
         if hasattr(self.index, 'get_entry_point_label'):
              return self.index.get_entry_point_label()
         return None
-    
-    
+
+
+class ShardedHNSWSearchSystem:
+    """
+    Chia dữ liệu thành num_shards index HNSW độc lập (nhãn -> shard label % num_shards),
+    cùng API với HNSWSearchSystem. Mỗi shard chỉ cần max_elements / num_shards nên
+    build và resize nhanh hơn, add_items chèn vào các shard song song, knn_query hỏi
+    mọi shard cùng lúc trong thread pool (hnswlib nhả GIL khi tìm) rồi trộn top-k của
+    các shard bằng heap.
+    """
+
+    def __init__(self, space: str = 'l2', dim: int = 16, num_shards: int = 4,
+                 growth_factor: float = 2.0, growth_cap: int = None):
+        """
+        Args:
+            space: Không gian khoảng cách ('l2', 'cosine', 'ip')
+            dim: Số chiều của vector
+            num_shards: Số index con
+            growth_factor, growth_cap: Chính sách tự resize của từng shard (xem HNSWSearchSystem)
+        """
+        if num_shards < 1:
+            raise ValueError("num_shards phải >= 1")
+        self.space = space
+        self.dim = dim
+        self.num_shards = num_shards
+        self.shards = [HNSWSearchSystem(space=space, dim=dim, growth_factor=growth_factor, growth_cap=growth_cap)
+                       for _ in range(num_shards)]
+        self.pool = ThreadPoolExecutor(max_workers=num_shards, thread_name_prefix="hnsw-shard")
+        self.is_built = False
+        self.allow_replace_deleted = False
+        # Nhãn kế tiếp khi add_items không truyền ids
+        self.next_id = 0
+        self.num_queries = 0
+
+    def _shard_threads(self, num_threads: int) -> int:
+        # Mỗi shard chạy song song nên chia số luồng hnswlib cho các shard
+        if num_threads is None or num_threads <= 0:
+            num_threads = os.cpu_count() or 1
+        return max(1, num_threads // self.num_shards)
+
+    def _route(self, ids: np.ndarray) -> list:
+        """Chỉ số (trong ids) của các phần tử thuộc từng shard"""
+        shard_of = ids % self.num_shards
+        return [np.flatnonzero(shard_of == s) for s in range(self.num_shards)]
+
+    def _map(self, fn, args) -> list:
+        """Chạy fn(shard, arg) trên các shard song song, giữ thứ tự shard"""
+        futures = [self.pool.submit(fn, shard, arg) for shard, arg in zip(self.shards, args)]
+        return [f.result() for f in futures]
+
+    def build_hnsw_index(self, max_elements: int = 10000, ef_construction: int = 200, M: int = 128,
+                         allow_replace_deleted: bool = False) -> None:
+        """
+        Khởi tạo các shard, mỗi shard chứa được max_elements / num_shards phần tử
+
+        Args:
+            max_elements: Tổng số phần tử tối đa
+            ef_construction: Tham số ef cho quá trình xây dựng
+            M: Tham số M (số lượng kết nối tối đa)
+            allow_replace_deleted: Cho phép phần tử mới chiếm chỗ của phần tử đã xoá
+        """
+        self.max_elements = max_elements
+        self.ef_construction = ef_construction
+        self.M = M
+        self.allow_replace_deleted = allow_replace_deleted
+        per_shard = -(-max_elements // self.num_shards)
+        for shard in self.shards:
+            shard.build_hnsw_index(max_elements=per_shard, ef_construction=ef_construction, M=M,
+                                   allow_replace_deleted=allow_replace_deleted)
+        self.next_id = 0
+        self.is_built = True
+
+    def set_ef(self, val: int):
+        self.ef_search = val
+        for shard in self.shards:
+            shard.set_ef(val)
+
+    def set_num_threads(self, val: int):
+        self.num_threads = val
+        for shard in self.shards:
+            shard.set_num_threads(self._shard_threads(val))
+
+    def add_items(self, items, ids=None, replace_deleted: bool = False, num_threads: int = -1) -> None:
+        """
+        Chia các phần tử theo shard rồi chèn vào các shard song song
+
+        Args:
+            items: Các vector cần thêm
+            ids: Nhãn tương ứng (mặc định nối tiếp)
+            replace_deleted: Ghi phần tử mới vào chỗ của phần tử đã xoá (trong shard của nhãn)
+            num_threads: Tổng số luồng hnswlib (-1 = mọi core), chia đều cho các shard
+        """
+        if not self.is_built:
+            raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
+        if replace_deleted and not self.allow_replace_deleted:
+            raise ValueError("Index chưa bật allow_replace_deleted")
+
+        items = np.atleast_2d(np.asarray(items, dtype=np.float32))
+        if ids is None:
+            ids = np.arange(self.next_id, self.next_id + len(items))
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if len(ids) != len(items):
+            raise ValueError("Số lượng ids không khớp số vector")
+        if len(ids):
+            self.next_id = max(self.next_id, int(ids.max()) + 1)
+
+        threads = self._shard_threads(num_threads)
+
+        def add(shard, rows):
+            if len(rows):
+                shard.add_items(items[rows], ids[rows], replace_deleted=replace_deleted, num_threads=threads)
+
+        self._map(add, self._route(ids))
+
+    def set_items(self, items, ids):
+        items = np.atleast_2d(np.asarray(items, dtype=np.float32))
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if not all(self.has_item(i) for i in ids):
+            raise ValueError("ids is invalid")
+        self.add_items(items, ids)
+
+    def knn_query(self, query: np.ndarray, k: int = 1, num_threads: int = -1) -> tuple:
+        """
+        Tìm K láng giềng gần nhất trên mọi shard rồi trộn kết quả
+
+        Args:
+            query: Vector truy vấn (có thể là 1 vector hoặc nhiều vector)
+            k: Số lượng kết quả trả về
+            num_threads: Tổng số luồng cho truy vấn batch (-1 = mọi core)
+
+        Returns:
+            (labels, distances): mảng (n, min(k, số phần tử còn sống)), sắp theo khoảng
+            cách tăng dần. Khác một index đơn, k lớn hơn số phần tử không làm lỗi mà trả
+            về mọi phần tử còn sống.
+        """
+        if not self.is_built:
+            raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
+        query = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        # Mỗi shard cũng tự giới hạn k theo số phần tử của nó (bên dưới)
+        k = min(k, self.get_live_count())
+
+        threads = self._shard_threads(num_threads)
+
+        def search(shard, _):
+            # Shard ít phần tử hơn k chỉ trả về những gì nó có
+            shard_k = min(k, shard.get_live_count())
+            if shard_k == 0:
+                return None
+            return shard.knn_query(query, k=shard_k, num_threads=threads)
+
+        results = [r for r in self._map(search, [None] * self.num_shards) if r is not None]
+        self.num_queries += len(query)
+        if len(results) == 1:
+            return results[0]
+
+        labels = np.empty((len(query), k), dtype=np.uint64)
+        distances = np.empty((len(query), k), dtype=np.float32)
+        shard_rows = [(l.tolist(), d.tolist()) for l, d in results]
+        for i in range(len(query)):
+            # Kết quả mỗi shard đã sắp theo khoảng cách: trộn k-way bằng heap, lấy k đầu
+            merged = heapq.merge(*(zip(d[i], l[i]) for l, d in shard_rows))
+            for j, (dist, label) in enumerate(islice(merged, k)):
+                labels[i, j] = label
+                distances[i, j] = dist
+        return labels, distances
+
+    def delete_items(self, ids):
+        """Xoá (mark_deleted) một lô nhãn trên shard tương ứng. Returns: số phần tử thực sự bị xoá"""
+        if not self.is_built:
+            raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        return sum(shard.delete_items(ids[rows].tolist())
+                   for shard, rows in zip(self.shards, self._route(ids)) if len(rows))
+
+    def get_items(self, ids):
+        """Vector của các nhãn, theo đúng thứ tự ids"""
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        out = np.empty((len(ids), self.dim), dtype=np.float32)
+        for shard, rows in zip(self.shards, self._route(ids)):
+            if len(rows):
+                out[rows] = shard.get_items(ids[rows].tolist())
+        return out
+
+    def get_dim(self):
+        return self.dim
+
+    def get_size(self):
+        return sum(shard.get_size() for shard in self.shards)
+
+    def get_live_count(self) -> int:
+        return sum(shard.get_live_count() for shard in self.shards)
+
+    def has_item(self, label) -> bool:
+        return self.shards[int(label) % self.num_shards].has_item(label)
+
+    def __contains__(self, label) -> bool:
+        return self.has_item(label)
+
+    def get_max_elements(self):
+        # Sức chứa nhỏ nhất của một shard nhân số shard: nhãn nối tiếp chia đều nên
+        # shard đầy trước quyết định khi nào cần resize
+        return min(shard.get_max_elements() for shard in self.shards) * self.num_shards
+
+    def resize_index(self, new_size: int) -> None:
+        if not self.is_built:
+            raise ValueError("Chưa build index! Gọi build_hnsw_index() trước.")
+        per_shard = -(-new_size // self.num_shards)
+        for shard in self.shards:
+            if per_shard > shard.get_max_elements():
+                shard.resize_index(per_shard)
+        self.max_elements = new_size
+
+    def get_growth_stats(self) -> dict:
+        shard_stats = [shard.get_growth_stats() for shard in self.shards]
+        return {name: sum(s[name] for s in shard_stats) for name in ("resizes", "resize_seconds", "max_elements")}
+
+    def get_ids_list(self):
+        return sorted(label for shard in self.shards for label in shard.labels)
+
+    def get_all_items(self):
+        return self.get_items(self.get_ids_list())
+
+    def get_deleted_count(self) -> int:
+        return sum(shard.get_deleted_count() for shard in self.shards)
+
+    def get_deleted_ratio(self) -> float:
+        size = self.get_size()
+        return self.get_deleted_count() / size if size > 0 else 0.0
+
+    def get_metric_stats(self) -> dict:
+        return {"queries": self.num_queries}
+
+    def generate_data(self, num_elements: int) -> None:
+        data = np.float32(np.random.random((num_elements, self.dim)))
+        self.add_items(data)
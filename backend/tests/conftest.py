@@ -0,0 +1,47 @@
+import os
+import sys
+
+import mongomock
+import numpy as np
+import pytest
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from faces_recognition import hnsw_manager
+
+DIM = 128
+
+
+@pytest.fixture
+def collection(monkeypatch, tmp_path):
+    """Collection MongoDB giả (mongomock); snapshot ghi vào thư mục tạm của test."""
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(hnsw_manager, "MongoClient", lambda *args, **kwargs: client)
+    monkeypatch.setenv("MONGO_URI", "mongodb://test")
+    monkeypatch.setenv("INDEX_SNAPSHOT_DIR", str(tmp_path / "snapshot"))
+    return client["FaceRecProject"]["PeopleMetadata"]
+
+
+def random_vectors(n, seed=0):
+    return np.random.default_rng(seed).random((n, DIM), dtype=np.float32)
+
+
+def seed_people(collection, n, start=0, seed=0):
+    """Thêm n người (MSSV S<i>), mỗi người một vector; trả về ma trận vector"""
+    vectors = random_vectors(n, seed)
+    collection.insert_many([
+        {"MSSV": f"S{start + i}", "Ten": f"Name {start + i}", "feature_vector": vec.tolist()}
+        for i, vec in enumerate(vectors)
+    ])
+    return vectors
+
+
+@pytest.fixture
+def make_engine(collection):
+    """Tạo FaceSearchEngine mới và khởi động (snapshot nếu có, không thì build từ Mongo)."""
+    def make(**kwargs):
+        engine = hnsw_manager.FaceSearchEngine(**kwargs)
+        engine.load_data_and_build_index()
+        return engine
+    return make
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from conftest import random_vectors, seed_people
+
+
+@pytest.mark.parametrize("threshold, status", [(0.5, "found"), (0.3, "unknown")])
+def test_threshold_means_the_same_in_both_modes(collection, make_engine, threshold, status):
+    vectors = seed_people(collection, 20)
+    engine = make_engine()
+    # Truy vấn cách vector của S5 đúng 0.4 (khoảng cách Euclid)
+    direction = random_vectors(1, seed=3)[0] - 0.5
+    query = vectors[5] + 0.4 * direction / np.linalg.norm(direction)
+
+    hnsw = engine.search_faces([query], threshold=threshold)[0]
+    exact = engine.exact_search([query], threshold=threshold)[0]
+    assert hnsw["status"] == exact["status"] == status
+    assert hnsw["distance"] == pytest.approx(0.4, abs=1e-3)
+    assert exact["distance"] == pytest.approx(0.4, abs=1e-3)
+    assert set(hnsw) == set(exact)
+
+
+def test_margin_means_the_same_in_both_modes(collection, make_engine):
+    vectors = seed_people(collection, 20)
+    engine = make_engine()
+    query = vectors[5] + 0.01
+    hnsw = engine.search_faces([query])[0]
+    exact = engine.exact_search([query])[0]
+    assert hnsw["margin"] == pytest.approx(exact["margin"], rel=1e-4)
+
+    # margin lớn hơn khoảng cách tới người thứ hai -> unknown ở cả hai chế độ
+    big = hnsw["margin"] + 0.1
+    assert engine.search_faces([query], margin=big)[0]["status"] == "unknown"
+    assert engine.exact_search([query], margin=big)[0]["status"] == "unknown"
+
+
+def test_empty_index_results_have_the_same_shape(collection, make_engine):
+    seed_people(collection, 1)
+    engine = make_engine()
+    engine.delete_person("S0")
+    query = random_vectors(2, seed=1)
+    assert engine.search_faces(query) == engine.exact_search(query)
+    assert engine.search_faces(query)[0] == {"status": "unknown", "distance": None, "margin": None, "candidates": []}
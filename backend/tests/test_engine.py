@@ -0,0 +1,133 @@
+from contextlib import contextmanager
+
+import pytest
+
+from conftest import random_vectors, seed_people
+
+
+def test_enroll_search_delete_search(collection, make_engine):
+    seed_people(collection, 20)
+    engine = make_engine()
+    vector = random_vectors(1, seed=42)[0]
+
+    assert engine.search_face(vector)["status"] == "unknown"
+
+    enrolled = engine.enroll(vector, "N1", "New Person")
+    result = engine.search_face(vector)
+    assert result["status"] == "found"
+    assert result["info"]["MSSV"] == "N1"
+    assert engine.exact_search([vector])[0]["info"]["MSSV"] == "N1"
+
+    assert engine.delete_person("N1") == 1
+    assert collection.count_documents({"MSSV": "N1"}) == 0
+    result = engine.search_face(vector)
+    assert result["status"] == "unknown"
+    assert all(c["MSSV"] != "N1" for c in result["candidates"])
+    assert engine.exact_search([vector])[0]["status"] == "unknown"
+    assert enrolled["label"] not in engine.metadata_mapping
+
+
+def test_search_after_deleting_below_k(collection, make_engine):
+    vectors = random_vectors(10, seed=5)
+    seed_people(collection, 1)
+    engine = make_engine()
+    engine.delete_person("S0")
+    for i, vec in enumerate(vectors):
+        engine.enroll(vec, f"P{i}", f"Person {i}")
+    for i in range(6):
+        engine.delete_person(f"P{i}")
+
+    # Còn 4 người sống, ít hơn k mặc định (5), trong khi index vẫn giữ 11 chỗ
+    assert engine.search_system.get_live_count() == 4
+    assert engine.search_system.get_size() > 5
+    results = engine.search_faces(vectors[6:], k=5)
+    assert [r["info"]["MSSV"] for r in results] == ["P6", "P7", "P8", "P9"]
+    assert all(len(r["candidates"]) == 4 for r in results)
+
+
+def test_update_person_keeps_label_and_mongo_id(collection, make_engine):
+    vectors = seed_people(collection, 10)
+    engine = make_engine()
+    old_label = engine.label_by_mongo_id[str(collection.find_one({"MSSV": "S4"})["_id"])]
+    size = engine.search_system.get_size()
+
+    new_vector = random_vectors(1, seed=77)[0]
+    updated = engine.update_person("S4", new_vector, "Renamed")
+    assert updated["label"] == old_label
+    assert updated["MongoID"] == str(collection.find_one({"MSSV": "S4"})["_id"])
+    assert collection.count_documents({"MSSV": "S4"}) == 1
+    assert engine.search_system.get_size() == size
+
+    result = engine.search_face(new_vector)
+    assert result["info"]["MSSV"] == "S4" and result["info"]["Ten"] == "Renamed"
+    assert engine.search_face(vectors[4])["status"] == "unknown"
+
+
+def test_update_person_merges_multiple_faces(collection, make_engine):
+    seed_people(collection, 5)
+    extra = random_vectors(1, seed=31)[0]
+    collection.insert_one({"MSSV": "S2", "Ten": "Name 2", "feature_vector": extra.tolist()})
+    engine = make_engine()
+
+    new_vector = random_vectors(1, seed=32)[0]
+    engine.update_person("S2", new_vector)
+    assert collection.count_documents({"MSSV": "S2"}) == 1
+    assert engine.search_face(extra)["status"] == "unknown"
+    assert engine.search_face(new_vector)["info"]["Ten"] == "Name 2"
+
+
+def test_sync_from_db_picks_up_writes_of_another_worker(collection, make_engine):
+    vectors = seed_people(collection, 20)
+    writer, other = make_engine(), make_engine()
+    assert other.sync_from_db() == (0, 0)
+
+    new_vector = random_vectors(1, seed=42)[0]
+    writer.enroll(new_vector, "N1", "New Person")
+    writer.delete_person("S3")
+    updated_vector = random_vectors(1, seed=43)[0]
+    writer.update_person("S5", updated_vector, "Renamed")
+    assert other.search_face(new_vector)["status"] == "unknown"
+
+    assert other.sync_from_db() == (2, 1)
+    assert other.search_face(new_vector)["info"]["MSSV"] == "N1"
+    assert other.search_face(vectors[3])["status"] == "unknown"
+    assert other.exact_search([vectors[3]])[0]["status"] == "unknown"
+    result = other.search_face(updated_vector)
+    assert result["info"]["MSSV"] == "S5" and result["info"]["Ten"] == "Renamed"
+    assert other.search_face(vectors[5])["status"] == "unknown"
+    assert other.sync_from_db() == (0, 0)
+
+
+def test_failed_update_keeps_the_old_face(collection, make_engine):
+    vectors = seed_people(collection, 5)
+    engine = make_engine()
+    try:
+        engine.update_person("S1", [0.0] * 3)
+    except ValueError:
+        pass
+    assert collection.count_documents({"MSSV": "S1"}) == 1
+    assert engine.search_face(vectors[1])["info"]["MSSV"] == "S1"
+
+
+@pytest.mark.parametrize("method", ["search_faces", "exact_search"])
+def test_delete_between_cache_lookup_and_search(collection, make_engine, monkeypatch, method):
+    vectors = seed_people(collection, 3)
+    engine = make_engine()
+    # Không build lại nền (luồng build lại cũng lấy khoá đọc)
+    engine.compact_ratio = 2.0
+    read_locked = engine.lock.read_locked
+    pending = ["S1", "S2"]
+
+    @contextmanager
+    def delete_then_lock():
+        # Xoá chen vào ngay trước khi lượt tìm kiếm lấy khoá đọc
+        while pending:
+            engine.delete_person(pending.pop())
+        with read_locked():
+            yield
+    monkeypatch.setattr(engine.lock, "read_locked", delete_then_lock)
+
+    result = getattr(engine, method)([vectors[0]], k=3)[0]
+    assert not pending
+    assert result["info"]["MSSV"] == "S0"
+    assert [c["MSSV"] for c in result["candidates"]] == ["S0"]
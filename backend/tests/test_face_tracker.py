@@ -0,0 +1,40 @@
+import multiprocessing
+
+import pytest
+
+from faces_recognition import face_tracker
+from faces_recognition.face_tracker import FaceTracker
+
+
+def test_invalidate_all_resets_existing_trackers():
+    tracker = FaceTracker()
+    tracker.update([(0, 10, 10, 0)], [None], [[0.0]], [{"status": "found"}])
+    assert tracker.reusable_boxes()
+
+    face_tracker.invalidate_all()
+    assert tracker.reusable_boxes() == []
+
+
+def test_changing_search_params_resets_tracks():
+    tracker = FaceTracker()
+    key = ("hnsw", 5, None, None)
+    assert tracker.reusable_boxes(key) == []
+    tracker.update([(0, 10, 10, 0)], [None], [[0.0]], [{"status": "found"}])
+    assert tracker.reusable_boxes(key)
+
+    # Cùng session đổi threshold: kết quả cũ tính theo threshold khác, phải tìm lại
+    assert tracker.reusable_boxes(("hnsw", 5, 0.3, None)) == []
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="cần fork")
+def test_generation_is_shared_with_forked_workers():
+    tracker = FaceTracker()
+    tracker.update([(0, 10, 10, 0)], [None], [[0.0]], [{"status": "found"}])
+
+    # Giống worker gunicorn fork từ master (preload_app) rồi nhận request enroll
+    worker = multiprocessing.get_context("fork").Process(target=face_tracker.invalidate_all)
+    worker.start()
+    worker.join(10)
+    assert worker.exitcode == 0
+
+    assert tracker.reusable_boxes() == []
@@ -0,0 +1,88 @@
+import numpy as np
+
+from hnsw import HNSWSearchSystem, ShardedHNSWSearchSystem
+
+
+def build(dim=16, max_elements=10, **kwargs):
+    system = HNSWSearchSystem(space='l2', dim=dim, **kwargs)
+    system.build_hnsw_index(max_elements=max_elements, ef_construction=100, M=16, allow_replace_deleted=True)
+    system.set_ef(100)
+    return system
+
+
+def test_add_items_grows_capacity():
+    system = build(max_elements=10)
+    data = np.random.default_rng(0).random((100, 16), dtype=np.float32)
+    for start in range(0, 100, 7):
+        system.add_items(data[start:start + 7])
+    assert system.get_size() == 100
+    stats = system.get_growth_stats()
+    assert stats["resizes"] > 0 and stats["max_elements"] >= 100
+    labels, _ = system.knn_query(data[42], k=1)
+    assert labels[0][0] == 42
+
+
+def test_bulk_add_from_generator():
+    system = build(max_elements=4)
+    data = np.random.default_rng(1).random((1000, 16), dtype=np.float32)
+    ids = system.bulk_add((row for row in data), batch_size=64)
+    assert ids.tolist() == list(range(1000))
+    assert system.get_size() == 1000
+    np.testing.assert_allclose(system.get_items([0, 500, 999]), data[[0, 500, 999]])
+
+
+def test_bulk_add_propagates_generator_errors():
+    system = build()
+
+    def broken():
+        yield np.zeros(16, dtype=np.float32)
+        raise KeyError("boom")
+
+    try:
+        system.bulk_add(broken())
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("lỗi trong generator phải được ném lại")
+
+
+def test_exact_knn_matches_numpy():
+    system = build(max_elements=200)
+    data = np.random.default_rng(2).random((200, 16), dtype=np.float32)
+    system.add_items(data)
+    queries = np.random.default_rng(3).random((5, 16), dtype=np.float32)
+    labels, distances = system.exact_knn(queries, k=3)
+    expected = ((queries[:, None, :] - data[None, :, :]) ** 2).sum(-1)
+    np.testing.assert_array_equal(labels, np.argsort(expected, axis=1)[:, :3])
+    np.testing.assert_allclose(distances, np.sort(expected, axis=1)[:, :3], rtol=1e-4)
+
+
+def test_sharded_merge_matches_single_index():
+    data = np.random.default_rng(4).random((300, 16), dtype=np.float32)
+    queries = np.random.default_rng(5).random((20, 16), dtype=np.float32)
+    single = build(max_elements=300)
+    sharded = ShardedHNSWSearchSystem(space='l2', dim=16, num_shards=3)
+    sharded.build_hnsw_index(max_elements=300, ef_construction=100, M=16)
+    sharded.set_ef(300)
+    single.set_ef(300)
+    for system in (single, sharded):
+        system.add_items(data, np.arange(300))
+        system.delete_items(list(range(0, 300, 4)))
+
+    labels, distances = sharded.knn_query(queries, k=10)
+    expected_labels, expected_distances = single.knn_query(queries, k=10)
+    np.testing.assert_array_equal(labels, expected_labels)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+
+
+def test_sharded_k_larger_than_live_count_returns_everything():
+    data = np.random.default_rng(6).random((7, 16), dtype=np.float32)
+    sharded = ShardedHNSWSearchSystem(space='l2', dim=16, num_shards=4)
+    sharded.build_hnsw_index(max_elements=16, ef_construction=100, M=16)
+    sharded.add_items(data, np.arange(7))
+    sharded.delete_items([1, 2])
+
+    labels, distances = sharded.knn_query(data[0], k=10)
+    assert labels.shape == (1, 5)
+    assert sorted(labels[0].tolist()) == [0, 3, 4, 5, 6]
+    assert labels[0][0] == 0 and distances[0][0] == 0
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+
+from faces_recognition.metadata_table import MetadataTable
+
+
+def info(i, name=None):
+    return {"MSSV": f"S{i}", "Ten": name or f"Nguyễn Văn {i}", "MongoID": f"{i:024x}"}
+
+
+def file_bytes(directory):
+    return {name: open(os.path.join(directory, name), "rb").read() for name in sorted(os.listdir(directory))}
+
+
+def test_get_many_matches_get():
+    table = MetadataTable.from_mapping({i: info(i) for i in range(0, 20, 2)})
+    table[5] = {"MSSV": "", "Ten": "Trần Thị Ánh", "MongoID": "x"}
+    labels = np.array([[4, 5, 4], [-1, 7, 1000]])
+
+    assert table.get_many(labels) == [table.get(int(label)) for label in labels.ravel()]
+    assert table.get_many(labels)[1] == {"MSSV": "", "Ten": "Trần Thị Ánh", "MongoID": "x"}
+    assert table.get_many(np.zeros((0, 5), dtype=np.int64)) == []
+
+
+def test_save_load_round_trip(tmp_path):
+    mapping = {i: info(i) for i in range(50)}
+    table = MetadataTable.from_mapping(mapping)
+    table[7] = info(7, "Đổi tên")
+    table.pop(3)
+    table.save(str(tmp_path))
+
+    for mmap in (True, False):
+        loaded = MetadataTable.load(str(tmp_path), mmap=mmap)
+        expected = dict(mapping)
+        expected[7] = info(7, "Đổi tên")
+        del expected[3]
+        assert loaded.to_mapping() == expected
+        assert len(loaded) == 49 and 3 not in loaded
+
+
+def test_overwrite_and_delete():
+    table = MetadataTable()
+    table[1] = info(1)
+    table[1] = info(1, "Tên mới")
+    assert table.get(1) == info(1, "Tên mới")
+    assert len(table) == 1
+
+    assert table.pop(1) == info(1, "Tên mới")
+    assert table.pop(1, "missing") == "missing"
+    assert 1 not in table and table.get(1) is None
+    assert table.get_many([1]) == [None]
+
+
+def test_overwrites_do_not_grow_without_bound():
+    table = MetadataTable.from_mapping({i: info(i) for i in range(10)})
+    for round_ in range(5 * MetadataTable.MIN_GARBAGE_ROWS):
+        table[round_ % 10] = info(round_ % 10, f"Lần {round_}")
+
+    assert table._num_rows <= 10 + MetadataTable.MIN_GARBAGE_ROWS
+    assert table.get(3) == info(3, f"Lần {5 * MetadataTable.MIN_GARBAGE_ROWS - 7}")
+    assert len(table) == 10
+
+
+def test_writes_to_mmap_table_copy_before_writing(tmp_path):
+    MetadataTable.from_mapping({i: info(i) for i in range(10)}).save(str(tmp_path))
+    before = file_bytes(str(tmp_path))
+
+    table = MetadataTable.load(str(tmp_path), mmap=True)
+    table[2] = info(2, "Ghi đè")
+    table[10] = info(10)
+    table.pop(4)
+
+    assert file_bytes(str(tmp_path)) == before
+    assert table.get(2) == info(2, "Ghi đè")
+    assert table.get(10) == info(10)
+    assert 4 not in table
+    assert MetadataTable.load(str(tmp_path)).to_mapping() == {i: info(i) for i in range(10)}
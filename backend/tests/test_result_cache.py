@@ -0,0 +1,41 @@
+import numpy as np
+
+from faces_recognition.result_cache import QueryResultCache
+
+
+def test_near_query_hits_and_far_query_misses():
+    cache = QueryResultCache(capacity=10, epsilon=0.06, ttl=60)
+    vector = np.full(128, 0.5, dtype=np.float32)
+    cache.put(vector, "p", {"status": "found"}, cache.generation)
+
+    assert cache.get(vector + 0.001, "p") == {"status": "found"}
+    assert cache.get(vector + 0.1, "p") is None
+    assert cache.get(vector, "other params") is None
+
+
+def test_invalidate_drops_entries_and_rejects_stale_puts():
+    cache = QueryResultCache(capacity=10, epsilon=0.06, ttl=60)
+    vector = np.zeros(128, dtype=np.float32)
+    generation = cache.generation
+    cache.put(vector, "p", "old", generation)
+
+    cache.invalidate()
+    assert cache.get(vector, "p") is None
+    # Kết quả tính trước khi invalidate không được ghi lại vào cache
+    cache.put(vector, "p", "stale", generation)
+    assert cache.get(vector, "p") is None
+    cache.put(vector, "p", "new", cache.generation)
+    assert cache.get(vector, "p") == "new"
+
+
+def test_engine_invalidates_cache_on_enroll_and_delete(collection, make_engine):
+    from conftest import random_vectors, seed_people
+    seed_people(collection, 10)
+    engine = make_engine()
+    vector = random_vectors(1, seed=99)[0]
+
+    assert engine.search_face(vector)["status"] == "unknown"
+    engine.enroll(vector, "C1", "Cached")
+    assert engine.search_face(vector)["info"]["MSSV"] == "C1"
+    engine.delete_person("C1")
+    assert engine.search_face(vector)["status"] == "unknown"
@@ -0,0 +1,88 @@
+import threading
+import time
+
+from faces_recognition.rwlock import ReadWriteLock
+
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    inside = threading.Barrier(3, timeout=5)
+
+    def reader():
+        with lock.read_locked():
+            # Cả ba luồng chỉ qua được barrier nếu cùng giữ khoá đọc một lúc
+            inside.wait()
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert not any(t.is_alive() for t in threads)
+
+
+def test_writer_excludes_readers_and_writers():
+    lock = ReadWriteLock()
+    state = {"writers": 0, "readers": 0, "violations": 0}
+    guard = threading.Lock()
+
+    def writer():
+        for _ in range(200):
+            with lock.write_locked():
+                with guard:
+                    state["writers"] += 1
+                    if state["writers"] > 1 or state["readers"] > 0:
+                        state["violations"] += 1
+                time.sleep(0)
+                with guard:
+                    state["writers"] -= 1
+
+    def reader():
+        for _ in range(200):
+            with lock.read_locked():
+                with guard:
+                    state["readers"] += 1
+                    if state["writers"] > 0:
+                        state["violations"] += 1
+                time.sleep(0)
+                with guard:
+                    state["readers"] -= 1
+
+    threads = [threading.Thread(target=writer) for _ in range(2)] + [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    assert state["violations"] == 0
+
+
+def test_writer_is_not_starved_by_readers():
+    lock = ReadWriteLock()
+    stop = threading.Event()
+
+    def reader():
+        # Các luồng đọc nối đuôi nhau liên tục: luôn có ít nhất một luồng đang giữ khoá
+        while not stop.is_set():
+            with lock.read_locked():
+                time.sleep(0.001)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for t in readers:
+        t.start()
+    time.sleep(0.05)
+
+    acquired = threading.Event()
+
+    def writer():
+        with lock.write_locked():
+            acquired.set()
+
+    w = threading.Thread(target=writer)
+    w.start()
+    try:
+        assert acquired.wait(2), "luồng ghi bị đói khi luồng đọc liên tục"
+    finally:
+        stop.set()
+        w.join(5)
+        for t in readers:
+            t.join(5)
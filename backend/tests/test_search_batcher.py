@@ -0,0 +1,102 @@
+import threading
+import time
+
+import numpy as np
+
+from faces_recognition.search_batcher import SearchBatcher
+
+
+class FakeIndex:
+    """search_fn giả: nhãn = id (cột 0 của vector) * 10 + thứ hạng; chặn tới khi release."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def search(self, query, k, num_threads):
+        self.calls.append((len(query), k))
+        assert self.release.wait(5)
+        ids = query[:, 0].astype(np.int64)
+        labels = ids[:, None] * 10 + np.arange(k)
+        return labels, labels.astype(np.float32)
+
+
+def vectors(*ids):
+    data = np.zeros((len(ids), 4), dtype=np.float32)
+    data[:, 0] = ids
+    return data
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def start(batcher, results, key, vecs, k):
+    thread = threading.Thread(target=lambda: results.__setitem__(key, batcher.search(vecs, k)))
+    thread.start()
+    return thread
+
+
+def test_lone_request_does_not_wait_for_window():
+    index = FakeIndex()
+    index.release.set()
+    batcher = SearchBatcher(index.search, window_ms=10000, max_batch=8, num_threads=1)
+
+    began = time.monotonic()
+    labels, _ = batcher.search(vectors(3), 2)
+    assert time.monotonic() - began < 1
+    assert labels.tolist() == [[30, 31]]
+
+
+def test_mixed_k_results_map_back_to_each_request():
+    index = FakeIndex()
+    batcher = SearchBatcher(index.search, window_ms=10000, max_batch=3, num_threads=1)
+    results = {}
+
+    # Lô đầu giữ index bận để hai request sau được gộp chung
+    threads = [start(batcher, results, "first", vectors(0), 1)]
+    wait_until(lambda: len(index.calls) == 1)
+    threads.append(start(batcher, results, "small", vectors(1), 1))
+    wait_until(lambda: batcher._pending_count == 1)
+    threads.append(start(batcher, results, "large", vectors(2, 3), 3))
+    wait_until(lambda: len(index.calls) == 2)
+    index.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert index.calls[1] == (3, 3)
+    labels, distances = results["small"]
+    assert labels.tolist() == [[10]]
+    assert distances.shape == (1, 1)
+    labels, _ = results["large"]
+    assert labels.tolist() == [[20, 21, 22], [30, 31, 32]]
+    assert batcher.stats()["requests"] == 3
+
+
+def test_leftover_request_leads_the_next_batch():
+    index = FakeIndex()
+    batcher = SearchBatcher(index.search, window_ms=10000, max_batch=3, num_threads=1)
+    results = {}
+
+    threads = [start(batcher, results, "first", vectors(0), 1)]
+    wait_until(lambda: len(index.calls) == 1)
+    threads.append(start(batcher, results, "second", vectors(1, 2), 1))
+    wait_until(lambda: batcher._pending_count == 2)
+    # Không vừa lô của "second" (2 + 2 > max_batch): được giao làm leader lô sau,
+    # chờ trong khi hai lô kia chạy rồi tìm ngay khi chúng xong
+    threads.append(start(batcher, results, "leftover", vectors(3, 4), 2))
+    wait_until(lambda: len(index.calls) == 2 and batcher._pending[0].lead)
+
+    began = time.monotonic()
+    index.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert time.monotonic() - began < 1
+
+    assert index.calls == [(1, 1), (2, 1), (2, 2)]
+    assert results["second"][0].tolist() == [[10], [20]]
+    assert results["leftover"][0].tolist() == [[30, 31], [40, 41]]
+    assert batcher._pending_count == 0 and not batcher._has_leader
@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import random_vectors, seed_people
+from faces_recognition.index_snapshot import IndexSnapshot
+
+
+def test_snapshot_round_trip_with_delta_replay(collection, make_engine):
+    vectors = seed_people(collection, 30)
+    first = make_engine()
+    assert first.snapshot.exists()
+
+    # Thay đổi sau snapshot: một người mới
+    new_vector = random_vectors(1, seed=7)[0]
+    collection.insert_one({"MSSV": "NEW", "Ten": "Moi", "feature_vector": new_vector.tolist()})
+
+    second = make_engine()
+    assert second.search_system.get_size() == 31
+    assert second.search_face(new_vector)["info"]["MSSV"] == "NEW"
+    for i in (0, 10, 29):
+        assert second.search_face(vectors[i])["info"]["MSSV"] == f"S{i}"
+
+    # Lần khởi động thứ ba nạp snapshot đã gồm các thay đổi, không còn gì để replay
+    third = make_engine()
+    assert third.search_system.get_size() == 31
+    assert third.search_face(new_vector)["info"]["MSSV"] == "NEW"
+
+
+def test_warm_start_replays_deletions_when_count_is_unchanged(collection, make_engine):
+    vectors = seed_people(collection, 20)
+    make_engine()
+
+    # Xoá 3 người và thêm 3 người mới: số document không đổi
+    collection.delete_many({"MSSV": {"$in": ["S1", "S2", "S3"]}})
+    added = seed_people(collection, 3, start=100, seed=11)
+
+    engine = make_engine()
+    assert engine.search_system.get_live_count() == 20
+    for i in (1, 2, 3):
+        assert engine.search_face(vectors[i])["status"] == "unknown"
+    for i, vec in enumerate(added):
+        assert engine.search_face(vec)["info"]["MSSV"] == f"S{100 + i}"
+    assert engine.fingerprint["count"] == 20
+
+    # Snapshot mới đã gồm việc xoá: khởi động lại vẫn không thấy người đã xoá
+    again = make_engine()
+    assert again.search_face(vectors[2])["status"] == "unknown"
+    assert again.search_system.get_live_count() == 20
+
+
+def test_warm_start_replays_updates_when_snapshot_had_no_updated_at(collection, make_engine):
+    vectors = seed_people(collection, 10)
+    make_engine()
+
+    moved = random_vectors(1, seed=8)[0]
+    collection.update_one({"MSSV": "S3"}, {"$set": {"feature_vector": moved.tolist(),
+                                                    "updated_at": datetime.now(timezone.utc)}})
+
+    engine = make_engine()
+    assert engine.search_face(moved)["info"]["MSSV"] == "S3"
+    assert engine.search_face(vectors[3])["status"] == "unknown"
+    assert engine.fingerprint["max_updated_at"] is not None
+
+
+def snapshot_entries(engine):
+    return sorted(name for name in os.listdir(engine.snapshot.directory)
+                  if name.startswith((IndexSnapshot.SET_PREFIX, IndexSnapshot.TMP_PREFIX)))
+
+
+def test_interrupted_save_keeps_the_previous_set(collection, make_engine, monkeypatch):
+    vectors = seed_people(collection, 10)
+    engine = make_engine()
+    before = engine.snapshot.current_set()
+    engine.enroll(random_vectors(1, seed=5)[0], "LATE", "Late")
+
+    # Metadata / ma trận vector của lần lưu mới đã ghi xong, index thì chưa
+    def crash(path):
+        raise OSError("disk full")
+    monkeypatch.setattr(engine.search_system, "save_index", crash)
+    with pytest.raises(OSError):
+        engine.save_snapshot()
+
+    assert engine.snapshot.current_set() == before
+    assert snapshot_entries(engine) == [os.path.basename(before)]
+    served = make_engine(read_only=True)
+    assert served.search_system.get_size() == 10
+    assert served.search_face(vectors[3])["info"]["MSSV"] == "S3"
+
+
+def test_save_switches_to_a_new_set_and_prunes_the_old_one(collection, make_engine):
+    seed_people(collection, 5)
+    engine = make_engine()
+    before = engine.snapshot.current_set()
+    engine.save_snapshot()
+
+    after = engine.snapshot.current_set()
+    assert after != before
+    assert snapshot_entries(engine) == [os.path.basename(after)]
+
+
+def _child_acquires_writer(directory, results):
+    results.put(IndexSnapshot(directory).acquire_writer())
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="cần fork")
+def test_only_one_process_holds_the_snapshot_writer(tmp_path):
+    directory = str(tmp_path / "snapshot")
+    snapshot = IndexSnapshot(directory)
+    ctx = multiprocessing.get_context("fork")
+
+    def child_acquires():
+        results = ctx.Queue()
+        worker = ctx.Process(target=_child_acquires_writer, args=(directory, results))
+        worker.start()
+        worker.join(10)
+        return results.get(timeout=5)
+
+    assert snapshot.acquire_writer()
+    assert snapshot.acquire_writer()
+    assert child_acquires() is False
+    # Giống master gunicorn trả quyền ghi trước khi fork worker
+    snapshot.release_writer()
+    assert child_acquires() is True
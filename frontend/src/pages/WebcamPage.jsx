@@ -1,8 +1,39 @@
 // src/pages/WebcamPage.jsx
 import React, { useEffect, useRef, useState } from "react";
-import { recognizeFrame } from "../services/api";
+import { recognizeFrame, getSearchMode } from "../services/api";
+import { initWebSocket } from "../services/websocket";
 import FaceBox from "../components/FaceBox";
 
+// WebSocket: chụp frame mỗi 150ms, backend tự bỏ frame cũ nếu xử lý không kịp
+const WS_FRAME_INTERVAL_MS = 150;
+// Fallback HTTP khi không mở được WebSocket
+const HTTP_FRAME_INTERVAL_MS = 800;
+
+// Chuẩn hoá dữ liệu trả về từ API / WebSocket
+function normalizeFaces(res) {
+  let rawFaces = [];
+  if (Array.isArray(res?.faces)) {
+    rawFaces = res.faces;
+  } else if (res && (res.box || res.info || res.status)) {
+    rawFaces = [res];
+  }
+
+  return rawFaces.map((face) => {
+      const info = face.info || {};
+      // Ưu tiên ảnh crop từ backend trả về để đỡ tốn sức frontend
+      const imgSrc = face.crop_image || face.imgSrc || "https://placehold.co/100x100?text=No+Image";
+
+      return {
+        ...face,
+        mssv: face.student_id || info.MSSV || "Unknown",
+        name: face.name || info.Ten || "Unknown",
+        distance: face.distance || 0,
+        imgSrc: imgSrc,
+        box: face.box // [top, right, bottom, left]
+      };
+  });
+}
+
 const WebcamPage = () => {
   const videoRef = useRef(null);
   const overlayRef = useRef(null); // Canvas phủ lên để vẽ khung
@@ -40,17 +71,39 @@ const WebcamPage = () => {
     };
   }, []);
 
-  // 2. Vòng lặp gửi API (Xử lý ngầm, không ảnh hưởng hiển thị)
+  // 2. Vòng lặp gửi frame (Xử lý ngầm, không ảnh hưởng hiển thị)
+  //    Ưu tiên WebSocket (gửi bytes JPEG, không base64); mất kết nối thì initWebSocket tự
+  //    mở lại (backoff), trong lúc chờ mở lại thì gửi frame qua HTTP
   useEffect(() => {
     if (!running) return;
 
-    const interval = setInterval(captureAndSendFrame, 800);
-    return () => clearInterval(interval);
+    const ws = initWebSocket(
+      (res) => {
+        // Frame lỗi / bị bỏ -> giữ nguyên kết quả cũ
+        if (res.error) return;
+        setResults(normalizeFaces(res));
+      },
+      { mode: getSearchMode() }
+    );
+    let lastHttpSend = 0;
+
+    const interval = setInterval(captureAndSendFrame, WS_FRAME_INTERVAL_MS);
+    return () => {
+      clearInterval(interval);
+      ws.close();
+    };
 
     async function captureAndSendFrame() {
       const video = videoRef.current;
       // Chỉ chụp khi video đã sẵn sàng và có kích thước
       if (!video || video.readyState !== 4 || video.videoWidth === 0) return;
+      if (ws.readyState === WebSocket.CONNECTING) return;
+
+      // Frame trước chưa gửi xong thì bỏ qua lượt này
+      if (ws.readyState === WebSocket.OPEN && ws.bufferedAmount > 0) return;
+
+      const now = Date.now();
+      if (ws.readyState !== WebSocket.OPEN && now - lastHttpSend < HTTP_FRAME_INTERVAL_MS) return;
 
       // Tạo canvas ảo để chụp frame gửi đi
       const offscreenCanvas = document.createElement("canvas");
@@ -61,36 +114,32 @@ const WebcamPage = () => {
       // Vẽ frame gốc vào canvas ảo
       ctx.drawImage(video, 0, 0);
 
-      // Nén ảnh JPEG 0.7
-      const base64Image = offscreenCanvas.toDataURL("image/jpeg", 0.7);
+      if (ws.readyState === WebSocket.OPEN) {
+        // Nén ảnh JPEG 0.7, gửi thẳng bytes qua WebSocket
+        // (kết nối đóng giữa chừng thì frame được gửi lại khi kết nối mới mở)
+        offscreenCanvas.toBlob(
+          (blob) => {
+            if (blob) ws.send(blob);
+          },
+          "image/jpeg",
+          0.7
+        );
+        return;
+      }
 
-      try {
-        const res = await recognizeFrame(base64Image);
-
-        // Chuẩn hoá dữ liệu trả về từ API
-        let rawFaces = [];
-        if (Array.isArray(res?.faces)) {
-          rawFaces = res.faces;
-        } else if (res && (res.box || res.info || res.status)) {
-          rawFaces = [res];
-        }
+      // Fallback HTTP: nén ảnh JPEG 0.7, gửi bytes JPEG trong body
+      lastHttpSend = now;
+      const jpegBlob = await new Promise((resolve) =>
+        offscreenCanvas.toBlob(resolve, "image/jpeg", 0.7)
+      );
+      if (!jpegBlob) return;
 
-        const processedFaces = rawFaces.map((face) => {
-            const info = face.info || {};
-            // Ưu tiên ảnh crop từ backend trả về để đỡ tốn sức frontend
-            const imgSrc = face.crop_image || face.imgSrc || "https://placehold.co/100x100?text=No+Image";
-
-            return {
-              ...face,
-              mssv: face.student_id || info.MSSV || "Unknown",
-              name: face.name || info.Ten || "Unknown",
-              distance: face.distance || 0,
-              imgSrc: imgSrc,
-              box: face.box // [top, right, bottom, left]
-            };
-        });
+      try {
+        const res = await recognizeFrame(jpegBlob);
+        // Frame bị backend bỏ (đang bận) -> giữ nguyên kết quả cũ
+        if (res === null) return;
 
-        setResults(processedFaces);
+        setResults(normalizeFaces(res));
       } catch (err) {
         console.error("API Error:", err);
       }
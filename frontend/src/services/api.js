@@ -2,7 +2,12 @@
 // get from .env file
 const API_BASE = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000";
 
-function getSearchMode() {
+// Mỗi tab một phiên tracking: backend dùng lại danh tính của khuôn mặt đứng yên giữa các frame
+const SESSION_ID =
+  (window.crypto && window.crypto.randomUUID && window.crypto.randomUUID()) ||
+  Math.random().toString(36).slice(2);
+
+export function getSearchMode() {
   const mode = window.localStorage.getItem("searchMode");
   // fallback mặc định là HNSW
   return mode === "bruteforce" ? "bruteforce" : "hnsw";
@@ -25,19 +30,24 @@ export async function recognizeImage(formData) {
   return data;
 }
 
-export async function recognizeFrame(base64Image) {
+export async function recognizeFrame(frame) {
   const mode = getSearchMode();
 
-  const payload = { image: base64Image };
-
-  const res = await fetch(`${API_BASE}/recognize_frame?mode=${mode}`, {
+  // Blob JPEG -> gửi thẳng bytes (không base64); chuỗi base64 -> JSON như cũ
+  const isBlob = frame instanceof Blob;
+  const res = await fetch(`${API_BASE}/recognize_frame?mode=${mode}&crops=base64&session=${SESSION_ID}`, {
     method: "POST",
     headers: {
-      "Content-Type": "application/json",
+      "Content-Type": isBlob ? "image/jpeg" : "application/json",
     },
-    body: JSON.stringify(payload),
+    body: isBlob ? frame : JSON.stringify({ image: frame }),
   });
 
+  // 503: backend đang bận nên bỏ frame này, frame kế tiếp sẽ được gửi lại
+  if (res.status === 503) {
+    return null;
+  }
+
   if (!res.ok) {
     throw new Error("Webcam API error");
   }
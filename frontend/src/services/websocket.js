@@ -1,18 +1,76 @@
 // src/services/websocket.js
 // get from .env file
-const WS_BASE = process.env.BACKEND_WS_URL || "ws://localhost:8000";
+const API_BASE = import.meta.env.VITE_BACKEND_URL || "http://localhost:8000";
+// Mặc định suy ra từ VITE_BACKEND_URL (http -> ws, https -> wss)
+const WS_BASE = import.meta.env.VITE_BACKEND_WS_URL || API_BASE.replace(/^http/, "ws");
+// Mất kết nối thì mở lại sau 500ms, gấp đôi sau mỗi lần thất bại liên tiếp (tối đa 10s)
+const WS_RECONNECT_BASE_MS = 500;
+const WS_RECONNECT_MAX_MS = 10000;
 
-export function initWebSocket(onMessage) {
-    // Use secure websocket for the deployed backend
-    const ws = new WebSocket(`${WS_BASE}/ws_recognize_frame`);
+// Kết nối WebSocket tự mở lại khi bị đóng / lỗi (backoff luỹ thừa).
+// Trả về object có readyState, bufferedAmount, send(frame), close() như WebSocket;
+// frame đã gửi mà chưa có kết quả được gửi lại ngay khi kết nối mới mở.
+export function initWebSocket(onMessage, { mode = "hnsw", onOpen, onClose } = {}) {
+    let ws = null;
+    let attempt = 0;
+    let retryTimer = null;
+    // close() do trang gọi -> không mở lại nữa
+    let stopped = false;
+    // Frame gần nhất đã gửi (hoặc định gửi) mà chưa nhận được kết quả
+    let pending = null;
 
-    ws.onopen = () => console.log("WebSocket connected");
-    ws.onmessage = (evt) => {
-        const data = JSON.parse(evt.data);
-        onMessage(data);
-    };
-    ws.onerror = (err) => console.error("WS error:", err);
-    ws.onclose = () => console.log("WebSocket closed");
+    function connect() {
+        // Use secure websocket for the deployed backend
+        ws = new WebSocket(`${WS_BASE}/ws_recognize_frame?mode=${mode}`);
+        ws.binaryType = "arraybuffer";
+
+        ws.onopen = () => {
+            console.log("WebSocket connected");
+            attempt = 0;
+            if (pending) ws.send(pending);
+            if (onOpen) onOpen();
+        };
+        ws.onmessage = (evt) => {
+            pending = null;
+            const data = JSON.parse(evt.data);
+            onMessage(data);
+        };
+        // Trình duyệt luôn gọi onclose sau onerror: việc mở lại nằm ở onclose
+        ws.onerror = (err) => console.error("WS error:", err);
+        ws.onclose = () => {
+            console.log("WebSocket closed");
+            if (onClose) onClose();
+            if (!stopped) scheduleReconnect();
+        };
+    }
+
+    function scheduleReconnect() {
+        const delay = Math.min(WS_RECONNECT_BASE_MS * 2 ** attempt, WS_RECONNECT_MAX_MS);
+        attempt += 1;
+        console.log(`WebSocket reconnecting in ${delay}ms`);
+        retryTimer = setTimeout(() => {
+            retryTimer = null;
+            connect();
+        }, delay);
+    }
 
-    return ws;
+    connect();
+
+    return {
+        get readyState() {
+            return ws.readyState;
+        },
+        get bufferedAmount() {
+            return ws.bufferedAmount;
+        },
+        send(frame) {
+            pending = frame;
+            if (ws.readyState === WebSocket.OPEN) ws.send(frame);
+        },
+        close() {
+            stopped = true;
+            clearTimeout(retryTimer);
+            ws.close();
+        },
+    };
 }